@@ -0,0 +1,213 @@
+"""
+Packed snapshot of the issue cache, memory mapped for a fast cold start
+
+The file consists of
+- a header (see *HEADER*) with the store generation the snapshot represents
+- an index with the position, checksum and store token of every issue
+- the summaries of all issues as a single JSON document
+- the serialized issues
+"""
+
+import contextlib
+import logging
+import mmap
+import struct
+import zlib
+from collections.abc import Iterable, Mapping
+from pathlib import Path
+from typing import Any, Final, NamedTuple, Self
+
+import orjson as json
+
+from .cache_stores import CacheToken, Generation
+from .models import IssueID
+
+MAGIC: Final[bytes] = b"GLPIBSNP"
+FORMAT_VERSION: Final[int] = 3
+#: magic, format version, issue count, token size, generation size,
+#: summaries length, checksum of index and summaries, generation
+HEADER: Final = struct.Struct("<8sIIIIII4q")
+#: issue id, offset, length, checksum, token
+INDEX_ENTRY: Final = struct.Struct("<qQII3q")
+MAX_GENERATION_SIZE: Final[int] = 4
+TOKEN_SIZE: Final[int] = 3
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotRecord(NamedTuple):
+    issue_id: IssueID
+    token: CacheToken
+    #: JSON serializable summary of the issue
+    summary: Any
+    content: bytes
+
+
+class _IndexEntry(NamedTuple):
+    offset: int
+    length: int
+    checksum: int
+    token: CacheToken
+
+
+class InvalidSnapshotError(ValueError):
+    pass
+
+
+def _pack_token(token: CacheToken) -> tuple[int, int, int]:
+    if isinstance(token, int):
+        return token, 0, 0
+    return token
+
+
+def _unpack_token(values: tuple[int, ...], token_size: int) -> CacheToken:
+    if token_size == 1:
+        return values[0]
+    mtime, ctime, size = values
+    return mtime, ctime, size
+
+
+def pack(records: Iterable[SnapshotRecord], generation: Generation | None) -> bytes:
+    """
+    Create the content of a snapshot file containing *records*
+
+    Only pass *generation* if *records* contain all issues of the store in that
+    generation, otherwise the store is compared on loading.
+    """
+    records = tuple(records)
+    token_sizes = {1 if isinstance(record.token, int) else 3 for record in records}
+    if len(token_sizes) > 1:
+        raise ValueError("All tokens need to be of the same type")
+    if generation is not None and len(generation) > MAX_GENERATION_SIZE:
+        generation = None
+    summaries = json.dumps([record.summary for record in records])
+    offset = HEADER.size + INDEX_ENTRY.size * len(records) + len(summaries)
+    index = bytearray()
+    for record in records:
+        index += INDEX_ENTRY.pack(
+            record.issue_id,
+            offset,
+            len(record.content),
+            zlib.crc32(record.content),
+            *_pack_token(record.token),
+        )
+        offset += len(record.content)
+    generation_values = tuple(generation or ())
+    header = HEADER.pack(
+        MAGIC,
+        FORMAT_VERSION,
+        len(records),
+        token_sizes.pop() if token_sizes else TOKEN_SIZE,
+        len(generation_values),
+        len(summaries),
+        zlib.crc32(index + summaries),
+        *(generation_values + (0,) * (MAX_GENERATION_SIZE - len(generation_values))),
+    )
+    return b"".join((header, index, summaries, *(r.content for r in records)))
+
+
+class Snapshot:
+    """
+    A read only, memory mapped snapshot file
+
+    The serialized issues are only read once requested by *content*.
+    """
+
+    #: generation of the store the snapshot represents or None if unknown
+    generation: Generation | None
+    #: token of every issue in the snapshot
+    tokens: Mapping[IssueID, CacheToken]
+    #: JSON serializable summaries of all issues in the snapshot
+    summaries: Mapping[IssueID, Any]
+
+    def __init__(self, path: Path) -> None:
+        with path.open("rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._read_index()
+        except struct.error as e:
+            self.close()
+            raise InvalidSnapshotError(str(e)) from e
+        except ValueError:
+            self.close()
+            raise
+
+    @classmethod
+    def open(cls, path: Path) -> Self | None:
+        """Open the snapshot at *path*, None if it does not exist or is corrupt."""
+        try:
+            return cls(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring invalid snapshot '{path}': {e}")
+            return None
+
+    def _read_index(self) -> None:
+        data = self._mmap
+        if len(data) < HEADER.size:
+            raise InvalidSnapshotError("File too small")
+        (
+            magic,
+            version,
+            count,
+            token_size,
+            generation_size,
+            summaries_length,
+            checksum,
+            *generation,
+        ) = HEADER.unpack_from(data)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise InvalidSnapshotError("Unknown format")
+        summaries_start = HEADER.size + INDEX_ENTRY.size * count
+        records_start = summaries_start + summaries_length
+        if records_start > len(data):
+            raise InvalidSnapshotError("File truncated")
+        if zlib.crc32(data[HEADER.size : records_start]) != checksum:
+            raise InvalidSnapshotError("Checksum mismatch")
+        self.generation = tuple(generation[:generation_size]) or None
+        self._index: dict[IssueID, _IndexEntry] = {}
+        for (
+            issue_id,
+            offset,
+            length,
+            record_checksum,
+            *token,
+        ) in INDEX_ENTRY.iter_unpack(data[HEADER.size : summaries_start]):
+            if offset + length > len(data):
+                raise InvalidSnapshotError("File truncated")
+            self._index[IssueID(issue_id)] = _IndexEntry(
+                offset, length, record_checksum, _unpack_token(tuple(token), token_size)
+            )
+        self.tokens = {issue_id: entry.token for issue_id, entry in self._index.items()}
+        self.summaries = dict(
+            zip(
+                self._index,
+                json.loads(data[summaries_start:records_start]),
+                strict=True,
+            )
+        )
+
+    def content(self, issue_id: IssueID) -> bytes | None:
+        """
+        Return the serialized issue or None if it is not part of the snapshot,
+        corrupt or the snapshot was closed.
+        """
+        entry = self._index.get(issue_id)
+        if entry is None:
+            return None
+        try:
+            content = self._mmap[entry.offset : entry.offset + entry.length]
+        except ValueError:  # closed
+            return None
+        if zlib.crc32(content) != entry.checksum:
+            logger.warning(f"Ignoring corrupt issue {issue_id} in snapshot")
+            return None
+        return content
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def close(self) -> None:
+        with contextlib.suppress(BufferError):
+            self._mmap.close()
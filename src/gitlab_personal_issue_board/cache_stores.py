@@ -0,0 +1,545 @@
+"""
+Storage backends used by *caching.IssueCacheDict* to keep issues on disk
+"""
+
+import contextlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Collection, Iterable, Iterator, Mapping
+from pathlib import Path
+from typing import Final, NamedTuple, Protocol
+
+import orjson as json
+
+from . import settings
+from .file_lock import FileLock
+from .models import IssueID
+
+type Mtime = int
+type Ctime = int
+type FileSize = int
+type FileCacheInfo = tuple[Mtime, Ctime, FileSize]
+type RowVersion = int
+#: Store specific token that changes every time the stored issue changes
+type CacheToken = FileCacheInfo | RowVersion
+#: Store specific token that changes every time anything in the store changes
+type Generation = tuple[int, ...]
+
+
+logger = logging.getLogger(__name__)
+
+
+class StoredIssue(NamedTuple):
+    issue_id: IssueID
+    token: CacheToken
+    content: bytes
+
+
+class IssueRecord(NamedTuple):
+    """An issue to be stored"""
+
+    #: the serialized *models.Issue*
+    content: bytes
+    #: optional compressed attributes as received from gitlab (for debugging)
+    raw: bytes | None = None
+
+
+class IssueStore(Protocol):
+    """
+    Persistence of the serialized issues used by *caching.IssueCacheDict*
+    """
+
+    def load_all(
+        self, project_ids: Collection[int] | None = None
+    ) -> Iterator[StoredIssue]:
+        """Load all stored issues, only of the given projects if *project_ids*."""
+        ...
+
+    def load(self, issue_id: IssueID) -> StoredIssue | None:
+        """Load the given issue or return None if it isn't stored."""
+        ...
+
+    def tokens(
+        self, project_ids: Collection[int] | None = None
+    ) -> dict[IssueID, CacheToken]:
+        """
+        Return the current tokens of all stored issues, only of the given projects if
+        *project_ids*.
+        """
+        ...
+
+    def label_project_ids(self, label_names: Collection[str]) -> frozenset[int]:
+        """Return the ids of all projects with issues having any of *label_names*."""
+        ...
+
+    def generation(self) -> Generation:
+        """
+        Return the generation of the store, it changes whenever the store changes.
+
+        This check is cheap, so it can be used to detect changes of other processes
+        before comparing all *tokens*.
+        """
+        ...
+
+    def load_raw(self, issue_id: IssueID) -> bytes | None:
+        """Load the compressed raw attributes stored with the issue, if any."""
+        ...
+
+    def write(
+        self, records: Mapping[IssueID, IssueRecord]
+    ) -> dict[IssueID, CacheToken]:
+        """Store all *records* at once and return their new tokens."""
+        ...
+
+    def delete(self, issue_ids: Iterable[IssueID]) -> None:
+        """Remove the given issues, ignoring issues that aren't stored."""
+        ...
+
+    def clear(self) -> None:
+        """Remove all stored issues."""
+        ...
+
+
+def _project_id(content: bytes) -> int | None:
+    try:
+        return int(json.loads(content)["project_id"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def _label_names(content: bytes) -> set[str]:
+    try:
+        return {label["name"] for label in json.loads(content)["labels"]}
+    except (ValueError, KeyError, TypeError):
+        return set()
+
+
+def get_file_cache_info(file: Path) -> FileCacheInfo:
+    stat = file.stat()
+    return stat.st_mtime_ns, stat.st_ctime_ns, stat.st_size
+
+
+def atomic_write(file: Path, content: bytes) -> None:
+    """
+    Write *content* to *file* using a temporary file that replaces *file*.
+
+    So *file* is never seen half written, even if the process crashes.
+    """
+    tmp_file = file.with_name(f"{file.name}.{os.getpid()}.tmp")
+    with tmp_file.open("wb") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    tmp_file.replace(file)
+
+
+class JsonFileStore:
+    """
+    Store every issue as a separate JSON file inside *folder*
+
+    Files are written atomically (see *atomic_write*), changes of multiple processes
+    are serialised by the *lock_file*.
+    Filtering by project requires reading all files, the project and label names
+    of every issue are kept in the *labels_file* to find the projects of labels.
+    Every change rewrites the *generation_file*. Replacing it also changes the
+    modification time of the folder, which is changed as well if files are
+    added or removed by other processes.
+    """
+
+    file_name: Final[str] = "issue_{issue_id}.json"
+    raw_file_name: Final[str] = "raw_{issue_id}.json.zlib"
+    generation_file: Final[str] = "generation"
+    labels_file: Final[str] = "labels.json"
+    lock_file: Final[str] = "lock"
+
+    def __init__(self, folder: Path) -> None:
+        self.folder = folder
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self._lock = FileLock(self.folder / self.lock_file)
+
+    def _file(self, issue_id: IssueID) -> Path:
+        return self.folder / self.file_name.format(issue_id=issue_id)
+
+    def _raw_file(self, issue_id: IssueID) -> Path:
+        return self.folder / self.raw_file_name.format(issue_id=issue_id)
+
+    def _files(self) -> Iterator[Path]:
+        return self.folder.glob(self.file_name.format(issue_id="*"))
+
+    @staticmethod
+    def _issue_id(file: Path | os.DirEntry[str]) -> IssueID:
+        return IssueID(int(file.name.removeprefix("issue_").removesuffix(".json")))
+
+    def _bump_generation(self) -> None:
+        atomic_write(self.folder / self.generation_file, str(time.time_ns()).encode())
+
+    def generation(self) -> Generation:
+        try:
+            counter = int((self.folder / self.generation_file).read_text())
+        except (FileNotFoundError, ValueError):
+            counter = 0
+        return self.folder.stat().st_mtime_ns, counter
+
+    def load_all(
+        self, project_ids: Collection[int] | None = None
+    ) -> Iterator[StoredIssue]:
+        for file in self._files():
+            stored = StoredIssue(
+                self._issue_id(file), get_file_cache_info(file), file.read_bytes()
+            )
+            if project_ids is None or _project_id(stored.content) in project_ids:
+                yield stored
+
+    def load(self, issue_id: IssueID) -> StoredIssue | None:
+        file = self._file(issue_id)
+        try:
+            return StoredIssue(issue_id, get_file_cache_info(file), file.read_bytes())
+        except FileNotFoundError:
+            return None
+
+    def load_raw(self, issue_id: IssueID) -> bytes | None:
+        try:
+            return self._raw_file(issue_id).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def tokens(
+        self, project_ids: Collection[int] | None = None
+    ) -> dict[IssueID, CacheToken]:
+        if project_ids is not None:
+            return {
+                stored.issue_id: stored.token for stored in self.load_all(project_ids)
+            }
+        tokens: dict[IssueID, CacheToken] = {}
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.name.startswith("issue_") and entry.name.endswith(".json"):
+                    with contextlib.suppress(FileNotFoundError):
+                        stat = entry.stat()
+                        tokens[self._issue_id(entry)] = (
+                            stat.st_mtime_ns,
+                            stat.st_ctime_ns,
+                            stat.st_size,
+                        )
+        return tokens
+
+    def _read_labels(self) -> dict[str, tuple[int | None, list[str]]] | None:
+        """Read project id and label names by issue id, None if not written yet."""
+        try:
+            labels: dict[str, tuple[int | None, list[str]]] = json.loads(
+                (self.folder / self.labels_file).read_bytes()
+            )
+        except (FileNotFoundError, ValueError):
+            return None
+        return labels
+
+    def _write_labels(
+        self,
+        changed: Iterable[tuple[IssueID, bytes]] = (),
+        deleted: Iterable[IssueID] = (),
+    ) -> dict[str, tuple[int | None, list[str]]]:
+        """Update the *labels_file* for the changed and deleted issues (locked)."""
+        labels = self._read_labels()
+        if labels is None:
+            # read all files, which already contain the changes
+            changed = (
+                (self._issue_id(file), file.read_bytes()) for file in self._files()
+            )
+            labels = {}
+        for issue_id, content in changed:
+            labels[str(issue_id)] = (
+                _project_id(content),
+                sorted(_label_names(content)),
+            )
+        for issue_id in deleted:
+            labels.pop(str(issue_id), None)
+        atomic_write(self.folder / self.labels_file, json.dumps(labels))
+        return labels
+
+    def label_project_ids(self, label_names: Collection[str]) -> frozenset[int]:
+        labels = self._read_labels()
+        if labels is None:
+            with self._lock:
+                labels = self._write_labels()
+        return frozenset(
+            project_id
+            for project_id, issue_labels in labels.values()
+            if project_id is not None and not set(issue_labels).isdisjoint(label_names)
+        )
+
+    def write(
+        self, records: Mapping[IssueID, IssueRecord]
+    ) -> dict[IssueID, CacheToken]:
+        tokens: dict[IssueID, CacheToken] = {}
+        with self._lock:
+            for issue_id, record in records.items():
+                if record.raw is None:
+                    self._raw_file(issue_id).unlink(missing_ok=True)
+                else:
+                    atomic_write(self._raw_file(issue_id), record.raw)
+                file = self._file(issue_id)
+                atomic_write(file, record.content)
+                tokens[issue_id] = get_file_cache_info(file)
+            if tokens:
+                self._write_labels(
+                    (issue_id, record.content) for issue_id, record in records.items()
+                )
+                self._bump_generation()
+        return tokens
+
+    def delete(self, issue_ids: Iterable[IssueID]) -> None:
+        issue_ids = list(issue_ids)
+        with self._lock:
+            for issue_id in issue_ids:
+                self._file(issue_id).unlink(missing_ok=True)
+                self._raw_file(issue_id).unlink(missing_ok=True)
+            self._write_labels(deleted=issue_ids)
+            self._bump_generation()
+
+    def clear(self) -> None:
+        with self._lock:
+            for file in self._files():
+                file.unlink(missing_ok=True)
+            for file in self.folder.glob(self.raw_file_name.format(issue_id="*")):
+                file.unlink(missing_ok=True)
+            (self.folder / self.labels_file).unlink(missing_ok=True)
+            # left over by crashed processes
+            for file in self.folder.glob("*.tmp"):
+                file.unlink(missing_ok=True)
+            self._bump_generation()
+
+
+class SqliteStore:
+    """
+    Store all issues in a single SQLite database using WAL mode
+
+    Every call to *write* is executed in a single transaction. Each written row gets
+    the generation of its transaction as version, which is used as cache token.
+    Deletions increase the generation as well.
+    The project of an issue is extracted from its content by an indexed generated
+    column, so issues can be loaded by project.
+    The label names of every issue are kept in the indexed *issue_labels* table
+    along with its project, so the projects of labels are found without reading
+    all issues.
+    """
+
+    #: schema migrations, the number of applied ones is kept as `user_version`
+    migrations: Final[tuple[str, ...]] = (
+        """
+        CREATE TABLE IF NOT EXISTS issues (
+            id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL,
+            content BLOB NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        """,
+        "ALTER TABLE issues ADD COLUMN raw BLOB;",
+        """
+        ALTER TABLE issues ADD COLUMN project_id INTEGER
+            AS (json_extract(CAST(content AS TEXT), '$.project_id')) VIRTUAL;
+        CREATE INDEX issues_project_id ON issues(project_id);
+        """,
+        """
+        CREATE TABLE issue_labels (
+            label TEXT NOT NULL,
+            issue_id INTEGER NOT NULL,
+            project_id INTEGER,
+            PRIMARY KEY (label, issue_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX issue_labels_issue_id ON issue_labels(issue_id);
+        INSERT OR IGNORE INTO issue_labels(label, issue_id, project_id)
+            SELECT json_extract(label.value, '$.name'), issues.id, issues.project_id
+            FROM issues, json_each(CAST(issues.content AS TEXT), '$.labels') AS label;
+        """,
+    )
+
+    #: fills *issue_labels* for the issue given as parameter
+    _insert_labels: Final[str] = (
+        "INSERT OR IGNORE INTO issue_labels(label, issue_id, project_id) "
+        "SELECT json_extract(label.value, '$.name'), issues.id, issues.project_id "
+        "FROM issues, json_each(CAST(issues.content AS TEXT), '$.labels') AS label "
+        "WHERE issues.id = ?"
+    )
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        # the connection is shared between the UI event loop and io_bound threads
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._migrate()
+
+    def _migrate(self) -> None:
+        with self._transaction() as connection:
+            (applied,) = connection.execute("PRAGMA user_version").fetchone()
+            for migration in self.migrations[applied:]:
+                for statement in migration.split(";"):
+                    if statement.strip():
+                        connection.execute(statement)
+            connection.execute(f"PRAGMA user_version = {len(self.migrations)}")
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._lock, self._connection:
+            yield self._connection
+
+    def _next_generation(self, connection: sqlite3.Connection) -> int:
+        row = connection.execute(
+            "INSERT INTO meta(key, value) VALUES ('generation', 1) "
+            "ON CONFLICT(key) DO UPDATE SET value = value + 1 "
+            "RETURNING value"
+        ).fetchone()
+        return int(row[0])
+
+    #: condition selecting the projects given as JSON array
+    _in_projects: Final[str] = "project_id IN (SELECT value FROM json_each(?))"
+
+    def load_all(
+        self, project_ids: Collection[int] | None = None
+    ) -> Iterator[StoredIssue]:
+        query = "SELECT id, version, content FROM issues"
+        with self._lock:
+            if project_ids is None:
+                rows = self._connection.execute(query).fetchall()
+            else:
+                rows = self._connection.execute(
+                    f"{query} WHERE {self._in_projects}",
+                    (json.dumps(list(project_ids)).decode(),),
+                ).fetchall()
+        for issue_id, version, content in rows:
+            yield StoredIssue(IssueID(issue_id), version, content)
+
+    def load(self, issue_id: IssueID) -> StoredIssue | None:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT version, content FROM issues WHERE id = ?", (issue_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return StoredIssue(issue_id, row[0], row[1])
+
+    def load_raw(self, issue_id: IssueID) -> bytes | None:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT raw FROM issues WHERE id = ?", (issue_id,)
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def tokens(
+        self, project_ids: Collection[int] | None = None
+    ) -> dict[IssueID, CacheToken]:
+        query = "SELECT id, version FROM issues"
+        with self._lock:
+            if project_ids is None:
+                rows = self._connection.execute(query)
+            else:
+                rows = self._connection.execute(
+                    f"{query} WHERE {self._in_projects}",
+                    (json.dumps(list(project_ids)).decode(),),
+                )
+            return {IssueID(issue_id): version for issue_id, version in rows}
+
+    def label_project_ids(self, label_names: Collection[str]) -> frozenset[int]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT DISTINCT project_id FROM issue_labels "
+                "WHERE label IN (SELECT value FROM json_each(?))",
+                (json.dumps(list(label_names)).decode(),),
+            ).fetchall()
+        return frozenset(project_id for (project_id,) in rows if project_id is not None)
+
+    def generation(self) -> Generation:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM meta WHERE key = 'generation'"
+            ).fetchone()
+        return (0,) if row is None else (int(row[0]),)
+
+    def write(
+        self, records: Mapping[IssueID, IssueRecord]
+    ) -> dict[IssueID, CacheToken]:
+        if not records:
+            return {}
+        with self._transaction() as connection:
+            version = self._next_generation(connection)
+            connection.executemany(
+                "INSERT OR REPLACE INTO issues(id, version, content, raw) "
+                "VALUES (?, ?, ?, ?)",
+                (
+                    (issue_id, version, record.content, record.raw)
+                    for issue_id, record in records.items()
+                ),
+            )
+            connection.executemany(
+                "DELETE FROM issue_labels WHERE issue_id = ?",
+                ((issue_id,) for issue_id in records),
+            )
+            connection.executemany(
+                self._insert_labels, ((issue_id,) for issue_id in records)
+            )
+        return dict.fromkeys(records, version)
+
+    def delete(self, issue_ids: Iterable[IssueID]) -> None:
+        issue_ids = list(issue_ids)
+        with self._transaction() as connection:
+            self._next_generation(connection)
+            connection.executemany(
+                "DELETE FROM issues WHERE id = ?",
+                ((issue_id,) for issue_id in issue_ids),
+            )
+            connection.executemany(
+                "DELETE FROM issue_labels WHERE issue_id = ?",
+                ((issue_id,) for issue_id in issue_ids),
+            )
+
+    def clear(self) -> None:
+        with self._transaction() as connection:
+            self._next_generation(connection)
+            connection.execute("DELETE FROM issues")
+            connection.execute("DELETE FROM issue_labels")
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+def migrate_json_files(folder: Path, target: IssueStore) -> None:
+    """
+    Move all issues stored as JSON files inside *folder* into *target*
+
+    The files are only deleted after they were written to *target*.
+    """
+    if not folder.is_dir():
+        return
+    source = JsonFileStore(folder)
+    records = {
+        stored.issue_id: IssueRecord(stored.content) for stored in source.load_all()
+    }
+    if records:
+        logger.info(f"Migrating {len(records)} cached issues from '{folder}'")
+        target.write(records)
+        source.delete(records)
+    (folder / source.generation_file).unlink(missing_ok=True)
+    (folder / source.labels_file).unlink(missing_ok=True)
+    (folder / source.lock_file).unlink(missing_ok=True)
+    with contextlib.suppress(OSError):
+        folder.rmdir()
+
+
+def open_store() -> IssueStore:
+    """
+    Open the issue store configured in the settings
+    """
+    folder = settings.cache_dir() / "issues"
+    if settings.load_settings().cache.backend == "json":
+        return JsonFileStore(folder)
+    store = SqliteStore(settings.cache_dir() / "issues.sqlite")
+    migrate_json_files(folder, store)
+    return store
@@ -2,175 +2,1042 @@
 Handle caching of Issues retrieved from gitlab
 """
 
+import atexit
+import contextlib
+import functools
+import hashlib
 import logging
-from collections.abc import Callable, Iterable
+import threading
+import types
+import zlib
+from collections import Counter, OrderedDict
+from collections.abc import Callable, Collection, Iterable, Iterator, Mapping
 from datetime import datetime
 from pathlib import Path
-from typing import TYPE_CHECKING, Any, Final, Union
+from typing import TYPE_CHECKING, Any, Final, Literal, NamedTuple, Union
 
+import attrs
 import orjson as json
 from pydantic import ValidationError
 
-from . import settings
-from .models import Issue, IssueID
+from . import cache_snapshot, cache_stores, settings
+from .cache_stores import (
+    CacheToken,
+    Generation,
+    IssueRecord,
+    IssueStore,
+    StoredIssue,
+)
+from .models import InternPool, Issue, IssueID, IssueLike, Label
 
 if TYPE_CHECKING:
     from gitlab.base import RESTObject
 
-type Mtime = int
-type Ctime = int
-type FileSize = int
-type FileCacheInfo = tuple[Mtime, Ctime, FileSize]
-
 
 logger = logging.getLogger(__name__)
 
+#: validation context sharing equal labels and users between all cached issues
+VALIDATION_CONTEXT: Final = {"intern": InternPool()}
+
+
+#: result of *IssueCacheDict.update*, "ignored" for removed issues not cached
+type UpdateOutcome = Literal["new", "changed", "unchanged", "removed", "ignored"]
+
+
+def validate_issue(content: bytes) -> Issue:
+    return Issue.model_validate_json(content, context=VALIDATION_CONTEXT)
+
+
+def fingerprint(content: bytes) -> bytes:
+    """Return a digest identifying the serialized issue *content*."""
+    return hashlib.blake2b(content, digest_size=16).digest()
+
+
+class IssueSummary(NamedTuple):
+    """The cheap to extract fields of an issue needed to sort it into cards"""
+
+    id: IssueID
+    project_id: int
+    iid: int
+    state: Literal["opened", "closed"]
+    label_names: frozenset[str]
+    assignee_usernames: frozenset[str]
+    updated_at: datetime
+
+    @classmethod
+    def from_issue(cls, issue: Issue) -> "IssueSummary":
+        return cls(
+            id=issue.id,
+            project_id=issue.project_id,
+            iid=issue.iid,
+            state=issue.state,
+            label_names=issue.label_names,
+            assignee_usernames=issue.assignee_usernames,
+            updated_at=issue.updated_at,
+        )
+
+    @classmethod
+    def from_content(cls, content: bytes) -> "IssueSummary":
+        """Extract the summary from serialized issue without validating it."""
+        data = json.loads(content)
+        return cls(
+            id=IssueID(data["id"]),
+            project_id=data["project_id"],
+            iid=data["iid"],
+            state=data["state"],
+            label_names=frozenset(label["name"] for label in data["labels"]),
+            assignee_usernames=frozenset(
+                assignee["username"] for assignee in data["assignees"]
+            ),
+            updated_at=datetime.fromisoformat(data["updated_at"]),
+        )
+
+    def to_raw(self) -> tuple[int, int, int, str, list[str], list[str], str]:
+        """Return the summary as JSON serializable tuple."""
+        return (
+            self.id,
+            self.project_id,
+            self.iid,
+            self.state,
+            sorted(self.label_names),
+            sorted(self.assignee_usernames),
+            self.updated_at.isoformat(),
+        )
+
+    @classmethod
+    def from_raw(cls, raw: Any) -> "IssueSummary":
+        """Create the summary from the result of *to_raw*."""
+        (
+            issue_id,
+            project_id,
+            iid,
+            state,
+            label_names,
+            assignee_usernames,
+            updated_at,
+        ) = raw
+        return cls(
+            id=IssueID(issue_id),
+            project_id=project_id,
+            iid=iid,
+            state=state,
+            label_names=frozenset(label_names),
+            assignee_usernames=frozenset(assignee_usernames),
+            updated_at=datetime.fromisoformat(updated_at),
+        )
+
+
+class IssueIndex:
+    """
+    Secondary indexes of issue ids by label name, state and project
+
+    Kept up to date by *IssueCacheDict* for every added or removed issue.
+    The index of a published *CacheVersion* is never changed, changes are
+    applied to a *copy*, which shares all sets of ids not changed since.
+    """
+
+    def __init__(self) -> None:
+        self.by_label: dict[str, set[IssueID]] = {}
+        self.by_state: dict[str, set[IssueID]] = {}
+        self.by_project: dict[int, set[IssueID]] = {}
+        #: sets of ids created by this index, the others are shared with versions
+        self._owned: set[tuple[int, Any]] = set()
+
+    def _keys(
+        self, summary: IssueSummary
+    ) -> Iterator[tuple[dict[Any, set[IssueID]], Any]]:
+        for label_name in summary.label_names:
+            yield self.by_label, label_name
+        yield self.by_state, summary.state
+        yield self.by_project, summary.project_id
+
+    def _own(self, index: dict[Any, set[IssueID]], key: Any) -> set[IssueID]:
+        """Return the ids of *key* to change, copying them if they are shared."""
+        issue_ids = index.get(key)
+        if issue_ids is None or (id(index), key) not in self._owned:
+            issue_ids = index[key] = set() if issue_ids is None else set(issue_ids)
+            self._owned.add((id(index), key))
+        return issue_ids
+
+    def add(self, summary: IssueSummary) -> None:
+        """Index *summary*, the previously indexed version must be discarded."""
+        for index, key in self._keys(summary):
+            self._own(index, key).add(summary.id)
+
+    def discard(self, summary: IssueSummary) -> None:
+        """Remove the issue of *summary* from all indexes."""
+        for index, key in self._keys(summary):
+            if key not in index:
+                continue
+            issue_ids = self._own(index, key)
+            issue_ids.discard(summary.id)
+            if not issue_ids:
+                # only keep keys that are in use, e.g. to list all label names
+                del index[key]
+
+    def copy(self) -> "IssueIndex":
+        result = IssueIndex()
+        result.by_label = dict(self.by_label)
+        result.by_state = dict(self.by_state)
+        result.by_project = dict(self.by_project)
+        return result
+
+
+@attrs.define
+class CacheEntry:
+    """
+    An issue held by *IssueCacheDict*
+
+    The *Issue* is only validated from *content* once it is accessed.
+    The *content* is either kept in memory or read using the *loader* on access.
+    """
+
+    token: CacheToken | None
+    summary: IssueSummary
+    _content: bytes | None = None
+    _issue: Issue | None = None
+    _loader: Callable[[], bytes] | None = None
+    #: size of the content the *_issue* was validated from
+    _size: int = 0
+    _fingerprint: bytes | None = None
+
+    @classmethod
+    def from_stored(cls, stored: StoredIssue, lazy: bool) -> "CacheEntry":
+        if lazy:
+            summary = IssueSummary.from_content(stored.content)
+            return cls(stored.token, summary, stored.content)
+        issue = validate_issue(stored.content)
+        return cls(stored.token, IssueSummary.from_issue(issue), stored.content, issue)
+
+    @property
+    def content(self) -> bytes:
+        # read the attributes once, as the entry could be evicted concurrently
+        content = self._content
+        if content is not None:
+            return content
+        loader = self._loader
+        assert loader is not None, "Cache entry without content"
+        return loader()
+
+    @property
+    def issue(self) -> Issue:
+        issue = self._issue
+        if issue is None:
+            content = self.content
+            self._size = len(content)
+            issue = self._issue = validate_issue(content)
+        return issue
+
+    @property
+    def fingerprint(self) -> bytes:
+        """Digest of the *content*, calculated on first access."""
+        if self._fingerprint is None:
+            self._fingerprint = fingerprint(self.content)
+        return self._fingerprint
+
+    @property
+    def resident_bytes(self) -> int:
+        """Serialized size of the issue if it is held in memory, else 0"""
+        content = self._content
+        if content is not None:
+            return len(content)
+        return self._size if self._issue is not None else 0
+
+    def evict(self, loader: Callable[[], bytes]) -> None:
+        """Drop the issue from memory, it is read using *loader* on next access."""
+        self._loader = loader
+        self._content = None
+        self._issue = None
+
+
+@attrs.frozen
+class CacheVersion:
+    """
+    An immutable version of all cached issues
+
+    *IssueCacheDict* publishes a new version for every change (or *batch* of
+    changes), so readers always see a consistent state without locking.
+    """
+
+    #: increases with every published version
+    version: int
+    entries: Mapping[IssueID, CacheEntry]
+    index: IssueIndex
+
+    @classmethod
+    def empty(cls, version: int = 0) -> "CacheVersion":
+        return cls(version, types.MappingProxyType({}), IssueIndex())
+
+    def summaries(self) -> tuple[IssueSummary, ...]:
+        return tuple(entry.summary for entry in self.entries.values())
+
+    def query(
+        self,
+        label: str | None = None,
+        state: Literal["opened", "closed"] | None = None,
+        project_id: int | None = None,
+    ) -> frozenset[IssueID]:
+        """
+        Return the ids of all issues matching all given criteria
+
+        Answered by the indexes, so no issue is validated.
+        """
+        matches: list[set[IssueID]] = []
+        if label is not None:
+            matches.append(self.index.by_label.get(label, set()))
+        if state is not None:
+            matches.append(self.index.by_state.get(state, set()))
+        if project_id is not None:
+            matches.append(self.index.by_project.get(project_id, set()))
+        if not matches:
+            return frozenset(self.entries.keys())
+        # intersect starting with the smallest set
+        matches.sort(key=len)
+        return frozenset(matches[0].intersection(*matches[1:]))
+
+
+class TierStats(NamedTuple):
+    """Memory usage of the issues of a tier of *IssueCacheDict*"""
 
-def get_file_cache_info(file: Path) -> FileCacheInfo:
-    stat = file.stat()
-    return stat.st_mtime_ns, stat.st_ctime_ns, stat.st_size
+    #: number of issues in the tier
+    issues: int
+    #: number of issues held in memory
+    resident: int
+    #: serialized size of the issues held in memory
+    resident_bytes: int
+
+
+type OnWritten = Callable[
+    [Mapping[IssueID, IssueRecord], Mapping[IssueID, CacheToken]], None
+]
+
+
+class WriteBehindWriter:
+    """
+    Persist issue records to a store in batches
+
+    Only the latest record (or None for deletion) of each issue is kept until it is
+    written. With *background* a daemon thread writes the records shortly after they
+    were put, otherwise they are written immediately.
+    While *hold* is active no records are written, so all changes within are
+    written in a single store transaction.
+    """
+
+    def __init__(
+        self,
+        store: IssueStore,
+        on_written: OnWritten,
+        background: bool = True,
+        delay: float = 0.5,
+    ) -> None:
+        self._store = store
+        self._on_written = on_written
+        self._delay = delay
+        self._condition = threading.Condition()
+        # serialises writing, so records of an issue can't be written out of order
+        self._write_lock = threading.Lock()
+        self._pending: dict[IssueID, IssueRecord | None] = {}
+        self._in_flight: dict[IssueID, IssueRecord | None] = {}
+        self._holds = 0
+        self._closed = False
+        self._thread: threading.Thread | None = None
+        if background:
+            self._thread = threading.Thread(
+                target=self._run, name="issue-cache-writer", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.close)
+
+    def put(self, issue_id: IssueID, record: IssueRecord | None) -> None:
+        with self._condition:
+            self._pending[issue_id] = record
+            self._condition.notify()
+        if self._thread is None:
+            self._write(respect_holds=True)
+
+    def is_pending(self, issue_id: IssueID) -> bool:
+        """Return True if the issue is not written to the store yet."""
+        with self._condition:
+            return issue_id in self._pending or issue_id in self._in_flight
+
+    def pending_ids(self) -> frozenset[IssueID]:
+        """IDs of issues not yet written to the store."""
+        with self._condition:
+            return frozenset(self._pending.keys() | self._in_flight.keys())
+
+    @contextlib.contextmanager
+    def hold(self) -> Iterator[None]:
+        with self._condition:
+            self._holds += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._holds -= 1
+                self._condition.notify()
+            if self._thread is None:
+                self._write(respect_holds=True)
+
+    def flush(self) -> None:
+        """Write all pending records now, even if held."""
+        self._write(respect_holds=False)
+
+    def close(self) -> None:
+        """Stop the background thread and write all pending records."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            atexit.unregister(self.close)
+        self.flush()
+
+    def _write(self, respect_holds: bool) -> None:
+        with self._write_lock:
+            with self._condition:
+                if not self._pending or (respect_holds and self._holds):
+                    return
+                changes = self._in_flight = self._pending
+                self._pending = {}
+            try:
+                to_write = {
+                    issue_id: record
+                    for issue_id, record in changes.items()
+                    if record is not None
+                }
+                to_delete = [
+                    issue_id for issue_id, record in changes.items() if record is None
+                ]
+                if to_delete:
+                    self._store.delete(to_delete)
+                self._on_written(to_write, self._store.write(to_write))
+            except BaseException:
+                with self._condition:
+                    # keep the records, unless they were changed in the meantime
+                    self._pending = changes | self._pending
+                raise
+            finally:
+                with self._condition:
+                    self._in_flight = {}
+
+    def _should_write(self) -> bool:
+        return self._closed or bool(self._pending and not self._holds)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(self._should_write)
+                if self._closed:
+                    return
+                # collect further changes to write them in the same transaction
+                self._condition.wait_for(lambda: self._closed, timeout=self._delay)
+            try:
+                self._write(respect_holds=True)
+            except Exception:
+                logger.exception("Failed to write cached issues, retrying later")
+                with self._condition:
+                    self._condition.wait_for(lambda: self._closed, timeout=self._delay)
 
 
 class IssueCacheDict:
     """
     A dictionary like cache holding issues keeping data on disk.
 
-    - caches the full issue attributes but only returns `Issue` objects on disk.
-    - automatically reloads Issues if the cache file is updated.
+    - stores the compact serialized `Issue` and optionally the compressed raw
+      issue attributes for debugging (see *raw_attributes*).
     - loads all cached issues once initialized
+    - reads are served from memory, *refresh_from_disk* checks the store
+      generation once and reloads only issues added, changed or removed
+      (e.g. by other processes)
+    - readers use the *current* immutable *CacheVersion*, changes are collected
+      in a copy that is published atomically, so a refresh running in another
+      thread is never seen half applied
+    - in *lazy* mode only the *IssueSummary* is extracted while loading, the
+      `Issue` is validated once it is accessed
+    - issues are indexed by label name, state and project (see *query*)
+    - open issues and issues referenced by boards (see *set_referenced*) are
+      hot and kept in memory. Other (cold) issues are evicted in least recently
+      used order once they exceed the *memory_budget* and are reloaded from the
+      snapshot or store on access (see *tier_stats*).
+    - the optional *snapshot_file* (see *cache_snapshot*) is written by
+      *write_snapshot* and memory mapped on initialisation. The store is only
+      read for issues changed since the snapshot was written.
+    - the issues are partitioned by project. If *project_ids* are given only
+      these projects are loaded on initialisation, others are loaded by
+      *load_projects*, e.g. in the background or once a board needs them.
+      Until then reads, *remove* and *last_updated* only cover the loaded
+      projects, while *update* compares issues of other projects with the store.
+    - persistence is handled by a pluggable *cache_stores.IssueStore*, changes
+      are written by a *WriteBehindWriter* once published, use *flush* or
+      *close* to ensure they are written
     """
 
-    file_name: Final[str] = "issue_{issue_id}.json"
-    _cache: dict[IssueID, tuple[FileCacheInfo, Issue]]
+    _current: CacheVersion
+    #: entries and index of the next version, while changes are collected
+    _next: tuple[dict[IssueID, CacheEntry], IssueIndex] | None
+    #: generation of the store when it was last checked for changes
+    _generation: Generation
+    #: ids of the projects loaded from the store, None if all are loaded
+    _loaded_projects: frozenset[int] | None
 
-    def __init__(self) -> None:
-        self._cache = dict(self._load_cache_files())
+    def __init__(
+        self,
+        store: IssueStore | None = None,
+        lazy: bool | None = None,
+        keep_raw: bool | None = None,
+        write_behind: bool | None = None,
+        snapshot_file: Path | None = None,
+        memory_budget: int | None = None,
+        project_ids: Collection[int] | None = None,
+    ) -> None:
+        config = settings.load_settings().cache
+        if snapshot_file is None and config.snapshot:
+            snapshot_file = settings.cache_dir() / "issues.snapshot"
+        self._snapshot_file = snapshot_file
+        self._snapshot: cache_snapshot.Snapshot | None = None
+        #: serializes writing the snapshot, e.g. by refreshes running at once
+        self._snapshot_lock = threading.Lock()
+        self._store = cache_stores.open_store() if store is None else store
+        self._lazy = config.lazy if lazy is None else lazy
+        self._keep_raw = config.keep_raw if keep_raw is None else keep_raw
+        self._writer = WriteBehindWriter(
+            self._store,
+            self._on_written,
+            background=config.write_behind if write_behind is None else write_behind,
+        )
+        self._memory_budget = (
+            config.cold_memory_budget if memory_budget is None else memory_budget
+        )
+        # guards the tiers, as written issues become evictable in the writer thread
+        self._tier_lock = threading.RLock()
+        self._referenced: dict[str, frozenset[IssueID]] = {}
+        self._hot_ids: frozenset[IssueID] = frozenset()
+        #: resident cold issues in least recently used order with their size
+        self._cold_resident: OrderedDict[IssueID, tuple[CacheEntry, int]] = (
+            OrderedDict()
+        )
+        self._cold_bytes = 0
+        # serialises changes, readers don't need it
+        self._change_lock = threading.RLock()
+        self._batch_depth = 0
+        self._current = CacheVersion.empty()
+        self._next = None
+        self._generation = self._store.generation()
+        self._loaded_projects = None if project_ids is None else frozenset(project_ids)
+        if self._snapshot_file is not None:
+            self._snapshot = cache_snapshot.Snapshot.open(self._snapshot_file)
+        with self.batch():
+            for issue_id, entry in self._load_cache(self._loaded_projects):
+                self._set_entry(issue_id, entry)
+
+    @property
+    def current(self) -> CacheVersion:
+        """The latest published version of all issues."""
+        return self._current
+
+    @property
+    def version(self) -> int:
+        """Number of the latest published version, changes with every change."""
+        return self._current.version
 
     def __getitem__(self, item: IssueID) -> Issue:
-        issue = self._refresh_item(item)
-        if issue:
-            return issue
-        raise KeyError(item)
-
-    def _refresh_item(self, item: IssueID) -> Issue | None:
-        cache_info, issue = self._cache.get(item, (None, None))
-        cache_file = self._issue_cache_file(item)
-        if cache_file.exists():
-            if get_file_cache_info(cache_file) != cache_info:
-                cache_info, issue = self._load_from_file(item)
-                self._cache[item] = cache_info, issue
-        return issue
+        return self._get(self._current, item)
 
-    @classmethod
-    def _converter(cls, content: bytes) -> Issue:
-        return Issue.model_validate_json(content)
+    def get_in(self, version: CacheVersion, item: IssueID) -> Issue:
+        """Return the issue as of *version*, e.g. to match its summaries."""
+        return self._get(version, item)
 
     def __len__(self) -> int:
-        return len(self._cache)
+        return len(self._current.entries)
 
     def values(self) -> Iterable[Issue]:
-        for _, issue in self._cache.values():
-            yield issue
+        current = self._current
+        for issue_id in current.entries:
+            yield self._get(current, issue_id)
+
+    def _get(self, version: CacheVersion, issue_id: IssueID) -> Issue:
+        entry = version.entries[issue_id]
+        issue = entry.issue
+        if not self._is_hot(entry.summary):
+            with self._tier_lock:
+                self._track(issue_id, entry)
+                self._enforce_budget()
+        return issue
+
+    def summaries(self) -> Iterable[IssueSummary]:
+        """Return the summaries of all issues without validating them."""
+        return self._current.summaries()
 
     def keys(self) -> tuple[IssueID, ...]:
-        return tuple(self._cache.keys())
+        return tuple(self._current.entries.keys())
+
+    def query(
+        self,
+        label: str | None = None,
+        state: Literal["opened", "closed"] | None = None,
+        project_id: int | None = None,
+    ) -> frozenset[IssueID]:
+        """Return the ids of all issues matching all given criteria."""
+        return self._current.query(label=label, state=state, project_id=project_id)
+
+    def label_names(self) -> frozenset[str]:
+        """Return the names of all labels used by at least one issue."""
+        return frozenset(self._current.index.by_label.keys())
+
+    def project_ids(self) -> frozenset[int]:
+        """Return the ids of all projects having at least one issue."""
+        return frozenset(self._current.index.by_project.keys())
+
+    def labels(self) -> Mapping[str, Label]:
+        """
+        Return the most used definition of every label used by the issues.
+
+        Labels are defined per project, so only the latest updated issue of
+        every project is validated for each label.
+        """
+        current = self._current
+        result: dict[str, Label] = {}
+        for label_name, issue_ids in current.index.by_label.items():
+            latest: dict[int, IssueSummary] = {}
+            occurrences: Counter[int] = Counter()
+            for issue_id in issue_ids:
+                summary = current.entries[issue_id].summary
+                occurrences[summary.project_id] += 1
+                other = latest.get(summary.project_id)
+                if other is None or other.updated_at < summary.updated_at:
+                    latest[summary.project_id] = summary
+            variants: Counter[Label] = Counter()
+            for project_id, summary in latest.items():
+                issue = self._get(current, summary.id)
+                for label in issue.labels:
+                    if label.name == label_name:
+                        variants[label] += occurrences[project_id]
+            if variants:
+                result[label_name] = variants.most_common(1)[0][0]
+        return types.MappingProxyType(result)
+
+    @property
+    def loaded_projects(self) -> frozenset[int] | None:
+        """The ids of the loaded projects, None if all projects are loaded."""
+        return self._loaded_projects
+
+    def is_loaded(self, project_id: int) -> bool:
+        loaded_projects = self._loaded_projects
+        return loaded_projects is None or project_id in loaded_projects
+
+    def is_empty(self) -> bool:
+        """Return True if no issue is cached, including the not loaded projects."""
+        if self._current.entries:
+            return False
+        return self._loaded_projects is None or not self._store.tokens()
+
+    def label_project_ids(self, label_names: Collection[str]) -> frozenset[int]:
+        """
+        Return the ids of all cached projects with issues having any of the labels.
+
+        Answered by the store, so the projects don't need to be loaded.
+        """
+        return self._store.label_project_ids(label_names)
+
+    def load_projects(self, project_ids: Collection[int] | None = None) -> None:
+        """
+        Load the issues of the given projects (all if None) if not loaded yet.
+
+        Issues changed in memory in the meantime are kept.
+        """
+        with self._change_lock:
+            loaded_projects = self._loaded_projects
+            if loaded_projects is None:
+                return
+            if project_ids is None:
+                to_load = None
+            elif not (to_load := frozenset(project_ids) - loaded_projects):
+                return
+            with self.batch():
+                entries = self._latest_entries()
+                for issue_id, entry in self._load_cache(to_load):
+                    if issue_id not in entries and not self._writer.is_pending(
+                        issue_id
+                    ):
+                        self._set_entry(issue_id, entry)
+                self._loaded_projects = (
+                    None if to_load is None else loaded_projects | to_load
+                )
+
+    def set_referenced(self, owner: str, issue_ids: Iterable[IssueID]) -> None:
+        """
+        Keep the issues referenced by *owner* (e.g. a board) in memory.
+
+        Replaces the issues referenced by *owner* before.
+        """
+        with self._tier_lock:
+            self._referenced[owner] = frozenset(issue_ids)
+            old_hot_ids = self._hot_ids
+            self._hot_ids = frozenset().union(*self._referenced.values())
+            for issue_id in self._hot_ids - old_hot_ids:
+                self._untrack(issue_id)
+            entries = self._current.entries
+            for issue_id in old_hot_ids - self._hot_ids:
+                if (entry := entries.get(issue_id)) is not None:
+                    self._track(issue_id, entry)
+            self._enforce_budget()
+
+    def tier_stats(self) -> dict[Literal["hot", "cold"], TierStats]:
+        """Return the number and memory usage of hot and cold issues."""
+        counts = {"hot": [0, 0, 0], "cold": [0, 0, 0]}
+        for entry in self._current.entries.values():
+            count = counts["hot" if self._is_hot(entry.summary) else "cold"]
+            size = entry.resident_bytes
+            count[0] += 1
+            count[1] += bool(size)
+            count[2] += size
+        return {"hot": TierStats(*counts["hot"]), "cold": TierStats(*counts["cold"])}
+
+    def _is_hot(self, summary: IssueSummary) -> bool:
+        return summary.state == "opened" or summary.id in self._hot_ids
+
+    def _track(self, issue_id: IssueID, entry: CacheEntry) -> None:
+        """Mark the issue as most recently used, if it is cold and in memory."""
+        self._untrack(issue_id)
+        if self._is_hot(entry.summary):
+            return
+        if size := entry.resident_bytes:
+            self._cold_resident[issue_id] = entry, size
+            self._cold_bytes += size
+
+    def _untrack(self, issue_id: IssueID) -> None:
+        _, size = self._cold_resident.pop(issue_id, (None, 0))
+        self._cold_bytes -= size
+
+    def _enforce_budget(self) -> None:
+        """Evict the least recently used cold issues exceeding the memory budget."""
+        while self._cold_bytes > self._memory_budget and self._cold_resident:
+            issue_id, (entry, _) = next(iter(self._cold_resident.items()))
+            self._untrack(issue_id)
+            # issues not written yet are tracked again once written
+            if entry.token is not None:
+                entry.evict(functools.partial(self._load_content, issue_id))
+
+    def _latest_entries(self) -> Mapping[IssueID, CacheEntry]:
+        """Entries including the changes not published yet."""
+        return self._current.entries if self._next is None else self._next[0]
+
+    def _changes(self) -> tuple[dict[IssueID, CacheEntry], IssueIndex]:
+        """Return entries and index of the next version, copying the current one."""
+        if self._next is None:
+            self._next = dict(self._current.entries), self._current.index.copy()
+        return self._next
+
+    def _publish(self) -> None:
+        if self._next is None:
+            return
+        entries, index = self._next
+        self._next = None
+        self._current = CacheVersion(
+            self._current.version + 1, types.MappingProxyType(entries), index
+        )
+
+    def _set_entry(self, issue_id: IssueID, entry: CacheEntry) -> None:
+        """Add or replace the issue in the next version (only within *batch*)."""
+        entries, index = self._changes()
+        if (old := entries.get(issue_id)) is not None:
+            index.discard(old.summary)
+        entries[issue_id] = entry
+        index.add(entry.summary)
+        with self._tier_lock:
+            self._track(issue_id, entry)
+            self._enforce_budget()
+
+    def _pop_entry(self, issue_id: IssueID) -> None:
+        """Remove the issue from the next version (only within *batch*)."""
+        entries, index = self._changes()
+        if (old := entries.pop(issue_id, None)) is not None:
+            index.discard(old.summary)
+        with self._tier_lock:
+            self._untrack(issue_id)
 
     def refresh_from_disk(self) -> None:
-        for elm in self._cache.keys():
-            self._refresh_item(elm)
+        """
+        Apply changes of the store done by other processes.
 
-    def remove(self, remove: Callable[[Issue], bool]) -> None:
+        Only compares the tokens of all stored issues if the generation of the store
+        changed since the last check.
+        Skipped while another thread changes the cache, e.g. refreshes from gitlab.
+        """
+        if not self._change_lock.acquire(blocking=False):
+            return
+        try:
+            generation = self._store.generation()
+            if generation == self._generation:
+                return
+            self._generation = generation
+            with self.batch():
+                self._apply_store_changes()
+        finally:
+            self._change_lock.release()
+
+    def _apply_store_changes(self) -> None:
+        pending = self._writer.pending_ids()
+        tokens = self._store.tokens(self._loaded_projects)
+        entries = self._latest_entries()
+        for issue_id in entries.keys() - tokens.keys() - pending:
+            # issues of not loaded projects were loaded by *update*
+            if self.is_loaded(entries[issue_id].summary.project_id):
+                self._pop_entry(issue_id)
+        for issue_id, token in tokens.items():
+            entry = entries.get(issue_id)
+            if issue_id in pending or (entry and entry.token == token):
+                continue
+            stored = self._store.load(issue_id)
+            if stored is not None and (entry := self._entry_from_stored(stored)):
+                self._set_entry(issue_id, entry)
+
+    @contextlib.contextmanager
+    def batch(self) -> Iterator[None]:
+        """
+        Publish all changes as a single version and persist them in a single store
+        transaction on exit.
+
+        Until then readers see the previous version. Nested calls join the outer
+        batch, changes of other threads wait until the batch is finished.
+        """
+        with self._change_lock, self._writer.hold():
+            self._batch_depth += 1
+            try:
+                yield
+            finally:
+                self._batch_depth -= 1
+                if not self._batch_depth:
+                    # publish before the writer persists the changes
+                    self._publish()
+
+    def _stage(self, issue_id: IssueID, record: IssueRecord | None) -> None:
+        """Persist *record* (None means deletion) by the writer."""
+        self._writer.put(issue_id, record)
+
+    def _on_written(
+        self,
+        records: Mapping[IssueID, IssueRecord],
+        tokens: Mapping[IssueID, CacheToken],
+    ) -> None:
+        entries = self._current.entries
+        with self._tier_lock:
+            for issue_id, token in tokens.items():
+                entry = entries.get(issue_id)
+                # the entry could have been changed again in the meantime
+                if entry is not None and entry.content == records[issue_id].content:
+                    entry.token = token
+                    self._track(issue_id, entry)
+            self._enforce_budget()
+
+    def flush(self) -> None:
+        """Ensure all changes are written to the store."""
+        self._writer.flush()
+
+    def close(self) -> None:
+        """Write all changes and stop writing in the background."""
+        self._writer.close()
+
+    def remove(self, remove: Callable[[IssueLike], bool]) -> None:
         """
         Remove all issues that meet *remove*
+
+        *remove* is called with the *IssueSummary*, so no issue is validated.
+        Issues of projects not loaded yet are not checked.
         """
-        for issue_id, (_, issue) in tuple(self._cache.items()):
-            if remove(issue):
-                file = self._issue_cache_file(issue_id)
-                del self._cache[issue_id]
-                if file.exists():
-                    file.unlink()
+        with self.batch():
+            for issue_id, entry in tuple(self._latest_entries().items()):
+                if remove(entry.summary):
+                    self._pop_entry(issue_id)
+                    self._stage(issue_id, None)
 
     def update(
         self,
         gl_issue: Union["RESTObject", dict[str, Any]],
-        remove: Callable[[Issue], bool],
-    ) -> None:
+        remove: Callable[[IssueLike], bool],
+    ) -> UpdateOutcome:
         """
         Update the gl_issue state in cache.
 
-        Write as file or if remove retruns True, remove it from dict and disk.
+        Store it or if remove retruns True, remove it from dict and disk.
+        Issues equal to the cached ones are neither replaced nor written.
 
         Args:
             gl_issue: The gitlab issue to put in cache
             remove: Callable, if True, will remove the issue from cache
 
+        Returns:
+            How the cache was changed
+
         """
         data = gl_issue if isinstance(gl_issue, dict) else gl_issue.attributes
-        content = json.dumps(data, option=json.OPT_INDENT_2)
         try:
-            issue = self._converter(content)
+            issue = Issue.model_validate(data, context=VALIDATION_CONTEXT)
         except ValidationError:
-            logger.exception(f"Failed to convert issue: {content.decode()}")
+            logger.exception(f"Failed to convert issue: {data}")
             raise
-        file = self._issue_cache_file(issue.id)
-        if remove(issue):
-            if issue.id in self._cache:
-                del self._cache[issue.id]
-            if file.exists():
-                file.unlink()
-            del issue
-            del content
-        else:
-            file.write_bytes(content)
-            self._cache[issue.id] = (get_file_cache_info(file), issue)
+        with self.batch():
+            cached = self._latest_entries().get(issue.id)
+            if cached is None and (cached := self._unloaded_entry(issue)):
+                self._set_entry(issue.id, cached)
+            if remove(issue):
+                if cached is None:
+                    return "ignored"
+                self._pop_entry(issue.id)
+                self._stage(issue.id, None)
+                return "removed"
+            # only the fields of the Issue are stored, in compact form
+            content = issue.model_dump_json().encode()
+            digest = fingerprint(content)
+            if cached is not None and cached.fingerprint == digest:
+                return "unchanged"
+            summary = IssueSummary.from_issue(issue)
+            entry = CacheEntry(None, summary, content, issue, fingerprint=digest)
+            self._set_entry(issue.id, entry)
+            raw = zlib.compress(json.dumps(data)) if self._keep_raw else None
+            self._stage(issue.id, IssueRecord(content, raw))
+            return "new" if cached is None else "changed"
+
+    def _unloaded_entry(self, issue: Issue) -> CacheEntry | None:
+        """Load the stored version of an issue of a project not loaded yet."""
+        if self.is_loaded(issue.project_id) or self._writer.is_pending(issue.id):
+            return None
+        stored = self._store.load(issue.id)
+        return None if stored is None else self._entry_from_stored(stored)
+
+    def raw_attributes(self, issue_id: IssueID) -> dict[str, Any] | None:
+        """
+        Return the issue attributes as received from gitlab.
+
+        Only available if the issue was updated while *keep_raw* was enabled.
+        """
+        raw = self._store.load_raw(issue_id)
+        if raw is None:
+            return None
+        result: dict[str, Any] = json.loads(zlib.decompress(raw))
+        return result
 
     @property
     def last_updated(self) -> datetime | None:
         """
         Return the time the last issue was updated or none if no issues are loaded.
+
+        Only covers the loaded projects.
         """
-        if self._cache:
-            return max(issue.updated_at for _, issue in self._cache.values())
+        if entries := self._current.entries:
+            return max(entry.summary.updated_at for entry in entries.values())
         return None
 
-    @classmethod
-    def _cache_folder(cls) -> Path:
-        """Path to cache folder, ensuring existence."""
-        cache_folder = settings.cache_dir() / "issues"
-        cache_folder.mkdir(parents=True, exist_ok=True)
-        return cache_folder
+    def _load_cache(
+        self, project_ids: Collection[int] | None
+    ) -> Iterable[tuple[IssueID, CacheEntry]]:
+        """
+        Load the stored issues of the given projects (all if None), using the
+        snapshot if available.
 
-    @classmethod
-    def _issue_cache_file(cls, issue_id: IssueID) -> Path:
-        """Path to Cache file of the given issue."""
-        return cls._cache_folder() / cls.file_name.format(issue_id=issue_id)
+        Intended only for loading projects not loaded yet
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            for stored in self._store.load_all(project_ids):
+                if entry := self._entry_from_stored(stored):
+                    yield stored.issue_id, entry
+            return
 
-    @classmethod
-    def _load_from_file(cls, elm: IssueID | Path) -> tuple[FileCacheInfo, Issue]:
-        """Load the given issue by ID or Path."""
-        if isinstance(elm, Path):
-            file = elm
+        if snapshot.generation == self._store.generation():
+            # the store wasn't changed since the snapshot was written
+            tokens = snapshot.tokens
         else:
-            file = cls._issue_cache_file(elm)
-            if not file.exists():
-                raise KeyError(elm)
-        cache_info = get_file_cache_info(file)
-        issue = cls._converter(file.read_bytes())
-        return cache_info, issue
+            tokens = self._store.tokens(project_ids)
+        for issue_id, token in tokens.items():
+            if snapshot.tokens.get(issue_id) == token:
+                summary = IssueSummary.from_raw(snapshot.summaries[issue_id])
+                if project_ids is not None and summary.project_id not in project_ids:
+                    continue
+                loader = functools.partial(self._load_content, issue_id)
+                entry = CacheEntry(token, summary, loader=loader)
+                if not self._lazy:
+                    entry.issue  # noqa: B018 validate now
+                yield issue_id, entry
+            elif (changed := self._store.load(issue_id)) and (
+                entry := self._entry_from_stored(changed)
+            ):
+                yield issue_id, entry
 
-    @classmethod
-    def _load_cache_files(cls) -> Iterable[tuple[IssueID, tuple[FileCacheInfo, Issue]]]:
-        """
-        Load all existing cache files.
+    def _load_content(self, issue_id: IssueID) -> bytes:
+        """Load the content of an issue from the snapshot or the store."""
+        # the snapshot is replaced by *write_snapshot* in other threads
+        snapshot = self._snapshot
+        content = snapshot.content(issue_id) if snapshot is not None else None
+        if content is None:
+            stored = self._store.load(issue_id)
+            if stored is None:
+                raise KeyError(issue_id)
+            content = stored.content
+        return content
 
-        Intended only for initial loading when initialising the class
+    def write_snapshot(self) -> None:
         """
-        for path in cls._cache_folder().glob(cls.file_name.format(issue_id="*")):
-            cache_info, issue = cls._load_from_file(path)
-            yield issue.id, (cache_info, issue)
+        Write all stored issues into the snapshot file, replacing it atomically.
+        """
+        if self._snapshot_file is None:
+            return
+        if self._loaded_projects is not None:
+            # the issues of the not loaded projects would be missing
+            logger.debug("Not writing snapshot, as not all projects are loaded")
+            return
+        with self._snapshot_lock:
+            self._write_snapshot(self._snapshot_file)
+
+    def _write_snapshot(self, snapshot_file: Path) -> None:
+        self._writer.flush()
+        generation: Generation | None = self._store.generation()
+        tokens = self._store.tokens()
+        records = [
+            cache_snapshot.SnapshotRecord(
+                issue_id, entry.token, entry.summary.to_raw(), entry.content
+            )
+            for issue_id, entry in self._current.entries.items()
+            if entry.token is not None and tokens.get(issue_id) == entry.token
+        ]
+        if len(records) != len(tokens) or generation != self._store.generation():
+            # not all stored issues are part of the snapshot
+            generation = None
+        data = cache_snapshot.pack(records, generation)
+        snapshot, self._snapshot = self._snapshot, None
+        if snapshot is not None:
+            # release the mapping, as mapped files can't be replaced on Windows
+            snapshot.close()
+        try:
+            cache_stores.atomic_write(snapshot_file, data)
+        except OSError as e:
+            logger.warning(f"Failed to write snapshot: {type(e).__name__}: {e}")
+        self._snapshot = cache_snapshot.Snapshot.open(snapshot_file)
+
+    def _entry_from_stored(self, stored: StoredIssue) -> CacheEntry | None:
+        """Create the cache entry for *stored*, ignoring invalid content."""
+        try:
+            return CacheEntry.from_stored(stored, self._lazy)
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(
+                f"Ignoring invalid cached issue {stored.issue_id}: "
+                f"{type(e).__name__}: {e}"
+            )
+            return None
 
     def clean(self) -> None:
         """Clean the cache in memory and on disk."""
-        self._cache.clear()
-        for file in self._cache_folder().glob(self.file_name.format(issue_id="*")):
-            file.unlink()
+        self._writer.flush()
+        with self._change_lock, self._tier_lock:
+            self._next = None
+            self._current = CacheVersion.empty(self._current.version + 1)
+            self._loaded_projects = None
+            self._cold_resident.clear()
+            self._cold_bytes = 0
+        self._store.clear()
+        with self._snapshot_lock:
+            snapshot, self._snapshot = self._snapshot, None
+            if snapshot is not None:
+                snapshot.close()
+            if self._snapshot_file is not None:
+                self._snapshot_file.unlink(missing_ok=True)
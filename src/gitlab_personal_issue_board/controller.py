@@ -4,9 +4,20 @@ Buisness Logic (Controller) handling sorting Issues into Cards/Boards
 
 import types
 from collections import Counter
-from collections.abc import Iterable, Mapping, Sequence
+from collections.abc import Collection, Iterable, Mapping, Sequence
+from typing import Literal, Protocol
 
-from .models import Issue, IssueID, Label, LabelCard
+from .models import Issue, IssueID, IssueLike, Label, LabelCard
+
+
+class IssueQuery(Protocol):
+    """Index answering which issues have a label or state, see *CacheVersion*"""
+
+    def query(
+        self,
+        label: str | None = None,
+        state: Literal["opened", "closed"] | None = None,
+    ) -> Collection[IssueID]: ...
 
 
 def get_labels_from_issues(issues: Iterable[Issue]) -> Mapping[str, Label]:
@@ -15,11 +26,20 @@ def get_labels_from_issues(issues: Iterable[Issue]) -> Mapping[str, Label]:
 
     Returns a Mapping of label name to most occurred label definition.
     """
-
-    issue_variants: dict[str, Counter[Label]] = {}
+    # Labels of cached issues are interned, so count the instances by identity
+    # first and only hash every distinct instance once.
+    # Keeping the instances ensures their ids are not reused.
+    instances: dict[int, Label] = {}
+    occurrences: Counter[int] = Counter()
     for issue in issues:
         for label in issue.labels:
-            issue_variants.setdefault(label.name, Counter()).update((label,))
+            instances[id(label)] = label
+            occurrences[id(label)] += 1
+
+    issue_variants: dict[str, Counter[Label]] = {}
+    for instance_id, count in occurrences.items():
+        label = instances[instance_id]
+        issue_variants.setdefault(label.name, Counter())[label] += count
 
     return types.MappingProxyType(
         {
@@ -30,7 +50,9 @@ def get_labels_from_issues(issues: Iterable[Issue]) -> Mapping[str, Label]:
 
 
 def sort_issues_in_cards_by_label(
-    issues: Sequence[Issue], cards: Sequence[LabelCard]
+    issues: Sequence[IssueLike],
+    cards: Sequence[LabelCard],
+    index: IssueQuery | None = None,
 ) -> Iterable[LabelCard]:
     """
     Sort *issues* into *cards* as gitlab would do.
@@ -43,6 +65,9 @@ def sort_issues_in_cards_by_label(
 
     The sorting of the issues in cards are kept.
     Issues that are newly added to a card a prepended in the order of *issues*.
+
+    If the *index* of *issues* is given, only the issues it returns for a card
+    are checked instead of all issues.
     """
     if not cards:
         # if no cards are given, then just return an empty tuple
@@ -64,10 +89,14 @@ def sort_issues_in_cards_by_label(
 
     # after we have the old issues we need to determine new issue to add
     card_issues_new: list[list[IssueID]] = []
+    positions = {issue.id: position for position, issue in enumerate(issues)}
     for card, already_added in zip(reversed(cards), card_issues_old, strict=True):
+        candidates = (
+            issues if index is None else _candidates(card, index, issues, positions)
+        )
         to_add: list[IssueID] = [
             issue.id
-            for issue in issues
+            for issue in candidates
             if issue.id not in already_added and card.valid(issue, issues_distributed)
         ]
         issues_distributed = issues_distributed | set(to_add)
@@ -78,3 +107,20 @@ def sort_issues_in_cards_by_label(
         cards, reversed(card_issues_old), reversed(card_issues_new), strict=True
     ):
         yield card.evolve(issue_new, issue_old)
+
+
+def _candidates(
+    card: LabelCard,
+    index: IssueQuery,
+    issues: Sequence[IssueLike],
+    positions: Mapping[IssueID, int],
+) -> list[IssueLike]:
+    """Return the issues that could belong to *card* in the order of *issues*."""
+    if isinstance(card.label, Label):
+        issue_ids = index.query(label=card.label.name, state="opened")
+    else:
+        issue_ids = index.query(state=card.label)
+    found = sorted(
+        positions[issue_id] for issue_id in issue_ids if issue_id in positions
+    )
+    return [issues[position] for position in found]
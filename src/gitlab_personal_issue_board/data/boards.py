@@ -1,6 +1,8 @@
 from pathlib import Path
 
 from .. import models, settings
+from ..cache_stores import atomic_write
+from ..file_lock import FileLock
 
 
 def _label_board_path(board: models.LabelBoard | models.LabelBoardID | Path) -> Path:
@@ -12,7 +14,9 @@ def _label_board_path(board: models.LabelBoard | models.LabelBoardID | Path) ->
 
 def save_label_board(board: models.LabelBoard) -> None:
     target = _label_board_path(board)
-    target.write_text(board.model_dump_json())
+    # boards are saved by all UI processes, so never show a half written one
+    with FileLock(target.with_name(f"{target.name}.lock")):
+        atomic_write(target, board.model_dump_json().encode())
 
 
 def load_label_board(
@@ -2,156 +2,1135 @@
 Handling data loading/updates from/to gitlab.
 """
 
+import asyncio
+import contextlib
 import functools
-import getpass
+import itertools
 import logging
-from collections.abc import Iterable
-from datetime import UTC, datetime
-from typing import Any, Literal
+import threading
+import time
+from collections import Counter
+from collections.abc import AsyncIterator, Collection, Iterable, Iterator, Mapping
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime, timedelta
+from typing import Any, Final, Literal, NamedTuple
 
 import gitlab
+import httpx
+import requests
 
-from gitlab_personal_issue_board import caching, models, settings
+from gitlab_personal_issue_board import (
+    caching,
+    data,
+    file_lock,
+    gitlab_async,
+    gitlab_graphql,
+    models,
+    move_journal,
+    request_scheduler,
+    settings,
+    sync_state,
+)
+from gitlab_personal_issue_board.move_journal import MoveTarget
 
 logger = logging.getLogger(__name__)
 
+#: issues requested per page of concurrently requested listings and iids requested
+#: at once to detect unassigned issues
+PER_PAGE: Final[int] = 100
+#: status codes telling a project can't be accessed (anymore)
+INACCESSIBLE_STATUS: Final[frozenset[int]] = frozenset({403, 404})
+
+
+@functools.cache
+def get_scheduler(
+    config_section: str | None = None,
+) -> request_scheduler.RequestScheduler:
+    """The scheduler all requests to the gitlab instance are sent through"""
+    config = settings.load_settings().gitlab
+    return request_scheduler.RequestScheduler(
+        max_connections=config.max_connections,
+        max_retries=config.max_retries,
+        backoff=config.request_backoff,
+        max_backoff=config.max_request_backoff,
+        reserve=config.rate_limit_reserve,
+    )
+
+
+class ScheduledGitlab(gitlab.Gitlab):
+    """
+    A python-gitlab connection leaving all retries to its *ScheduledSession*
+
+    python-gitlab would otherwise retry rate limited (and possibly failed) requests
+    up to 10 times on its own, each time after the session retried them already.
+    """
+
+    def http_request(
+        self, verb: str, path: str, *args: Any, **kwargs: Any
+    ) -> requests.Response:
+        kwargs |= {"obey_rate_limit": False, "retry_transient_errors": False}
+        return super().http_request(verb, path, *args, **kwargs)
+
 
 @functools.cache
-def get_gitlab() -> gitlab.Gitlab:
-    config = settings.load_settings()
-    return gitlab.Gitlab.from_config(gitlab_id=config.gitlab.config_section)
+def get_gitlab(config_section: str | None = None) -> gitlab.Gitlab:
+    """Connect to the gitlab instance of the python-gitlab *config_section*."""
+    gl = ScheduledGitlab.from_config(
+        gitlab_id=config_section,
+        session=request_scheduler.ScheduledSession(get_scheduler(config_section)),
+    )
+    if gl.timeout is None:
+        # an unreachable instance would block its requests forever
+        gl.timeout = settings.load_settings().gitlab.timeout
+    return gl
 
 
 @functools.cache
-def get_gitlab_user() -> models.User:
-    gl = get_gitlab()
-    try:
-        gl.auth()
-    except Exception as e:
-        logger.error(
-            f"Failed to authenticate to Gitlab. Fallback to login user. "
-            f"Error was: {type(e).__name__}: {e}"
-        )
-        username = getpass.getuser()
-        return models.User(
-            username=username, id=models.UserID(-1), name=username, avatar_url=""
-        )
+def get_gitlab_user(config_section: str | None = None) -> models.User:
+    """
+    Return the user authenticated at the instance of *config_section*
+
+    Failures raise and aren't cached, so the next call tries again.
+    """
+    gl = get_gitlab(config_section)
+    gl.auth()
     if gl.user is None:
         raise RuntimeError("Could not determine GitLab user")
     return models.User.model_validate(gl.user.attributes)
 
 
-def not_assigned_to_me(issue: models.Issue) -> bool:
+def label_changes(
+    state: Literal["opened", "closed"],
+    new_label: MoveTarget,
+    old_labels: Iterable[models.Label],
+) -> dict[str, Any]:
     """
-    Return True if the given issue is not assigned to the user holding the connection
+    Return the attributes to update an issue with *state* to be moved to the card of
+    *new_label* from the cards of *old_labels*
+
+    Labels are added and removed relative to the current labels of the issue, so
+    other labels are kept, even if they were changed in the meantime.
     """
-    assigned_to_me = any(
-        assignee.username == get_gitlab_user().username for assignee in issue.assignees
-    )
-    return not assigned_to_me
+    remove_labels = {label.name for label in old_labels}
+    result: dict[str, Any] = {}
+    if isinstance(new_label, models.Label):
+        result["add_labels"] = new_label.name
+        remove_labels.discard(new_label.name)
+    if remove_labels:
+        result["remove_labels"] = ",".join(sorted(remove_labels))
+    if new_label == "closed":
+        if state != "closed":
+            # close issues that need to be closed
+            result["state_event"] = "close"
+    elif state == "closed":
+        # reopen closed issue if moved from closed
+        result["state_event"] = "reopen"
+    return result
 
 
-class Issues:
+class RefreshResult(NamedTuple):
+    """Result of refreshing the issues of all instances"""
+
+    #: True if all instances were refreshed, else the error messages
+    status: str | Literal[True]
+    #: how the received issues changed the cache
+    counts: Counter[caching.UpdateOutcome]
+
+    @property
+    def changes(self) -> int:
+        """Number of issues added, changed or removed."""
+        return self.counts["new"] + self.counts["changed"] + self.counts["removed"]
+
+
+class LabelCache:
     """
-    Handles issues assigned to a user
+    Labels available in each project by name, kept for *ttl* seconds
     """
 
-    #: time the issues were last retrieved from gitlab
-    _last_updated: datetime | None
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._labels: dict[int, tuple[float, dict[str, dict[str, Any]]]] = {}
+
+    def get(self, project_id: int) -> dict[str, dict[str, Any]] | None:
+        """Return the labels of the project, None if unknown or expired."""
+        with self._lock:
+            loaded, labels = self._labels.get(project_id, (0.0, None))
+        if labels is None or time.monotonic() - loaded > self.ttl:
+            return None
+        return labels
+
+    def set(
+        self, project_id: int, labels: Iterable[dict[str, Any]]
+    ) -> dict[str, dict[str, Any]]:
+        result = {label["name"]: label for label in labels}
+        with self._lock:
+            self._labels[project_id] = time.monotonic(), result
+        return result
+
+    def add(self, project_id: int, label: dict[str, Any]) -> dict[str, dict[str, Any]]:
+        """Add a label created in the project, return the labels of the project."""
+        with self._lock:
+            loaded, labels = self._labels.get(project_id, (0.0, {}))
+            # never change the labels returned before
+            labels = labels | {label["name"]: label}
+            if loaded:
+                self._labels[project_id] = loaded, labels
+        return labels
+
+    def invalidate(self, project_id: int | None = None) -> None:
+        """Forget the labels of the project, of all projects if None."""
+        with self._lock:
+            if project_id is None:
+                self._labels.clear()
+            else:
+                self._labels.pop(project_id, None)
+
+
+class Instance:
+    """
+    A gitlab instance the issues are synced from
+
+    The issue and project ids of the instance are namespaced in the cache (see
+    *models.namespaced_id*), so they can't collide with the ones of other instances.
+    Namespace 0 keeps the ids of gitlab.
+    """
+
+    #: start time of the last successful refresh of this instance
+    last_updated: datetime | None
+    #: user holding the connection, None until resolved by the first refresh
+    user: models.User | None
+
+    def __init__(
+        self, config_section: str | None, config: settings.GitlabSettings
+    ) -> None:
+        self.config_section = config_section
+        self.gl = get_gitlab(config_section)
+        self.namespace = sync_state.get_namespace(self.gl.url)
+        self.async_gl = (
+            gitlab_async.AsyncGitlab.from_gitlab(
+                self.gl, config.max_connections, get_scheduler(config_section)
+            )
+            if config.backend == "async"
+            else None
+        )
+        self.labels = LabelCache(config.label_ttl)
+        self.sync = config.sync
+        self.page_concurrency = config.page_concurrency
+        lock_name = (
+            f"refresh_{self.namespace}.lock" if self.namespace else "refresh.lock"
+        )
+        self.refresh_lock = file_lock.FileLock(settings.cache_dir() / lock_name)
+        self.last_updated = None
+        self.user = None
+
+    def __str__(self) -> str:
+        return f"<Gitlab Instance {self.gl.url}>"
+
+    @property
+    def url(self) -> str:
+        return self.gl.url
+
+    @property
+    def username(self) -> str:
+        """Name of the user holding the connection, once resolved."""
+        if self.user is None:
+            raise RuntimeError(f"User of {self} not resolved yet")
+        return self.user.username
+
+    def owns(self, namespaced_id: int) -> bool:
+        """Return True if the namespaced issue or project id is of this instance."""
+        return models.split_namespace(namespaced_id)[0] == self.namespace
+
+    def local_id(self, namespaced_id: int) -> int:
+        """Return the id on gitlab of a namespaced issue or project id."""
+        return models.split_namespace(namespaced_id)[1]
+
+    def namespaced(self, issue: Any) -> dict[str, Any]:
+        """Return the attributes of an issue received from gitlab for the cache."""
+        data: dict[str, Any] = issue if isinstance(issue, dict) else issue.attributes
+        if not self.namespace:
+            return data
+        return data | {
+            "id": models.namespaced_id(data["id"], self.namespace),
+            "project_id": models.namespaced_id(data["project_id"], self.namespace),
+        }
+
+    def not_assigned_to_me(self, issue: models.IssueLike) -> bool:
+        """
+        Return True if the given issue is not assigned to the user holding the
+        connection, False while the user isn't known
+        """
+        if self.user is None:
+            return False
+        return self.user.username not in issue.assignee_usernames
+
+    def project_labels(self, project_id: int) -> dict[str, dict[str, Any]]:
+        """Return the labels of the project, from the label cache if possible."""
+        labels = self.labels.get(project_id)
+        if labels is None:
+            gl_project = self.gl.projects.get(project_id, lazy=True)
+            labels = self.labels.set(
+                project_id,
+                (label.attributes for label in gl_project.labels.list(get_all=True)),
+            )
+        return labels
+
+    async def project_labels_async(
+        self, gl: gitlab_async.AsyncGitlab, project_id: int
+    ) -> dict[str, dict[str, Any]]:
+        labels = self.labels.get(project_id)
+        if labels is None:
+            labels = self.labels.set(project_id, await gl.list_labels(project_id))
+        return labels
+
+    def save_move(
+        self,
+        project_id: int,
+        iid: int,
+        new_label: MoveTarget,
+        changes: dict[str, Any],
+    ) -> tuple[dict[str, Any], dict[str, dict[str, Any]]]:
+        """Save a move, return the saved issue and the labels of its project."""
+        # can only retreive single issues from project not from complese instance
+        gl_project = self.gl.projects.get(project_id, lazy=True)
+        project_labels = self.project_labels(project_id)
+        if isinstance(new_label, models.Label) and new_label.name not in project_labels:
+            # handle adding a real new label
+            new_label_data = new_label.model_dump()
+            gl_project.labels.create(new_label_data)
+            project_labels = self.labels.add(project_id, new_label_data)
+        new_issue: dict[str, Any] = gl_project.issues.update(iid, changes)
+        if missing := self._missing_labels(new_issue, project_labels):
+            logger.debug(f"Reloading labels of {project_id}, missing {missing}")
+            self.labels.invalidate(project_id)
+            project_labels = self.project_labels(project_id)
+        return new_issue, project_labels
+
+    async def save_move_async(
+        self,
+        project_id: int,
+        iid: int,
+        new_label: MoveTarget,
+        changes: dict[str, Any],
+    ) -> tuple[dict[str, Any], dict[str, dict[str, Any]]]:
+        gl = self.async_gl
+        if gl is None:
+            return await asyncio.to_thread(
+                self.save_move, project_id, iid, new_label, changes
+            )
+        project_labels = await self.project_labels_async(gl, project_id)
+        if isinstance(new_label, models.Label) and new_label.name not in project_labels:
+            # handle adding a real new label
+            new_label_data = new_label.model_dump()
+            await gl.create_label(project_id, new_label_data)
+            project_labels = self.labels.add(project_id, new_label_data)
+        new_issue = await gl.update_issue(project_id, iid, changes)
+        if missing := self._missing_labels(new_issue, project_labels):
+            logger.debug(f"Reloading labels of {project_id}, missing {missing}")
+            self.labels.invalidate(project_id)
+            project_labels = await self.project_labels_async(gl, project_id)
+        return new_issue, project_labels
+
+    @staticmethod
+    def _missing_labels(
+        new_issue: dict[str, Any], project_labels: dict[str, dict[str, Any]]
+    ) -> set[str]:
+        """Return the labels of the saved issue not known (e.g. created meanwhile)."""
+        return set(new_issue.get("labels", ())) - project_labels.keys()
+
+    def _page_concurrency(self) -> int:
+        """Pages to request at once, only the first (full) refresh is paginated."""
+        if self.last_updated:
+            return 1
+        return self.page_concurrency
+
+    def list_assigned(self) -> Iterable[Any]:
+        """List the issues assigned to me changed since the last refresh."""
+        if self.sync == "graphql":
+            return self._list_assigned_graphql()
+        return self._list_issues("assigned_to_me")
+
+    def list_assigned_async(
+        self, gl: gitlab_async.AsyncGitlab
+    ) -> AsyncIterator[gitlab_async.JSON]:
+        """Same as *list_assigned*, but with the async backend"""
+        if self.sync == "graphql":
+            return self._list_assigned_graphql_async(gl)
+        return gl.list_issues(
+            "assigned_to_me",
+            updated_after=self.last_updated,
+            concurrency=self._page_concurrency(),
+        )
+
+    def _list_assigned_graphql(self) -> Iterator[gitlab_graphql.JSON]:
+        url = f"{self.gl.url}{gitlab_graphql.GRAPHQL_PATH}"
+        cursor: str | None = None
+        while True:
+            request = gitlab_graphql.assigned_issues_request(self.last_updated, cursor)
+            response = self.gl.http_post(url, post_data=request)
+            assert isinstance(response, dict), "GraphQL responses are objects"
+            issues, cursor = gitlab_graphql.parse_assigned_issues(response)
+            yield from issues
+            if cursor is None:
+                return
+
+    async def _list_assigned_graphql_async(
+        self, gl: gitlab_async.AsyncGitlab
+    ) -> AsyncIterator[gitlab_graphql.JSON]:
+        cursor: str | None = None
+        while True:
+            request = gitlab_graphql.assigned_issues_request(self.last_updated, cursor)
+            response = await gl.graphql(request)
+            issues, cursor = gitlab_graphql.parse_assigned_issues(response)
+            for issue in issues:
+                yield issue
+            if cursor is None:
+                return
+
+    def _list_issues(self, scope: str) -> Iterable[Any]:
+        """List the issues of *scope* changed since the last refresh."""
+        params: dict[str, Any] = {"scope": scope, "with_labels_details": True}
+        if self.last_updated:
+            params["updated_after"] = self.last_updated
+        concurrency = self._page_concurrency()
+        if concurrency > 1:
+            return self._list_pages_concurrently(params, concurrency)
+        return self.gl.issues.list(iterator=True, **params)
+
+    def _list_pages_concurrently(
+        self, params: dict[str, Any], concurrency: int
+    ) -> Iterator[dict[str, Any]]:
+        """
+        Yield the issues in page order, requesting up to *concurrency* pages at once
+
+        The number of pages is taken from the first page. Gitlab omits it for
+        large listings, these are requested page by page.
+        """
+        query = {**params, "per_page": PER_PAGE}
+
+        def get_page(page: int) -> Any:
+            return self.gl.http_get("/issues", query_data=query | {"page": page})
+
+        first = self.gl.http_get("/issues", query_data=query | {"page": 1}, raw=True)
+        assert not isinstance(first, dict), "raw responses are returned"
+        yield from first.json()
+        total_pages = first.headers.get("X-Total-Pages")
+        if not total_pages:
+            # the link contains the query, passing page=2 again would repeat it
+            if next_url := first.links.get("next", {}).get("url"):
+                yield from self.gl.http_list(next_url, iterator=True)
+            return
+        pool = ThreadPoolExecutor(concurrency, "gitlab-pages")
+        try:
+            # map returns the pages in order while requesting the following ones
+            for page in pool.map(get_page, range(2, int(total_pages) + 1)):
+                yield from page
+        finally:
+            pool.shutdown(cancel_futures=True)
+
+    def list_project_issues(self, project_id: int, iids: Collection[int]) -> Any:
+        """List the issues of the project with *iids* changed since the last refresh"""
+        gl_project = self.gl.projects.get(project_id, lazy=True)
+        return gl_project.issues.list(
+            iterator=True,
+            iids=iids,
+            updated_after=self.last_updated,
+            with_labels_details=True,
+        )
+
+
+class Issues:
+    """
+    Handles issues assigned to a user on all configured gitlab instances
+
+    Several processes can share the cache, only one of them refreshes an instance
+    at a time (see *refresh*), the others load the changed issues from disk.
+    """
 
     def __init__(self) -> None:
-        self._gl = get_gitlab()
-        self._cache = caching.IssueCacheDict()
-        self._cache.remove(not_assigned_to_me)
-        # initialized with the last time the cache was updated
-        # currently this is the time the last issues was updated.
-        # TODO: Change it to the last time refresh was executed
-        self._last_updated = self._cache.last_updated
-
-    def assign_new_labels(
+        config = settings.load_settings().gitlab
+        self._instances = tuple(
+            Instance(config_section, config)
+            for config_section in (config.config_section, *config.config_sections)
+        )
+        self._journal = move_journal.MoveJournal(settings.data_dir() / "moves.json")
+        #: held while sending moves, so only one process sends the moves of the journal
+        self._send_lock = file_lock.FileLock(settings.data_dir() / "send_moves.lock")
+        self._move_delay = config.move_delay
+        self._retry_delay = config.retry_delay
+        self._max_retry_delay = config.max_retry_delay
+        board_scoped = settings.load_settings().cache.board_scoped
+        # projects are loaded once a board needs them (see *load_for_board*)
+        self._cache = caching.IssueCacheDict(project_ids=() if board_scoped else None)
+        #: the refresh of *refresh_async* that is running, joined by other callers
+        self._running_refresh: asyncio.Task[RefreshResult] | None = None
+        for board in data.load_label_boards():
+            self.set_referenced(board)
+
+    def _instance(self, namespaced_id: int) -> Instance:
+        """Return the instance of a namespaced issue or project id."""
+        for instance in self._instances:
+            if instance.owns(namespaced_id):
+                return instance
+        raise KeyError(f"No gitlab instance configured for id {namespaced_id}")
+
+    def _not_assigned_to_me(self, issue: models.IssueLike) -> bool:
+        """
+        Return True if the issue isn't assigned to me on its instance, or its
+        instance isn't configured anymore
+        """
+        try:
+            instance = self._instance(issue.id)
+        except KeyError:
+            return True
+        return instance.not_assigned_to_me(issue)
+
+    def _resolve_user(self, instance: Instance) -> None:
+        """
+        Authenticate at *instance* once, load its sync cursor and remove the cached
+        issues not assigned to me
+
+        Done by the first refresh of the instance, so unreachable instances don't
+        delay the start.
+        """
+        if instance.user is not None:
+            return
+        instance.user = get_gitlab_user(instance.config_section)
+        if instance.last_updated is None:
+            instance.last_updated = self._load_last_updated(instance)
+        self._cache.remove(self._not_assigned_to_me)
+
+    def _load_last_updated(self, instance: Instance) -> datetime | None:
+        """
+        Return the start time of the last successful refresh of *instance*, None if
+        a full refresh is needed.
+        """
+        if self._cache.is_empty():
+            return None
+        last_refresh = sync_state.get_last_refresh(instance.url, instance.username)
+        if last_refresh is None and not instance.namespace:
+            # cache was filled before the sync state was persisted
+            self.load_projects()
+            return self._cache.last_updated
+        return last_refresh
+
+    @property
+    def fully_loaded(self) -> bool:
+        """True if the issues of all projects are loaded."""
+        return self._cache.loaded_projects is None
+
+    def load_projects(self, project_ids: Collection[int] | None = None) -> None:
+        """Load the cached issues of the given projects (all if None)."""
+        self._cache.load_projects(project_ids)
+        self._cache.remove(self._not_assigned_to_me)
+
+    def board_project_ids(self, board: models.LabelBoard) -> frozenset[int] | None:
+        """
+        Return the ids of the projects that can contribute issues to *board*.
+
+        None if issues of any project can, i.e. for boards with opened or closed
+        card.
+        """
+        if board.has_opened or board.has_closed:
+            return None
+        return self._cache.label_project_ids(
+            [label.name for label in board.card_labels]
+        )
+
+    def load_for_board(self, board: models.LabelBoard) -> None:
+        """Load the cached issues of all projects that can be shown on *board*."""
+        self.load_projects(self.board_project_ids(board))
+
+    def prefetch_labels(self) -> None:
+        """Fill the label cache for all projects of the cached issues."""
+        for project_id in self._cache.project_ids():
+            try:
+                instance = self._instance(project_id)
+                instance.project_labels(instance.local_id(project_id))
+            except Exception as e:
+                logger.warning(
+                    f"Failed to load labels of project {project_id}: "
+                    f"{type(e).__name__}: {e}"
+                )
+
+    async def prefetch_labels_async(self) -> None:
+        """Same as *prefetch_labels*, but on the event loop with the async backend"""
+        if all(instance.async_gl is None for instance in self._instances):
+            await asyncio.to_thread(self.prefetch_labels)
+            return
+
+        async def prefetch(project_id: int) -> None:
+            instance = self._instance(project_id)
+            local_id = instance.local_id(project_id)
+            if instance.async_gl is None:
+                await asyncio.to_thread(instance.project_labels, local_id)
+            else:
+                await instance.project_labels_async(instance.async_gl, local_id)
+
+        results = await asyncio.gather(
+            *(prefetch(project_id) for project_id in self._cache.project_ids()),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning(
+                    f"Failed to load labels: {type(result).__name__}: {result}"
+                )
+
+    async def _save_move_async(
+        self,
+        project_id: int,
+        iid: int,
+        new_label: MoveTarget,
+        changes: dict[str, Any],
+    ) -> None:
+        instance = self._instance(project_id)
+        new_issue, project_labels = await instance.save_move_async(
+            instance.local_id(project_id), iid, new_label, changes
+        )
+        self._update_moved(instance, new_issue, project_labels)
+
+    def move(
         self,
         issue: models.Issue,
-        new_label: models.Label | Literal["opened", "closed"],
+        new_label: MoveTarget,
         old_labels: Iterable[models.Label],
     ) -> None:
         """
-        Assign *issue* with *new_label* while removing *old_labels*
+        Move *issue* to the card of *new_label* from the cards of *old_labels*.
+
+        The move is applied to the cache at once and recorded in the journal, the
+        *move_worker* sends it to gitlab. Moves of an issue following within the
+        move delay supersede it, so only the last one is sent.
         """
-        # can only retreive single issues from project not from complese instance
-        gl_project = self._gl.projects.get(issue.project_id)
-        project_labels: dict[str, dict[str, Any]] = {
-            label.name: label.attributes
-            for label in gl_project.labels.list(get_all=True)
-        }
-        gl_issue = gl_project.issues.get(issue.iid)
-        old_label_names = {label.name for label in old_labels}
-        new_labels = set(gl_issue.labels) - old_label_names
-        if isinstance(new_label, models.Label):
-            # handle adding a real new label
-            new_labels |= {new_label.name}
-            if new_label.name not in project_labels:
-                new_label_data = new_label.model_dump()
-                gl_project.labels.create(new_label_data)
-                project_labels[new_label.name] = new_label_data
-        if new_label == "closed":
-            if gl_issue.state != "closed":
-                # close issues that need to be closed
-                gl_issue.state_event = "close"
-        elif gl_issue.state == "closed":
-            # reopen closed issue if moved from closed
-            gl_issue.state_event = "reopen"
-        gl_issue.labels = sorted(new_labels)
-        new_issue: dict[str, Any] = gl_issue.save() or {}
+        move = self._journal.put(
+            move_journal.Move(
+                issue_id=issue.id,
+                project_id=issue.project_id,
+                iid=issue.iid,
+                new_label=new_label,
+                old_labels=tuple(old_labels),
+                state=issue.state,
+                requested=datetime.now(UTC),
+            )
+        )
+        self._apply_move(move)
+
+    def pending_moves(self) -> Mapping[models.IssueID, move_journal.Move]:
+        """Return the moves not sent to gitlab yet by issue."""
+        return self._journal.moves()
+
+    def _apply_move(self, move: move_journal.Move) -> None:
+        """Show the *move* in the cache as if gitlab applied it already."""
+        try:
+            issue = self._cache[move.issue_id]
+        except KeyError:
+            return
+        remove = {label.name for label in move.old_labels}
+        labels = tuple(label for label in issue.labels if label.name not in remove)
+        if isinstance(move.new_label, models.Label):
+            labels += (move.new_label,)
+        moved = issue.model_copy(update={"labels": labels, "state": move.target_state})
+        self._cache.update(moved.model_dump(), remove=lambda _: False)
+
+    def _apply_pending_moves(self) -> None:
+        """Apply the moves not sent yet, e.g. after the issues were refreshed."""
+        for move in self.pending_moves().values():
+            self._apply_move(move)
+
+    async def send_moves(self) -> None:
+        """
+        Send all due moves to gitlab, failed ones are retried with backoff.
+
+        Does nothing while another process (or task) is sending the moves.
+        """
+        if not self._send_lock.acquire(blocking=False):
+            logger.debug("Moves are sent by another process")
+            return
+        try:
+            await self._send_due_moves()
+        finally:
+            self._send_lock.release()
+
+    async def _send_due_moves(self) -> None:
+        delay = timedelta(seconds=self._move_delay)
+        for move in self.pending_moves().values():
+            now = datetime.now(UTC)
+            if not move.is_due(now, delay):
+                continue
+            changes = label_changes(move.state, move.new_label, move.old_labels)
+            try:
+                await self._save_move_async(
+                    move.project_id, move.iid, move.new_label, changes
+                )
+            except Exception as e:
+                backoff = min(
+                    self._retry_delay * 2**move.attempts, self._max_retry_delay
+                )
+                error = f"{type(e).__name__}: {e}"
+                logger.warning(
+                    f"Failed to move issue {move.issue_id}, retrying in "
+                    f"{backoff:.0f}s: {error}"
+                )
+                self._journal.failed(move, error, now + timedelta(seconds=backoff))
+            else:
+                self._journal.done(move)
+                # the issue returned by gitlab doesn't contain newer moves yet
+                if (newer := self.pending_moves().get(move.issue_id)) is not None:
+                    self._apply_move(newer)
+
+    async def move_worker(self) -> None:
+        """Send the moves of the journal to gitlab, until cancelled."""
+        while True:
+            try:
+                await self.send_moves()
+            except Exception:
+                logger.exception("Failed to send moves")
+            await asyncio.sleep(self._move_delay)
+
+    def _update_moved(
+        self,
+        instance: Instance,
+        new_issue: dict[str, Any],
+        project_labels: dict[str, dict[str, Any]],
+    ) -> None:
+        """Put the issue returned by saving a move into the cache."""
         if not new_issue:
             return
-        # replace the label names with label attributes
+        new_issue = instance.namespaced(new_issue)
+        known_labels: dict[str, dict[str, Any]] = {}
+        with contextlib.suppress(KeyError):
+            issue = self._cache[new_issue["id"]]
+            known_labels = {label.name: label.model_dump() for label in issue.labels}
+        # replace the label names with label attributes, labels still unknown are
+        # added by the next refresh
         new_issue["labels"] = [
-            project_labels[label] for label in tuple(new_issue["labels"])
+            details
+            for label in tuple(new_issue["labels"])
+            if (details := project_labels.get(label) or known_labels.get(label))
         ]
-        self._cache.update(new_issue, not_assigned_to_me)
+        self._cache.update(new_issue, self._not_assigned_to_me)
 
     def __getitem__(self, item: models.IssueID) -> models.Issue:
         return self._cache[item]
 
+    def get_in(
+        self, version: caching.CacheVersion, item: models.IssueID
+    ) -> models.Issue:
+        """Return the issue as of *version* (see *current*)."""
+        return self._cache.get_in(version, item)
+
     def __len__(self) -> int:
         return len(self._cache)
 
     def values(self) -> Iterable[models.Issue]:
         yield from self._cache.values()
 
+    def summaries(self) -> Iterable[caching.IssueSummary]:
+        """Issue fields needed for sorting, without validating all issues."""
+        yield from self._cache.summaries()
+
     def keys(self) -> tuple[models.IssueID, ...]:
         return self._cache.keys()
 
-    def refresh(self) -> str | Literal[True]:
+    @property
+    def current(self) -> caching.CacheVersion:
+        """Consistent version of all issues, not changed by running refreshes."""
+        return self._cache.current
+
+    def labels(self) -> Mapping[str, models.Label]:
+        """Return the most used definition of every label used by the issues."""
+        return self._cache.labels()
+
+    def project_ids(self) -> frozenset[int]:
+        """Return the ids of all projects the issues belong to."""
+        return self._cache.project_ids()
+
+    def set_referenced(self, board: models.LabelBoard) -> None:
+        """Keep the issues shown on *board* in memory."""
+        self._cache.set_referenced(
+            board.id, (issue_id for card in board.cards for issue_id in card.issues)
+        )
+
+    def tier_stats(self) -> dict[Literal["hot", "cold"], caching.TierStats]:
+        """Return the number and memory usage of hot and cold cached issues."""
+        return self._cache.tier_stats()
+
+    def refresh_from_disk(self) -> None:
+        """Load issues changed on disk by other processes (cheap if unchanged)."""
+        self._cache.refresh_from_disk()
+
+    def flush(self) -> None:
+        """Ensure all changed issues are written to disk."""
+        self._cache.flush()
+
+    def close(self) -> None:
+        """Write all changed issues and stop writing in the background."""
+        self._cache.close()
+
+    async def aclose(self) -> None:
+        """Like *close*, also closing the connections of the async backend."""
+        for instance in self._instances:
+            if instance.async_gl is not None:
+                await instance.async_gl.aclose()
+        self.close()
+
+    def _adopt_last_refresh(self, instance: Instance) -> bool:
         """
-        Refresh data from gitlab
+        Use the last refresh of *instance* by another process if it is newer than
+        ours.
 
-        Return True is success else return the error message
+        Only valid once the issues it wrote are loaded, as they are written before
+        the sync state. Return True if adopted.
         """
-        self._cache.refresh_from_disk()
-        start = datetime.now(UTC)
+        last_refresh = sync_state.get_last_refresh(instance.url, instance.username)
+        if last_refresh is None or (
+            instance.last_updated is not None and last_refresh <= instance.last_updated
+        ):
+            return False
+        instance.last_updated = last_refresh
+        return True
+
+    def refresh(self) -> RefreshResult:
+        """
+        Refresh data from all gitlab instances concurrently
+
+        Only one process refreshes an instance at a time. If another one is
+        refreshing it already, wait for it and use its result instead of refreshing
+        again. A slow instance doesn't delay the changes of the others.
+        """
+        counts: list[Counter[caching.UpdateOutcome]] = [
+            Counter() for _ in self._instances
+        ]
+        with ThreadPoolExecutor(len(self._instances), "gitlab-refresh") as pool:
+            results = list(pool.map(self._refresh_instance, self._instances, counts))
+        return self._finish_refresh(results, counts)
+
+    async def refresh_async(self) -> RefreshResult:
+        """
+        Same as *refresh*, but on the event loop with the async backend
+
+        Callers while a refresh is running get the result of that refresh.
+        """
+        running = self._running_refresh
+        if running is None or running.done():
+            running = self._running_refresh = asyncio.create_task(
+                self._refresh_all_async()
+            )
+        # a cancelled caller (e.g. a closed page) doesn't cancel it for the others
+        return await asyncio.shield(running)
+
+    async def _refresh_all_async(self) -> RefreshResult:
+        counts: list[Counter[caching.UpdateOutcome]] = [
+            Counter() for _ in self._instances
+        ]
+        results = await asyncio.gather(
+            *(
+                self._refresh_instance_async(instance, instance_counts)
+                for instance, instance_counts in zip(
+                    self._instances, counts, strict=True
+                )
+            )
+        )
+        # writing the snapshot reads and fsyncs all issues
+        return await asyncio.to_thread(self._finish_refresh, results, counts)
+
+    def _refresh_instance(
+        self, instance: Instance, counts: Counter[caching.UpdateOutcome]
+    ) -> str | Literal[True]:
+        try:
+            self._resolve_user(instance)
+        except Exception as e:
+            return self._refresh_failed(instance, e)
+        waited = not instance.refresh_lock.acquire(blocking=False)
+        if waited:
+            instance.refresh_lock.acquire()
         try:
-            if self._last_updated:
-                # we already have some issues inside the cache
-                # so new changed issues could have been unassigned,
-                # so we need to load all changed issues to account for this
-                for issue in self._gl.issues.list(
-                    iterator=True,
-                    scope="all",
-                    updated_after=self._last_updated,
-                    with_labels_details=True,
-                ):
-                    self._cache.update(issue, remove=not_assigned_to_me)
+            if self._refreshed_by_other(instance, waited):
+                return True
+            start = datetime.now(UTC)
+            try:
+                self._load_for_delta(instance)
+                assigned = [
+                    instance.namespaced(issue) for issue in instance.list_assigned()
+                ]
+                seen = {models.IssueID(issue["id"]) for issue in assigned}
+                unassigned: list[dict[str, Any]] = []
+                inaccessible: set[int] = set()
+                for project_id, iids in self._maybe_unassigned(instance, seen):
+                    if project_id in inaccessible:
+                        continue
+                    try:
+                        unassigned.extend(
+                            instance.namespaced(issue)
+                            for issue in instance.list_project_issues(project_id, iids)
+                        )
+                    except Exception as e:
+                        self._project_inaccessible(instance, project_id, e)
+                        inaccessible.add(project_id)
+                self._apply_refreshed(
+                    instance, start, assigned + unassigned, counts, inaccessible
+                )
+            except Exception as e:
+                return self._refresh_failed(instance, e)
+            return True
+        finally:
+            instance.refresh_lock.release()
 
-            else:
-                for issue in self._gl.issues.list(
-                    iterator=True, scope="assigned_to_me", with_labels_details=True
-                ):
-                    # we know that the issues are assigned to me, no more checks needd
-                    self._cache.update(issue, remove=lambda _: False)
+    async def _refresh_instance_async(
+        self, instance: Instance, counts: Counter[caching.UpdateOutcome]
+    ) -> str | Literal[True]:
+        gl = instance.async_gl
+        if gl is None:
+            return await asyncio.to_thread(self._refresh_instance, instance, counts)
+        try:
+            await asyncio.to_thread(self._resolve_user, instance)
         except Exception as e:
-            msg = f"Failed to refresh issues: {type(e).__name__}: {e}"
-            logger.warning(msg)
-            return msg
-        self._last_updated = start
+            return self._refresh_failed(instance, e)
+        waited = not instance.refresh_lock.acquire(blocking=False)
+        if waited:
+            await asyncio.to_thread(instance.refresh_lock.acquire)
+        try:
+            if await asyncio.to_thread(self._refreshed_by_other, instance, waited):
+                return True
+            start = datetime.now(UTC)
+            try:
+                await asyncio.to_thread(self._load_for_delta, instance)
+                assigned = [
+                    instance.namespaced(issue)
+                    async for issue in instance.list_assigned_async(gl)
+                ]
+                seen = {models.IssueID(issue["id"]) for issue in assigned}
+                unassigned: list[dict[str, Any]] = []
+                inaccessible: set[int] = set()
+                for project_id, iids in self._maybe_unassigned(instance, seen):
+                    if project_id in inaccessible:
+                        continue
+                    try:
+                        unassigned.extend(
+                            [
+                                instance.namespaced(issue)
+                                async for issue in gl.list_project_issues(
+                                    project_id,
+                                    iids,
+                                    updated_after=instance.last_updated,
+                                )
+                            ]
+                        )
+                    except Exception as e:
+                        self._project_inaccessible(instance, project_id, e)
+                        inaccessible.add(project_id)
+                # validating, writing and fsyncing the issues would block the UI
+                await asyncio.to_thread(
+                    self._apply_refreshed,
+                    instance,
+                    start,
+                    assigned + unassigned,
+                    counts,
+                    inaccessible,
+                )
+            except Exception as e:
+                return self._refresh_failed(instance, e)
+            return True
+        finally:
+            instance.refresh_lock.release()
+
+    def _refreshed_by_other(self, instance: Instance, waited: bool) -> bool:
+        """
+        Load the changes of other processes, return True if a refresh of *instance*
+        we *waited* for makes our own one unnecessary.
+        """
+        self._cache.refresh_from_disk()
+        if self._adopt_last_refresh(instance) and waited:
+            logger.info(f"{instance} was refreshed by another process")
+            return True
+        return False
+
+    def _load_for_delta(self, instance: Instance) -> None:
+        """
+        Load all projects before a delta refresh, as their issues could have been
+        unassigned
+        """
+        if instance.last_updated:
+            self._cache.load_projects()
+
+    def _maybe_unassigned(
+        self, instance: Instance, seen: Collection[models.IssueID]
+    ) -> Iterator[tuple[int, tuple[int, ...]]]:
+        """
+        Yield batches of iids by (gitlab) project id of the cached issues of
+        *instance* not listed as assigned to me by a delta refresh, they could have
+        been unassigned meanwhile.
+
+        So a refresh only requests issues related to me, instead of all issues
+        changed on the instance since the last refresh.
+        """
+        if not instance.last_updated:
+            return
+        by_project: dict[int, list[int]] = {}
+        for summary in self._cache.summaries():
+            if summary.id not in seen and instance.owns(summary.id):
+                project_id = instance.local_id(summary.project_id)
+                by_project.setdefault(project_id, []).append(summary.iid)
+        for project_id, iids in sorted(by_project.items()):
+            yield from (
+                (project_id, batch)
+                for batch in itertools.batched(sorted(iids), PER_PAGE)
+            )
+
+    @staticmethod
+    def _project_inaccessible(
+        instance: Instance, project_id: int, error: Exception
+    ) -> None:
+        """
+        Raise *error* unless it tells the project of *instance* can't be accessed
+        anymore (e.g. it was deleted or I was removed from it)
+        """
+        if isinstance(error, gitlab.GitlabError):
+            status = error.response_code
+        elif isinstance(error, httpx.HTTPStatusError):
+            status = error.response.status_code
+        else:
+            raise error
+        if status not in INACCESSIBLE_STATUS:
+            raise error
+        logger.warning(
+            f"Project {project_id} of {instance} is not accessible anymore, "
+            f"removing its issues: {type(error).__name__}: {error}"
+        )
+
+    def _apply_refreshed(
+        self,
+        instance: Instance,
+        start: datetime,
+        issues: Iterable[dict[str, Any]],
+        counts: Counter[caching.UpdateOutcome],
+        inaccessible: Collection[int] = (),
+    ) -> None:
+        """
+        Put the issues listed by a refresh of *instance* started at *start* in the
+        cache and remove the ones of its *inaccessible* projects, counting the
+        outcomes in *counts*
+        """
+
+        def of_inaccessible(issue: models.IssueLike) -> bool:
+            if not instance.owns(issue.id):
+                return False
+            if instance.local_id(issue.project_id) not in inaccessible:
+                return False
+            counts["removed"] += 1
+            return True
+
+        # persist all changes of a refresh in a single transaction, the issues are
+        # listed before, so slow instances don't block the cache for the others
+        with self._cache.batch():
+            for issue in issues:
+                outcome = self._cache.update(issue, remove=self._not_assigned_to_me)
+                counts[outcome] += 1
+            if inaccessible:
+                self._cache.remove(of_inaccessible)
+            # gitlab doesn't know the moves not sent yet
+            self._apply_pending_moves()
+        # the sync state may only be persisted once the issues are written
+        self._cache.flush()
+        sync_state.set_last_refresh(instance.url, instance.username, start)
+        instance.last_updated = start
+        logger.debug(
+            f"Gitlab requests to {instance.url}: "
+            f"{get_scheduler(instance.config_section).stats()}"
+        )
+
+    def _finish_refresh(
+        self,
+        results: Iterable[str | Literal[True]],
+        counts: Iterable[Counter[caching.UpdateOutcome]],
+    ) -> RefreshResult:
+        """Combine the *results* and *counts* of the instances."""
+        self._cache.write_snapshot()
+        total: Counter[caching.UpdateOutcome] = sum(counts, Counter())
+        logger.info(f"Refreshed issues: {dict(total)}")
+        logger.debug(f"Cached issues by tier: {self.tier_stats()}")
+        errors = [result for result in results if isinstance(result, str)]
+        return RefreshResult("\n".join(errors) if errors else True, total)
+
+    def update_pushed(self, issue: dict[str, Any]) -> caching.UpdateOutcome:
+        """
+        Put an issue pushed by gitlab (e.g. by a webhook) into the cache.
+
+        Pushes older than the cached issue are ignored, as they might arrive late.
+        Pushes of instances not configured are ignored as well.
+        Attributes missing in pushes (None) are completed, see *_complete_pushed*.
+        """
+        for instance in self._instances:
+            if issue["web_url"].startswith(f"{instance.url.rstrip('/')}/"):
+                break
+        else:
+            return "ignored"
+        issue = instance.namespaced(issue)
+        issue_id = models.IssueID(issue["id"])
+        cached: models.Issue | None = None
+        with contextlib.suppress(KeyError):
+            cached = self._cache[issue_id]
+        if cached is not None and cached.updated_at > issue["updated_at"]:
+            return "unchanged"
+        if not self._complete_pushed(instance, issue, cached):
+            logger.info(f"Pushed issue {issue_id} is left to the next refresh")
+            return "ignored"
+        outcome = self._cache.update(issue, remove=self._not_assigned_to_me)
+        if (move := self.pending_moves().get(issue_id)) is not None:
+            # gitlab doesn't know the move yet
+            self._apply_move(move)
+        return outcome
+
+    @staticmethod
+    def _complete_pushed(
+        instance: Instance, issue: dict[str, Any], cached: models.Issue | None
+    ) -> bool:
+        """
+        Complete the attributes missing in a pushed *issue* like a refresh lists them
+
+        Label text colors are taken from the *cached* issue or the labels of the
+        project, if the label has the same color, else computed like gitlab does.
+        Assignees are taken from the *cached* issue or me. Return False if the id of
+        an assignee is unknown.
+        """
+        known_labels: list[Mapping[str, Any]] = (
+            [label.model_dump() for label in cached.labels]
+            if cached is not None
+            else []
+        )
+        project_labels = instance.labels.get(instance.local_id(issue["project_id"]))
+        known_labels.extend((project_labels or {}).values())
+        for label in issue["labels"]:
+            if label["text_color"] is not None:
+                continue
+            label["text_color"] = next(
+                (
+                    known["text_color"]
+                    for known in known_labels
+                    if known["name"] == label["name"]
+                    and known["color"].lower() == label["color"].lower()
+                ),
+                models.label_text_color(label["color"]),
+            )
+        known_users = (
+            {user.username: user for user in cached.assignees} if cached else {}
+        )
+        if instance.user is not None:
+            known_users[instance.user.username] = instance.user
+        for assignee in issue["assignees"]:
+            if (user := known_users.get(assignee["username"])) is not None:
+                # payloads may contain other avatar urls than the REST API
+                assignee.update(id=user.id, avatar_url=user.avatar_url)
+            elif assignee["id"] is None:
+                return False
+            elif assignee["avatar_url"] is None:
+                assignee["avatar_url"] = ""
         return True
+
+    @staticmethod
+    def _refresh_failed(instance: Instance, error: Exception) -> str:
+        msg = f"Failed to refresh issues of {instance}: {type(error).__name__}: {error}"
+        logger.warning(msg)
+        return msg
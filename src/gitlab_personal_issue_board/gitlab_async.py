@@ -0,0 +1,229 @@
+"""
+Asyncio client for the gitlab REST API calls needed to sync issues
+
+An alternative to python-gitlab that runs directly on the event loop of the UI,
+so refreshes and label moves don't block a worker thread while waiting for gitlab.
+"""
+
+import asyncio
+import itertools
+import logging
+from collections import deque
+from collections.abc import AsyncIterator, Collection, Mapping
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Final, Self
+
+import httpx
+
+from .gitlab_graphql import GRAPHQL_PATH
+from .request_scheduler import RequestScheduler
+
+if TYPE_CHECKING:
+    import gitlab
+
+logger = logging.getLogger(__name__)
+
+type JSON = dict[str, Any]
+
+
+class AsyncGitlab:
+    """
+    Access a gitlab instance using at most *max_connections* at once
+
+    Requests are sent via *scheduler*, which is shared with the python-gitlab
+    connection to the same instance. Only implements the operations used by
+    *gitlab.Issues*. Errors are raised as *httpx.HTTPStatusError*.
+    """
+
+    #: items requested per page of a listing
+    per_page: Final[int] = 100
+
+    def __init__(
+        self,
+        url: str,
+        headers: Mapping[str, str],
+        max_connections: int = 4,
+        verify: bool | str = True,
+        timeout: float | None = None,
+        transport: httpx.AsyncBaseTransport | None = None,
+        scheduler: RequestScheduler | None = None,
+    ) -> None:
+        self.url = url.rstrip("/")
+        self.scheduler = scheduler or RequestScheduler(max_connections)
+        self._client = httpx.AsyncClient(
+            base_url=f"{self.url}/api/v4/",
+            headers=dict(headers),
+            limits=httpx.Limits(max_connections=max_connections),
+            verify=verify,
+            timeout=timeout,
+            transport=transport,
+        )
+
+    @classmethod
+    def from_gitlab(
+        cls,
+        gl: "gitlab.Gitlab",
+        max_connections: int = 4,
+        scheduler: RequestScheduler | None = None,
+    ) -> Self:
+        """Use the url and credentials of a configured python-gitlab connection."""
+        headers: dict[str, str] = {}
+        if gl.private_token:
+            headers["PRIVATE-TOKEN"] = gl.private_token
+        elif gl.oauth_token:
+            headers["Authorization"] = f"Bearer {gl.oauth_token}"
+        elif gl.job_token:
+            headers["JOB-TOKEN"] = gl.job_token
+        return cls(
+            gl.url,
+            headers,
+            max_connections=max_connections,
+            verify=gl.ssl_verify,
+            timeout=gl.timeout,
+            scheduler=scheduler,
+        )
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        params: Mapping[str, Any] | None = None,
+        json: JSON | None = None,
+    ) -> httpx.Response:
+        attempt = 0
+        while True:
+            async with self.scheduler.slot_async():
+                response = await self._client.request(
+                    method, path, params=params, json=json
+                )
+            self.scheduler.record(response.status_code, response.headers)
+            delay = self.scheduler.retry_delay(
+                method, attempt, response.status_code, response.headers
+            )
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+            attempt += 1
+        response.raise_for_status()
+        return response
+
+    async def _list(
+        self, path: str, params: Mapping[str, Any] | None = None
+    ) -> AsyncIterator[JSON]:
+        """Yield all items of a listing, following the `Link` header to next pages"""
+        url: str | None = path
+        page_params: Mapping[str, Any] | None = {
+            **(params or {}),
+            "per_page": self.per_page,
+        }
+        while url is not None:
+            response = await self._request("GET", url, params=page_params)
+            for item in response.json():
+                yield item
+            url = response.links.get("next", {}).get("url")
+            # the next link contains all parameters
+            page_params = None
+
+    async def _list_concurrently(
+        self, path: str, params: Mapping[str, Any], concurrency: int
+    ) -> AsyncIterator[JSON]:
+        """
+        Yield all items of a listing in page order, requesting up to *concurrency*
+        pages at once
+
+        The number of pages is taken from the first page. Gitlab omits it for
+        large listings, these are requested page by page.
+        """
+        query = {**params, "per_page": self.per_page}
+        response = await self._request("GET", path, params=query | {"page": 1})
+        for item in response.json():
+            yield item
+        total_pages = response.headers.get("X-Total-Pages")
+        if not total_pages:
+            if next_url := response.links.get("next", {}).get("url"):
+                async for item in self._list(next_url):
+                    yield item
+            return
+
+        def request(page: int) -> asyncio.Task[httpx.Response]:
+            return asyncio.create_task(
+                self._request("GET", path, params=query | {"page": page})
+            )
+
+        pages = iter(range(2, int(total_pages) + 1))
+        pending = deque(request(page) for page in itertools.islice(pages, concurrency))
+        try:
+            while pending:
+                response = await pending.popleft()
+                if (page := next(pages, None)) is not None:
+                    pending.append(request(page))
+                for item in response.json():
+                    yield item
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def list_issues(
+        self,
+        scope: str,
+        updated_after: datetime | None = None,
+        concurrency: int = 1,
+    ) -> AsyncIterator[JSON]:
+        """
+        List the issues of *scope* visible to the user, with label details.
+
+        With a *concurrency* above one, that many pages are requested at once.
+        """
+        params: dict[str, Any] = {"scope": scope, "with_labels_details": True}
+        if updated_after is not None:
+            params["updated_after"] = updated_after.isoformat()
+        if concurrency > 1:
+            return self._list_concurrently("issues", params, concurrency)
+        return self._list("issues", params)
+
+    def list_project_issues(
+        self,
+        project_id: int,
+        iids: Collection[int],
+        updated_after: datetime | None = None,
+    ) -> AsyncIterator[JSON]:
+        """List the issues of the project with the given *iids*, with label details."""
+        params: dict[str, Any] = {"iids[]": list(iids), "with_labels_details": True}
+        if updated_after is not None:
+            params["updated_after"] = updated_after.isoformat()
+        return self._list(f"projects/{project_id}/issues", params)
+
+    async def get_issue(self, project_id: int, iid: int) -> JSON:
+        response = await self._request("GET", f"projects/{project_id}/issues/{iid}")
+        result: JSON = response.json()
+        return result
+
+    async def update_issue(self, project_id: int, iid: int, attributes: JSON) -> JSON:
+        """Update the issue and return its new attributes (label names only)."""
+        response = await self._request(
+            "PUT", f"projects/{project_id}/issues/{iid}", json=attributes
+        )
+        result: JSON = response.json()
+        return result
+
+    async def list_labels(self, project_id: int) -> list[JSON]:
+        """List all labels available in the project, including group labels."""
+        return [label async for label in self._list(f"projects/{project_id}/labels")]
+
+    async def create_label(self, project_id: int, label: JSON) -> JSON:
+        response = await self._request(
+            "POST", f"projects/{project_id}/labels", json=label
+        )
+        result: JSON = response.json()
+        return result
+
+    async def graphql(self, request: JSON) -> JSON:
+        """Send a GraphQL *request* (query and variables) and return the response."""
+        response = await self._request(
+            "POST", f"{self.url}{GRAPHQL_PATH}", json=request
+        )
+        result: JSON = response.json()
+        return result
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
@@ -0,0 +1,120 @@
+"""
+Listing the assigned issues with the GraphQL API of gitlab
+
+The REST API returns many attributes not used by *models.Issue* (time stats, task
+completion, links, ...). The GraphQL query selects only the used fields, which
+reduces the transferred and parsed data of a refresh considerably.
+"""
+
+from datetime import datetime
+from typing import Any, Final
+
+type JSON = dict[str, Any]
+
+#: path of the GraphQL endpoint, relative to the url of the instance
+GRAPHQL_PATH: Final[str] = "/api/graphql"
+#: issues requested per page
+PER_PAGE: Final[int] = 100
+
+ASSIGNED_ISSUES_QUERY: Final[str] = """
+query assignedIssues($first: Int!, $after: String, $updatedAfter: Time) {
+  currentUser {
+    assignedIssues(first: $first, after: $after, updatedAfter: $updatedAfter) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        id
+        iid
+        title
+        description
+        state
+        labels { nodes { title color textColor description } }
+        assignees { nodes { id username name avatarUrl } }
+        webUrl
+        shortReference: reference
+        fullReference: reference(full: true)
+        createdAt
+        updatedAt
+        dueDate
+        projectId
+      }
+    }
+  }
+}
+"""
+
+
+class GraphQLError(Exception):
+    """Gitlab answered a GraphQL query with errors"""
+
+
+def _id(global_id: str) -> int:
+    """Return the id of a global id like `gid://gitlab/Issue/123`"""
+    return int(global_id.rsplit("/", 1)[-1])
+
+
+def assigned_issues_request(
+    updated_after: datetime | None = None, cursor: str | None = None
+) -> JSON:
+    """Return the request for the page of assigned issues after *cursor*."""
+    return {
+        "query": ASSIGNED_ISSUES_QUERY,
+        "variables": {
+            "first": PER_PAGE,
+            "after": cursor,
+            "updatedAfter": updated_after.isoformat() if updated_after else None,
+        },
+    }
+
+
+def issue_from_node(node: JSON) -> JSON:
+    """Convert an issue of the query to the issue attributes the REST API returns."""
+    return {
+        "id": _id(node["id"]),
+        "iid": int(node["iid"]),
+        "title": node["title"],
+        "description": node["description"],
+        "state": node["state"],
+        "labels": [
+            {
+                "name": label["title"],
+                "color": label["color"],
+                "text_color": label["textColor"],
+                "description": label["description"],
+            }
+            for label in node["labels"]["nodes"]
+        ],
+        "assignees": [
+            {
+                "id": _id(assignee["id"]),
+                "username": assignee["username"],
+                "name": assignee["name"],
+                "avatar_url": assignee["avatarUrl"] or "",
+            }
+            for assignee in node["assignees"]["nodes"]
+        ],
+        "web_url": node["webUrl"],
+        "references": {
+            "short": node["shortReference"],
+            "full": node["fullReference"],
+        },
+        "created_at": node["createdAt"],
+        "updated_at": node["updatedAt"],
+        "due_date": node["dueDate"],
+        "project_id": node["projectId"],
+    }
+
+
+def parse_assigned_issues(response: JSON) -> tuple[list[JSON], str | None]:
+    """
+    Return the issues of a page of the query and the cursor of the next page,
+    None for the last page.
+    """
+    if errors := response.get("errors"):
+        raise GraphQLError("; ".join(error.get("message", "") for error in errors))
+    user = response["data"]["currentUser"]
+    if user is None:
+        raise GraphQLError("Not authenticated")
+    connection = user["assignedIssues"]
+    page_info = connection["pageInfo"]
+    issues = [issue_from_node(node) for node in connection["nodes"]]
+    return issues, page_info["endCursor"] if page_info["hasNextPage"] else None
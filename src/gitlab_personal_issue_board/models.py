@@ -1,10 +1,26 @@
 import uuid
-from collections.abc import Container, Iterable, Mapping
+from collections.abc import Container, Hashable, Iterable, Mapping
 from datetime import datetime
 from itertools import chain
-from typing import TYPE_CHECKING, Annotated, Literal, NewType, assert_never
-
-from pydantic import AfterValidator, BaseModel, ConfigDict, Field
+from typing import (
+    TYPE_CHECKING,
+    Annotated,
+    Any,
+    Final,
+    Literal,
+    NewType,
+    Protocol,
+    assert_never,
+)
+
+from pydantic import (
+    AfterValidator,
+    BaseModel,
+    ConfigDict,
+    Field,
+    ValidationInfo,
+    field_validator,
+)
 
 from .model_validators import uniq, validate_label_cards
 
@@ -12,6 +28,22 @@ IssueID = NewType("IssueID", int)
 UserID = NewType("UserID", int)
 LabelBoardID = NewType("LabelBoardID", str)
 
+#: issue and project ids of an instance are offset by its namespace times this
+NAMESPACE_STRIDE: Final[int] = 2**40
+
+
+def namespaced_id(value: int, namespace: int) -> int:
+    """
+    Return the issue or project id *value* of the instance with *namespace*, unique
+    over all instances
+    """
+    return namespace * NAMESPACE_STRIDE + value
+
+
+def split_namespace(value: int) -> tuple[int, int]:
+    """Return the namespace and the id on the instance of a namespaced id."""
+    return divmod(value, NAMESPACE_STRIDE)
+
 
 class User(BaseModel):
     """A gitlab user"""
@@ -36,6 +68,23 @@ class Label(BaseModel):
         return f"Label ~{self.name}"
 
 
+def label_text_color(color: str) -> str:
+    """
+    Return the text color gitlab shows on labels with background *color*
+
+    Same as `Gitlab::Color#contrast` for hex colors with 3 or 6 digits, white for
+    any other color.
+    """
+    digits = color.removeprefix("#")
+    if len(digits) == 3:
+        digits = "".join(digit * 2 for digit in digits)
+    try:
+        rgb = bytes.fromhex(digits) if len(digits) == 6 else b""
+    except ValueError:
+        rgb = b""
+    return "#1F1E24" if rgb and sum(rgb) > 500 else "#FFFFFF"
+
+
 class Reference(BaseModel):
     """A gitlab issue reference"""
 
@@ -44,6 +93,25 @@ class Reference(BaseModel):
     full: str
 
 
+class InternPool:
+    """
+    Pool of hashable (frozen) instances, so equal instances are shared
+
+    Pass it as `intern` within the validation context of an *Issue* to share its
+    labels and assignees with all other issues validated with the same pool.
+    """
+
+    def __init__(self) -> None:
+        self._instances: dict[Any, Any] = {}
+
+    def intern[T: Hashable](self, value: T) -> T:
+        result: T = self._instances.setdefault(value, value)
+        return result
+
+    def __len__(self) -> int:
+        return len(self._instances)
+
+
 class Issue(BaseModel):
     """A gitlab issue"""
 
@@ -62,6 +130,49 @@ class Issue(BaseModel):
     state: Literal["opened", "closed"]
     due_at: datetime | None = None
 
+    @field_validator("labels", "assignees", mode="after")
+    @classmethod
+    def _intern(cls, value: tuple[Any, ...], info: ValidationInfo) -> tuple[Any, ...]:
+        context = info.context if isinstance(info.context, dict) else {}
+        pool: InternPool | None = context.get("intern")
+        if pool is None:
+            return value
+        return tuple(pool.intern(elem) for elem in value)
+
+    @property
+    def label_names(self) -> frozenset[str]:
+        return frozenset(label.name for label in self.labels)
+
+    @property
+    def assignee_usernames(self) -> frozenset[str]:
+        return frozenset(assignee.username for assignee in self.assignees)
+
+
+class IssueLike(Protocol):
+    """
+    Anything providing the fields of *Issue* needed to sort it into cards
+
+    Allows sorting issues without validating the complete *Issue*.
+    """
+
+    @property
+    def id(self) -> IssueID: ...
+
+    @property
+    def project_id(self) -> int: ...
+
+    @property
+    def state(self) -> Literal["opened", "closed"]: ...
+
+    @property
+    def label_names(self) -> frozenset[str]: ...
+
+    @property
+    def assignee_usernames(self) -> frozenset[str]: ...
+
+    @property
+    def updated_at(self) -> datetime: ...
+
 
 class LabelCard(BaseModel):
     """A card for issues defined by labels"""
@@ -82,16 +193,14 @@ class LabelCard(BaseModel):
     def is_label(self) -> bool:
         return isinstance(self.label, Label)
 
-    def valid(self, issue: Issue, distributed_issues: Container[IssueID]) -> bool:
+    def valid(self, issue: IssueLike, distributed_issues: Container[IssueID]) -> bool:
         """
         Return True if the given issue is a valid on for this card
 
         See *filter_issues_by_label*
         """
         if isinstance(self.label, Label):
-            return issue.state != "closed" and any(
-                label.name == self.label.name for label in issue.labels
-            )
+            return issue.state != "closed" and self.label.name in issue.label_names
         elif self.label == "opened":
             return issue.state == "opened" and issue.id not in distributed_issues
         elif self.label == "closed":
@@ -101,7 +210,7 @@ class LabelCard(BaseModel):
 
     def filtered_issues(
         self,
-        gitlab_issues: Mapping[IssueID, Issue],
+        gitlab_issues: Mapping[IssueID, IssueLike],
         distributed_issues: Container[IssueID],
     ) -> Iterable[IssueID]:
         """
@@ -182,3 +291,7 @@ if TYPE_CHECKING:
 
     # Ensure that CardLike is actually a protocol for LabelCard
     foo: CardLike = LabelCard(label="opened", issues=())
+
+    def _issue_like(issue: Issue) -> IssueLike:
+        # Ensure that IssueLike is actually a protocol for Issue
+        return issue
@@ -0,0 +1,153 @@
+"""
+Durable journal of issue moves not sent to gitlab yet
+
+Moves are applied to the cache immediately and sent to gitlab in the background,
+so the journal keeps them across restarts until gitlab accepted them.
+"""
+
+import logging
+from collections.abc import Mapping
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Literal
+
+from pydantic import BaseModel, ConfigDict
+
+from .cache_stores import FileCacheInfo, atomic_write, get_file_cache_info
+from .file_lock import FileLock
+from .models import IssueID, Label
+
+logger = logging.getLogger(__name__)
+
+type MoveTarget = Label | Literal["opened", "closed"]
+
+
+class Move(BaseModel):
+    """A move of an issue to the card of *new_label* from the cards of *old_labels*"""
+
+    model_config = ConfigDict(frozen=True)
+    issue_id: IssueID
+    project_id: int
+    iid: int
+    new_label: MoveTarget
+    old_labels: tuple[Label, ...]
+    #: state of the issue on gitlab before it was moved
+    state: Literal["opened", "closed"]
+    requested: datetime
+    #: failed attempts to send the move
+    attempts: int = 0
+    retry_at: datetime | None = None
+    #: error of the last failed attempt
+    error: str | None = None
+
+    @property
+    def target_state(self) -> Literal["opened", "closed"]:
+        """State of the issue once moved"""
+        return "closed" if self.new_label == "closed" else "opened"
+
+    def supersede(self, move: "Move") -> "Move":
+        """
+        Return *move* replacing this move of the same issue that wasn't sent yet
+        """
+        old_labels = dict.fromkeys(self.old_labels + move.old_labels)
+        return move.model_copy(
+            update={"state": self.state, "old_labels": tuple(old_labels)}
+        )
+
+    def is_due(self, now: datetime, delay: timedelta) -> bool:
+        """
+        Return True if the move should be sent, *delay* after it was requested
+        to wait for further moves of the issue
+        """
+        if self.retry_at is not None:
+            return self.retry_at <= now
+        return self.requested + delay <= now
+
+
+class Journal(BaseModel):
+    """Moves not sent yet, at most one per issue"""
+
+    model_config = ConfigDict(frozen=True)
+    moves: dict[IssueID, Move] = {}
+
+
+class MoveJournal:
+    """
+    Journal persisted in *path*, shared by all processes
+
+    Every change reads and replaces the file while holding a lock.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock = FileLock(path.with_name(f"{path.name}.lock"))
+        self._read_for: FileCacheInfo | None = None
+        self._journal = Journal()
+
+    def _read(self) -> Journal:
+        try:
+            info = get_file_cache_info(self.path)
+        except FileNotFoundError:
+            return Journal()
+        if info != self._read_for:
+            try:
+                self._journal = Journal.model_validate_json(self.path.read_bytes())
+            except FileNotFoundError:
+                return Journal()
+            except ValueError as e:
+                logger.error(f"Ignoring invalid move journal: {type(e).__name__}: {e}")
+                self._journal = Journal()
+            self._read_for = info
+        return self._journal
+
+    def _write(self, moves: dict[IssueID, Move]) -> None:
+        self._journal = Journal(moves=moves)
+        atomic_write(self.path, self._journal.model_dump_json(indent=2).encode())
+        self._read_for = get_file_cache_info(self.path)
+
+    def moves(self) -> Mapping[IssueID, Move]:
+        """Return the moves not sent yet by issue."""
+        return self._read().moves
+
+    def put(self, move: Move) -> Move:
+        """Record *move*, superseding a move of the issue not sent yet."""
+        with self._lock:
+            moves = dict(self._read().moves)
+            if (previous := moves.get(move.issue_id)) is not None:
+                move = previous.supersede(move)
+            moves[move.issue_id] = move
+            self._write(moves)
+        return move
+
+    def done(self, move: Move) -> None:
+        """Remove the sent *move*, unless it was superseded meanwhile."""
+        with self._lock:
+            moves = dict(self._read().moves)
+            current = moves.get(move.issue_id)
+            if current is None:
+                return
+            if current.requested == move.requested:
+                del moves[move.issue_id]
+            else:
+                # the superseding move starts from the state set by *move*
+                moves[move.issue_id] = current.model_copy(
+                    update={"state": move.target_state}
+                )
+            self._write(moves)
+
+    def failed(self, move: Move, error: str, retry_at: datetime) -> None:
+        """Record the failed attempt to send *move*, to retry it at *retry_at*."""
+        with self._lock:
+            moves = dict(self._read().moves)
+            current = moves.get(move.issue_id)
+            if current is None or current.requested != move.requested:
+                # superseded, the new move is sent instead
+                return
+            moves[move.issue_id] = current.model_copy(
+                update={
+                    "attempts": current.attempts + 1,
+                    "retry_at": retry_at,
+                    "error": error,
+                }
+            )
+            self._write(moves)
@@ -0,0 +1,73 @@
+"""
+Refreshing the issues in background while boards are open
+"""
+
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from typing import Final, Literal, Protocol
+
+logger = logging.getLogger(__name__)
+
+
+class RefreshOutcome(Protocol):
+    """Result of a refresh, see *gitlab.RefreshResult*"""
+
+    @property
+    def status(self) -> str | Literal[True]: ...
+
+    @property
+    def changes(self) -> int: ...
+
+
+class RefreshScheduler:
+    """
+    Refresh periodically, starting with *interval* seconds between refreshes
+
+    The interval is halved if a refresh found changes and grows if it found none
+    or failed, staying between *min_interval* and *max_interval*.
+    """
+
+    #: seconds between checks if a client connected
+    poll_interval: Final[float] = 1.0
+    #: factor the interval grows by after refreshes without changes
+    idle_factor: Final[float] = 1.5
+
+    def __init__(
+        self, interval: float, min_interval: float, max_interval: float
+    ) -> None:
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = self._bound(interval)
+
+    def _bound(self, interval: float) -> float:
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def adapt(self, result: str | Literal[True], changes: int) -> float:
+        """Adapt the interval to the *result* of a refresh and return it."""
+        if isinstance(result, str):
+            self.interval = self._bound(self.interval * 2)
+        elif changes:
+            self.interval = self._bound(self.interval / 2)
+        else:
+            self.interval = self._bound(self.interval * self.idle_factor)
+        return self.interval
+
+    async def run(
+        self,
+        refresh: Callable[[], Awaitable[RefreshOutcome]],
+        has_clients: Callable[[], bool],
+    ) -> None:
+        """Call *refresh* until cancelled, pausing while *has_clients* returns False"""
+        while True:
+            while not has_clients():
+                await asyncio.sleep(self.poll_interval)
+            try:
+                outcome = await refresh()
+            except Exception as e:
+                logger.exception("Background refresh failed")
+                interval = self.adapt(f"{type(e).__name__}: {e}", 0)
+            else:
+                interval = self.adapt(outcome.status, outcome.changes)
+            logger.debug(f"Next background refresh in {interval:.0f}s")
+            await asyncio.sleep(interval)
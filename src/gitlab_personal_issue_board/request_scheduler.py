@@ -0,0 +1,262 @@
+"""
+Scheduling of all requests to a gitlab instance
+
+Both backends send their requests through one *RequestScheduler*. It limits the
+connections used at once, follows the rate limit gitlab reports in its
+`RateLimit-*` and `Retry-After` headers and retries rate limited or failed requests.
+"""
+
+import asyncio
+import contextlib
+import email.utils
+import logging
+import random
+import threading
+import time
+from collections.abc import AsyncIterator, Iterator, Mapping
+from typing import Any, Final, NamedTuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+#: status codes of responses worth retrying
+RETRY_STATUS: Final[frozenset[int]] = frozenset({429, 500, 502, 503, 504})
+#: methods safe to send again after a failed (5xx) response
+IDEMPOTENT_METHODS: Final[frozenset[str]] = frozenset(
+    {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+)
+
+
+class SchedulerStats(NamedTuple):
+    """Load of a *RequestScheduler*"""
+
+    #: requests waiting for a connection or the rate limit
+    queued: int
+    #: requests sent and not answered yet
+    in_flight: int
+    #: requests sent, including retries
+    sent: int
+    #: requests sent again after a rate limited or failed response
+    retried: int
+    #: seconds all requests waited before they were sent
+    total_wait: float
+    #: longest time a request waited before it was sent
+    max_wait: float
+    #: requests left in the current rate limit window, None if not reported
+    remaining: int | None
+
+
+def _retry_after(headers: Mapping[str, str]) -> float | None:
+    """Return the seconds to wait given by the `Retry-After` header."""
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(date.timestamp() - time.time(), 0.0)
+
+
+class RequestScheduler:
+    """
+    Send at most *max_connections* requests at once and respect the rate limit
+
+    Once less than *reserve* of the rate limit window is left, requests are spread
+    evenly until the window resets, so the limit isn't hit by a large refresh.
+    Rate limited (429) and failed (5xx) responses are retried up to *max_retries*
+    times with a jittered exponential backoff starting at *backoff* seconds. Failed
+    responses of non idempotent requests (e.g. creating a label) aren't retried, as
+    gitlab might have applied them.
+    """
+
+    #: seconds between checks if a request may be sent
+    poll_interval: Final[float] = 0.05
+
+    def __init__(
+        self,
+        max_connections: int = 4,
+        max_retries: int = 5,
+        backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        reserve: float = 0.1,
+    ) -> None:
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.reserve = reserve
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._in_flight = 0
+        self._sent = 0
+        self._retried = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        #: rate limit as last reported by gitlab
+        self._limit: int | None = None
+        self._remaining: int | None = None
+        #: monotonic time the rate limit window resets
+        self._reset_at: float | None = None
+        #: monotonic time no request may be sent before
+        self._blocked_until = 0.0
+        self._last_sent = 0.0
+
+    def stats(self) -> SchedulerStats:
+        with self._lock:
+            return SchedulerStats(
+                queued=self._queued,
+                in_flight=self._in_flight,
+                sent=self._sent,
+                retried=self._retried,
+                total_wait=self._total_wait,
+                max_wait=self._max_wait,
+                remaining=self._remaining,
+            )
+
+    def _spacing(self, now: float) -> float:
+        """Seconds to keep between requests to not exceed the rate limit."""
+        if self._remaining is None or self._limit is None or self._reset_at is None:
+            return 0.0
+        if self._reset_at <= now:
+            # a new window started, its limits are learned from the next response
+            self._remaining = None
+            return 0.0
+        if self._remaining > self._limit * self.reserve:
+            return 0.0
+        return (self._reset_at - now) / max(self._remaining, 1)
+
+    def _try_start(self) -> float:
+        """Start a request and return 0, or return the seconds to wait."""
+        with self._lock:
+            now = time.monotonic()
+            if self._in_flight >= self.max_connections:
+                return self.poll_interval
+            if self._remaining == 0 and self._reset_at is not None:
+                start_at = max(self._blocked_until, self._reset_at)
+            else:
+                start_at = max(
+                    self._blocked_until, self._last_sent + self._spacing(now)
+                )
+            if start_at > now:
+                return start_at - now
+            self._in_flight += 1
+            self._sent += 1
+            self._last_sent = now
+            if self._remaining:
+                self._remaining -= 1
+            return 0.0
+
+    def _started(self, waited: float) -> None:
+        with self._lock:
+            self._queued -= 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+
+    def _finish(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+
+    @contextlib.contextmanager
+    def slot(self) -> Iterator[None]:
+        """Wait until a request may be sent, from a worker thread."""
+        with self._lock:
+            self._queued += 1
+        start = time.monotonic()
+        try:
+            while delay := self._try_start():
+                time.sleep(min(delay, self.max_backoff))
+        finally:
+            self._started(time.monotonic() - start)
+        try:
+            yield
+        finally:
+            self._finish()
+
+    @contextlib.asynccontextmanager
+    async def slot_async(self) -> AsyncIterator[None]:
+        """Wait until a request may be sent, on the event loop."""
+        with self._lock:
+            self._queued += 1
+        start = time.monotonic()
+        try:
+            while delay := self._try_start():
+                await asyncio.sleep(min(delay, self.max_backoff))
+        finally:
+            self._started(time.monotonic() - start)
+        try:
+            yield
+        finally:
+            self._finish()
+
+    def record(self, status: int, headers: Mapping[str, str]) -> None:
+        """Learn the rate limit from the headers of a response."""
+        with self._lock:
+            now = time.monotonic()
+            with contextlib.suppress(KeyError, ValueError):
+                self._limit = int(headers["RateLimit-Limit"])
+                self._remaining = int(headers["RateLimit-Remaining"])
+                self._reset_at = now + float(headers["RateLimit-Reset"]) - time.time()
+            if status == 429:
+                self._remaining = 0 if self._reset_at is not None else None
+                if (retry_after := _retry_after(headers)) is not None:
+                    self._blocked_until = max(self._blocked_until, now + retry_after)
+
+    def retry_delay(
+        self, method: str, attempt: int, status: int, headers: Mapping[str, str]
+    ) -> float | None:
+        """
+        Return the seconds to wait before sending the *method* request again, None
+        if the response of the *attempt* (counted from 0) shouldn't be retried
+        """
+        if status not in RETRY_STATUS or attempt >= self.max_retries:
+            return None
+        if status != 429 and method.upper() not in IDEMPOTENT_METHODS:
+            return None
+        with self._lock:
+            self._retried += 1
+        delay = min(self.backoff * 2.0**attempt, self.max_backoff)
+        # jitter, so requests failed together aren't sent again together
+        delay *= random.uniform(0.5, 1.0)  # noqa: S311
+        if status == 429 and (retry_after := _retry_after(headers)) is not None:
+            delay = max(delay, retry_after)
+        logger.info(f"Gitlab answered {status}, retrying in {delay:.1f}s")
+        return delay
+
+
+class ScheduledSession(requests.Session):
+    """
+    A requests session for python-gitlab sending all requests via *scheduler*
+
+    Keeps up to *max_connections* of the scheduler alive per host.
+    """
+
+    def __init__(self, scheduler: RequestScheduler) -> None:
+        super().__init__()
+        self.scheduler = scheduler
+        adapter = HTTPAdapter(pool_maxsize=scheduler.max_connections)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def send(
+        self, request: requests.PreparedRequest, **kwargs: Any
+    ) -> requests.Response:
+        attempt = 0
+        while True:
+            with self.scheduler.slot():
+                response = super().send(request, **kwargs)
+            self.scheduler.record(response.status_code, response.headers)
+            delay = self.scheduler.retry_delay(
+                request.method or "GET", attempt, response.status_code, response.headers
+            )
+            if delay is None:
+                return response
+            response.close()
+            time.sleep(delay)
+            attempt += 1
@@ -1,6 +1,6 @@
 import functools
 from pathlib import Path
-from typing import Final
+from typing import Final, Literal
 
 import attrs
 import platformdirs
@@ -30,11 +30,76 @@ def data_dir() -> Path:
 @attrs.frozen
 class GitlabSettings:
     config_section: str | None = None
+    #: config sections of further instances, their issues are shown on the boards too
+    config_sections: tuple[str, ...] = ()
+    #: talk to gitlab with python-gitlab in worker threads or natively with asyncio
+    backend: Literal["python-gitlab", "async"] = "python-gitlab"
+    #: list the assigned issues with the REST API or only the needed fields with
+    #: the GraphQL API
+    sync: Literal["rest", "graphql"] = "rest"
+    #: seconds to wait for an answer of gitlab, if the python-gitlab config sets none
+    timeout: float = 30.0
+    #: connections to gitlab used at most at once
+    max_connections: int = 4
+    #: times a rate limited (429) or failed (5xx) request is sent again
+    max_retries: int = 5
+    #: seconds to wait before sending a failed request again, doubled every time
+    request_backoff: float = 1.0
+    #: maximal seconds to wait before sending a failed request again
+    max_request_backoff: float = 60.0
+    #: share of the rate limit left at which requests are spread until it resets
+    rate_limit_reserve: float = 0.1
+    #: pages of all assigned issues requested at once by the first refresh
+    page_concurrency: int = 4
+    #: seconds the labels of a project are cached for moving issues
+    label_ttl: float = 300.0
+    #: seconds to wait for further moves of an issue before sending the last one
+    move_delay: float = 0.5
+    #: seconds to wait before sending a failed move again, doubled for every failure
+    retry_delay: float = 5.0
+    #: maximal seconds to wait before sending a failed move again
+    max_retry_delay: float = 600.0
+    #: secret token of gitlab webhooks posting issue changes, disabled if unset
+    webhook_secret: str | None = None
+
+
+@attrs.frozen
+class CacheSettings:
+    #: store all issues in one SQLite database or in one JSON file per issue
+    backend: Literal["sqlite", "json"] = "sqlite"
+    #: only validate cached issues once they are displayed
+    lazy: bool = True
+    #: keep the compressed issue attributes as received from gitlab for debugging
+    keep_raw: bool = False
+    #: write changed issues in the background instead of while refreshing
+    write_behind: bool = True
+    #: keep a packed snapshot of all issues for a fast start
+    snapshot: bool = True
+    #: bytes of closed issues not shown on any board that are kept in memory
+    cold_memory_budget: int = 16 * 1024 * 1024
+    #: only load the projects of the opened board first, the others in background
+    board_scoped: bool = True
+    #: seconds between checks of open boards for issues changed by other processes
+    watch_interval: float = 2.0
+
+
+@attrs.frozen
+class RefreshSettings:
+    #: refresh the issues periodically while a browser is connected
+    background: bool = True
+    #: seconds between background refreshes at start
+    interval: float = 300.0
+    #: seconds between background refreshes at least, while issues change often
+    min_interval: float = 60.0
+    #: seconds between background refreshes at most, while nothing changes
+    max_interval: float = 1800.0
 
 
 @attrs.frozen
 class Settings:
     gitlab: GitlabSettings = GitlabSettings()
+    cache: CacheSettings = CacheSettings()
+    refresh: RefreshSettings = RefreshSettings()
 
 
 def get_config_file() -> Path:
@@ -68,4 +133,7 @@ def debug_settings() -> None:
     if settings.gitlab.config_section:
         print(f"Using python gitlab config section {settings.gitlab.config_section}")
     print(f"Data is saved in '{data_dir()}'")
-    print(f"Cache files are stored in '{cache_dir()}'")
+    print(
+        f"Cache files are stored in '{cache_dir()}' "
+        f"using the {settings.cache.backend} backend"
+    )
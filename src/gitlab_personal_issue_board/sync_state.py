@@ -0,0 +1,92 @@
+"""
+Persist the state of the synchronisation with gitlab next to the issue cache
+"""
+
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Final
+
+from pydantic import BaseModel, ConfigDict
+
+from . import settings
+from .cache_stores import atomic_write
+from .file_lock import FileLock
+
+FILE_NAME: Final[str] = "sync_state.json"
+
+logger = logging.getLogger(__name__)
+
+
+class SyncState(BaseModel):
+    """State of the synchronisation with all gitlab instances"""
+
+    model_config = ConfigDict(frozen=True)
+    #: start time of the last successful refresh by instance url and username
+    last_refresh: dict[str, dict[str, datetime]] = {}
+    #: namespace of the issue and project ids by instance url
+    namespaces: dict[str, int] = {}
+
+
+def _sync_state_file() -> Path:
+    return settings.cache_dir() / FILE_NAME
+
+
+def _sync_state_lock() -> FileLock:
+    return FileLock(settings.cache_dir() / f"{FILE_NAME}.lock")
+
+
+def load_sync_state() -> SyncState:
+    try:
+        return SyncState.model_validate_json(_sync_state_file().read_bytes())
+    except FileNotFoundError:
+        return SyncState()
+    except ValueError as e:
+        logger.warning(f"Ignoring invalid sync state: {type(e).__name__}: {e}")
+        return SyncState()
+
+
+def get_last_refresh(instance: str, username: str) -> datetime | None:
+    """
+    Return the start time of the last successful refresh of *username* on *instance*
+    """
+    return load_sync_state().last_refresh.get(instance, {}).get(username)
+
+
+def set_last_refresh(instance: str, username: str, started: datetime) -> None:
+    """
+    Persist *started* as start time of the last successful refresh
+    """
+    # other processes could change the state of other instances or users meanwhile
+    with _sync_state_lock():
+        state = load_sync_state()
+        last_refresh = state.last_refresh
+        new_state = state.model_copy(
+            update={
+                "last_refresh": last_refresh
+                | {instance: last_refresh.get(instance, {}) | {username: started}}
+            }
+        )
+        atomic_write(_sync_state_file(), new_state.model_dump_json(indent=2).encode())
+
+
+def get_namespace(instance: str) -> int:
+    """
+    Return the namespace of the ids of *instance*
+
+    Namespaces are assigned in the order instances are seen first, so the first
+    instance keeps the ids of gitlab.
+    """
+    if (namespace := load_sync_state().namespaces.get(instance)) is not None:
+        return namespace
+    with _sync_state_lock():
+        state = load_sync_state()
+        namespaces = state.namespaces
+        if (namespace := namespaces.get(instance)) is not None:
+            return namespace
+        namespace = max(namespaces.values(), default=-1) + 1
+        new_state = state.model_copy(
+            update={"namespaces": namespaces | {instance: namespace}}
+        )
+        atomic_write(_sync_state_file(), new_state.model_dump_json(indent=2).encode())
+    return namespace
@@ -1,9 +1,17 @@
 from typing import TypeVar
 
 import click
-from nicegui import run, ui
-
-from gitlab_personal_issue_board import data, gitlab, models, settings, view_model
+from nicegui import Client, app, run, ui
+
+from gitlab_personal_issue_board import (
+    data,
+    gitlab,
+    models,
+    refresh_scheduler,
+    settings,
+    view_model,
+    webhook,
+)
 from gitlab_personal_issue_board.ui import navigate_to
 
 
@@ -13,7 +21,28 @@ def new_board() -> None:
     ui.navigate.to(f"/boards/{board.id}/edit")
 
 
+def has_clients() -> bool:
+    """Return True if any browser is connected"""
+    return any(client.has_socket_connection for client in Client.instances.values())
+
+
+async def refresh_in_background() -> None:
+    """Refresh the issues while boards are open, boards show the changes themselves"""
+    config = settings.load_settings().refresh
+    if not config.background:
+        return
+    scheduler = refresh_scheduler.RefreshScheduler(
+        config.interval, config.min_interval, config.max_interval
+    )
+    await scheduler.run(issues.refresh_async, has_clients)
+
+
 issues = gitlab.Issues()
+app.on_startup(issues.move_worker)
+app.on_startup(refresh_in_background)
+app.on_shutdown(issues.aclose)
+if webhook_secret := settings.load_settings().gitlab.webhook_secret:
+    webhook.register(app, issues, webhook_secret)
 
 
 @ui.page("/")
@@ -41,8 +70,10 @@ def main() -> None:
 
 
 @ui.page("/boards/{board_id:str}/view")
-def view_board(board_id: models.LabelBoardID) -> None:
+async def view_board(board_id: models.LabelBoardID) -> None:
     board = data.load_label_board(board_id)
+    # only the projects of the board, the others are loaded by the board later
+    await run.io_bound(issues.load_for_board, board)
     view_model.LabelBoard(board, issues=issues)
 
 
@@ -51,9 +82,11 @@ async def edit_board(board_id: models.LabelBoardID) -> None:
     board = data.load_label_board(board_id)
     spinner = ui.spinner()
     spinner.tailwind.align_self("center")
-    res = await run.io_bound(issues.refresh)
-    if isinstance(res, str):
-        ui.notify(res, type="warning")
+    # all labels are offered for the board
+    await run.io_bound(issues.load_projects)
+    res = await issues.refresh_async()
+    if isinstance(res.status, str):
+        ui.notify(res.status, type="warning")
     spinner.delete()
     view_model.BoardConfiguration(board, issues=issues)
 
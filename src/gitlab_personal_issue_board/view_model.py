@@ -10,7 +10,15 @@ from copy import deepcopy
 
 from nicegui import run, ui
 
-from gitlab_personal_issue_board import controller, data, gitlab, models
+from gitlab_personal_issue_board import (
+    caching,
+    controller,
+    data,
+    gitlab,
+    models,
+    move_journal,
+    settings,
+)
 from gitlab_personal_issue_board.ui import navigate_to, sortable
 
 type ElementID = int
@@ -88,6 +96,10 @@ class LabelIssueCard(sortable.MoveableCard):
             with ui.row(wrap=False) as row:
                 row.tailwind.align_items("center")
                 self.reference = ui.label(issue.references.full)
+                self.move_status = ui.icon("schedule", color="grey")
+                self.move_status.set_visibility(False)
+                with self.move_status:
+                    self._move_tooltip = ui.tooltip("")
                 btn = ui.button(
                     "", color="green", icon="info", on_click=self.show_details
                 )
@@ -133,6 +145,23 @@ class LabelIssueCard(sortable.MoveableCard):
             self.label_row_elements = new_label_row
             self.label_row.update()
 
+    def show_move(self, move: move_journal.Move | None) -> None:
+        """Show if the issue was moved but gitlab didn't accept the move yet"""
+        self.move_status.set_visibility(move is not None)
+        if move is None:
+            return
+        if move.error is None:
+            self.move_status.name = "schedule"
+            self.move_status.props["color"] = "grey"
+            self._move_tooltip.text = "Move not sent to gitlab yet"
+        else:
+            self.move_status.name = "sync_problem"
+            self.move_status.props["color"] = "negative"
+            self._move_tooltip.text = (
+                f"Move failed {move.attempts} times, will retry: {move.error}"
+            )
+        self.move_status.update()
+
     def set_content(self) -> None:
         self.header.props["text"] = self.issue.title
         self.header.props["target"] = self.issue.web_url
@@ -304,8 +333,8 @@ class BoardConfiguration(ui.element):
     def __init__(self, board: models.LabelBoard, issues: gitlab.Issues) -> None:
         super().__init__()
         self.board = board
-        issues.refresh()
-        labels = controller.get_labels_from_issues(issues.values())
+        # refreshed by the page before, so the refresh is joined by others
+        labels = issues.labels()
         with self:
             self.tailwind.height("screen")
             self.top_row = ui.row(wrap=False)
@@ -394,11 +423,13 @@ class LabelColumn(ui.column):
         else:
             # update Existing issue crd
             issue_card.refresh(issue)
+        issue_card.show_move(self.parent_board.pending_moves.get(issue.id))
         return issue_card
 
-    def update_issue_cards(self) -> None:
+    def update_issue_cards(self, current: caching.CacheVersion) -> None:
         """
-        Update/refresh the issue cards with the current data from gitlab
+        Update/refresh the issue cards with the issues of the *current* version,
+        the one the card was sorted with
 
         Unfortunately we can't use ui.refreshable as it doesn't mix with sortable.
         It leads too high CPU load in the browser and makes it hard to identify the
@@ -406,7 +437,9 @@ class LabelColumn(ui.column):
         """
         with self.card_column:
             issue_cards: list[ui.element] = [
-                self._update_or_create_issue_card(self.parent_board.issues[issue_id])
+                self._update_or_create_issue_card(
+                    self.parent_board.issues.get_in(current, issue_id)
+                )
                 for issue_id in self.card.issues
             ]
             if issue_cards != self.card_column.default_slot.children:
@@ -425,10 +458,9 @@ class LabelColumn(ui.column):
                     issue_card.parent_slot = self.card_column.default_slot
                 self.card_column.update()
 
-    async def update_gl_issue_state(self, element_id: ElementID) -> None:
+    def update_gl_issue_state(self, element_id: ElementID) -> None:
         card = self._card_ids[element_id]
-        await run.io_bound(
-            self.parent_board.issues.assign_new_labels,
+        self.parent_board.issues.move(
             card.issue,
             self.card.label,
             self.parent_board.board.card_labels,
@@ -442,7 +474,7 @@ class LabelColumn(ui.column):
         target = self.parent_board.id2column[new_list]
         if self != target:
             target.refresh_card_by_ui()
-            await target.update_gl_issue_state(element_id)
+            target.update_gl_issue_state(element_id)
         self.parent_board.update_and_save()
 
     def __str__(self) -> str:
@@ -460,6 +492,17 @@ class LabelBoard(ui.element):
         self.issues = issues
         self.dialog = ui.dialog()
         self.id2column = {}
+        #: issues version, cards and pending moves the cards were last sorted for
+        self._sorted_for: (
+            tuple[
+                int,
+                tuple[models.LabelCard, ...],
+                Mapping[models.IssueID, move_journal.Move],
+            ]
+            | None
+        ) = None
+        #: moves not accepted by gitlab yet, shown on the issue cards
+        self.pending_moves: Mapping[models.IssueID, move_journal.Move] = {}
 
         with self:
             self.tailwind.height("screen")
@@ -488,6 +531,9 @@ class LabelBoard(ui.element):
             | {column.card_column.id: column for column in self.columns}
         )
         self.update_cards()
+        # show issues changed by other processes, cheap if nothing changed
+        ui.timer(settings.load_settings().cache.watch_interval, self._watch)
+        ui.timer(0, self.load_in_background, once=True)
 
     @property
     def card_labels(self) -> tuple[models.Label, ...]:
@@ -500,14 +546,36 @@ class LabelBoard(ui.element):
         return tuple(column.card for column in self.columns)
 
     def update_cards(self) -> None:
+        self.issues.refresh_from_disk()
+        current = self.issues.current
+        pending_moves = self.issues.pending_moves()
+        sorted_for = (current.version, self.column_cards, pending_moves)
+        if self._sorted_for == sorted_for:
+            # neither the issues, the cards nor the moves changed since last sorting
+            return
+        self.pending_moves = pending_moves
         sorted_cards = controller.sort_issues_in_cards_by_label(
-            tuple(self.issues.values()), self.column_cards
+            current.summaries(), self.column_cards, current
         )
         self.board = self.board.evolve(*sorted_cards)
+        self.issues.set_referenced(self.board)
         for column, card in zip(self.columns, self.board.cards, strict=True):
             column.card = card
         for column in self.columns:
-            column.update_issue_cards()
+            column.update_issue_cards(current)
+        self._sorted_for = sorted_for
+
+    def _watch(self) -> None:
+        """Show changes of other processes and sent moves"""
+        self.update_cards()
+
+    async def load_in_background(self) -> None:
+        """Load the issues of the projects not needed by this board and the labels"""
+        if not self.issues.fully_loaded:
+            await run.io_bound(self.issues.load_projects)
+            self.update_cards()
+        # so moving the first issue doesn't wait for the labels of its project
+        await self.issues.prefetch_labels_async()
 
     async def refresh(self, notify: bool = True) -> None:
         """
@@ -519,10 +587,10 @@ class LabelBoard(ui.element):
                 position="center",
                 type="info",
             )
-        res = await run.io_bound(self.issues.refresh)
-        if isinstance(res, str):
+        res = await self.issues.refresh_async()
+        if isinstance(res.status, str):
             self.update_cards()  # Still update the cards
-            ui.notify(res, type="warning")
+            ui.notify(res.status, type="warning")
         else:
             self.update_cards()
             if notify:
@@ -0,0 +1,96 @@
+"""
+Receiving issue changes pushed by gitlab webhooks
+
+Gitlab posts an "Issue Hook" payload for every change of an issue in the projects
+a webhook is configured for, so changes are shown without waiting for a refresh.
+The periodic refresh stays as fallback for missed payloads.
+"""
+
+import hmac
+import logging
+from collections.abc import Mapping
+from datetime import datetime
+from typing import Any, Final
+
+from fastapi import FastAPI, HTTPException, Request
+
+from . import gitlab
+
+logger = logging.getLogger(__name__)
+
+#: header gitlab sends the secret token of the webhook in
+TOKEN_HEADER: Final[str] = "X-Gitlab-Token"  # noqa: S105
+#: path gitlab posts the payloads to
+WEBHOOK_PATH: Final[str] = "/webhooks/gitlab"
+
+
+def _parse_time(value: str) -> datetime:
+    """Parse the times of payloads, like `2024-12-12 04:15:00 UTC` or ISO format"""
+    if value.endswith(" UTC"):
+        value = f"{value.removesuffix(' UTC')}+00:00"
+    return datetime.fromisoformat(value)
+
+
+def issue_from_hook(payload: Mapping[str, Any]) -> dict[str, Any]:
+    """
+    Convert an issue hook payload to the issue attributes the REST API returns
+
+    Attributes missing in payloads, like the text color of labels, are None and
+    completed by *gitlab.Issues.update_pushed*.
+    """
+    attributes = payload["object_attributes"]
+    project_path = payload["project"]["path_with_namespace"]
+    return {
+        "id": attributes["id"],
+        "iid": attributes["iid"],
+        "title": attributes["title"],
+        "description": attributes.get("description"),
+        "state": attributes["state"],
+        "project_id": attributes["project_id"],
+        "web_url": attributes["url"],
+        "created_at": _parse_time(attributes["created_at"]),
+        "updated_at": _parse_time(attributes["updated_at"]),
+        "references": {
+            "short": f"#{attributes['iid']}",
+            "full": f"{project_path}#{attributes['iid']}",
+        },
+        "labels": [
+            {
+                "name": label["title"],
+                "color": label["color"],
+                "text_color": label.get("text_color"),
+                "description": label.get("description"),
+            }
+            for label in payload.get("labels", ())
+        ],
+        "assignees": [
+            {
+                "id": assignee.get("id"),
+                "username": assignee["username"],
+                "name": assignee["name"],
+                "avatar_url": assignee.get("avatar_url"),
+            }
+            for assignee in payload.get("assignees", ())
+        ],
+    }
+
+
+def register(app: FastAPI, issues: gitlab.Issues, secret: str) -> None:
+    """Accept issue hook payloads signed with *secret* at *WEBHOOK_PATH*."""
+
+    @app.post(WEBHOOK_PATH)
+    async def receive_issue_hook(request: Request) -> dict[str, str]:
+        token = request.headers.get(TOKEN_HEADER, "")
+        if not hmac.compare_digest(token.encode(), secret.encode()):
+            raise HTTPException(status_code=401, detail="Invalid webhook token")
+        payload = await request.json()
+        if not isinstance(payload, dict) or payload.get("object_kind") != "issue":
+            return {"outcome": "ignored"}
+        try:
+            issue = issue_from_hook(payload)
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning(f"Invalid issue hook: {type(e).__name__}: {e}")
+            raise HTTPException(status_code=422, detail="Invalid issue hook") from e
+        outcome = issues.update_pushed(issue)
+        logger.debug(f"Issue {issue['id']} pushed by webhook: {outcome}")
+        return {"outcome": outcome}
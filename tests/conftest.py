@@ -1,7 +1,12 @@
-from collections.abc import Iterable, Sequence
+from collections.abc import Iterable, Iterator, Sequence
 from datetime import UTC, datetime
-from typing import Final, Literal
+from pathlib import Path
+from typing import Any, Final, Literal
+from unittest import mock
 
+import pytest
+
+from gitlab_personal_issue_board import gitlab, settings
 from gitlab_personal_issue_board.models import Issue, LabelCard, User, UserID
 
 FAKE_USER: Final = User(
@@ -36,7 +41,7 @@ def gen_label_card(
     return LabelCard.model_validate(gen_label_card_data(label, issues))
 
 
-def gen_issue(
+def gen_issue_data(
     issue_id: int,
     title: str = "An Issue",
     labels: Iterable[str | dict[str, str]] = (),
@@ -46,7 +51,8 @@ def gen_issue(
     closed: bool = False,
     created_at: datetime = datetime(2024, 12, 12, 3, 12, tzinfo=UTC),
     updated_at: datetime = datetime(2024, 12, 12, 4, 15, tzinfo=UTC),
-) -> Issue:
+) -> dict[str, Any]:
+    """Generate the issue data as returned by the gitlab API"""
     labels = list(labels)
     if "opened" in labels:
         closed = False
@@ -54,13 +60,13 @@ def gen_issue(
     if "closed" in labels:
         closed = True
         labels.remove("closed")
-    data = {
+    return {
         "id": issue_id,
         "title": title,
         "description": description,
         "iid": issue_id,
         "labels": [gen_label_data(label) for label in labels],
-        "assignees": [FAKE_USER],
+        "assignees": [FAKE_USER.model_dump()],
         "created_at": created_at,
         "updated_at": updated_at,
         "references": {
@@ -72,9 +78,61 @@ def gen_issue(
         "web_url": f"{FAKE_GITLAB}/{project}/-/issues/{issue_id}",
     }
 
+
+def gen_issue(
+    issue_id: int,
+    title: str = "An Issue",
+    labels: Iterable[str | dict[str, str]] = (),
+    description: str = "Issue Description",
+    project: str = "fake/project",
+    project_id: int = 123,
+    closed: bool = False,
+    created_at: datetime = datetime(2024, 12, 12, 3, 12, tzinfo=UTC),
+    updated_at: datetime = datetime(2024, 12, 12, 4, 15, tzinfo=UTC),
+) -> Issue:
+    data = gen_issue_data(
+        issue_id,
+        title=title,
+        labels=labels,
+        description=description,
+        project=project,
+        project_id=project_id,
+        closed=closed,
+        created_at=created_at,
+        updated_at=updated_at,
+    )
     return Issue.model_validate(data)
 
 
+@pytest.fixture
+def cache_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """Use a temporary cache directory and default settings"""
+    result = tmp_path / "cache"
+    result.mkdir()
+    monkeypatch.setattr(settings, "cache_dir", lambda: result)
+    monkeypatch.setattr(settings, "load_settings", settings.Settings)
+    return result
+
+
+@pytest.fixture
+def issues(cache_dir: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[gitlab.Issues]:
+    """Issues with a fake gitlab connection and an issue with label foo"""
+    monkeypatch.setattr(settings, "data_dir", lambda: cache_dir)
+    monkeypatch.setattr(
+        gitlab, "get_gitlab", lambda config_section=None: mock.Mock(url=FAKE_GITLAB)
+    )
+    monkeypatch.setattr(
+        gitlab, "get_gitlab_user", lambda config_section=None: FAKE_USER
+    )
+    result = gitlab.Issues()
+    for instance in result._instances:
+        result._resolve_user(instance)
+    result.load_projects()
+    result._cache.update(gen_issue_data(1, labels=["foo"]), remove=lambda _: False)
+    yield result
+    result.close()
+
+
 # Test our generator functions
 
 
@@ -0,0 +1,129 @@
+import threading
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from gitlab_personal_issue_board import cache_snapshot, cache_stores, caching
+from gitlab_personal_issue_board.models import IssueID
+
+from .conftest import gen_issue_data
+
+
+@pytest.fixture(params=["sqlite", "json"])
+def store(request: pytest.FixtureRequest, cache_dir: Path) -> cache_stores.IssueStore:
+    if request.param == "sqlite":
+        return cache_stores.SqliteStore(cache_dir / "issues.sqlite")
+    return cache_stores.JsonFileStore(cache_dir / "issues")
+
+
+@pytest.fixture
+def snapshot_file(store: cache_stores.IssueStore, cache_dir: Path) -> Path:
+    """Snapshot of a cache containing issue 1-3"""
+    cache = caching.IssueCacheDict(store)
+    for issue_id in (1, 2, 3):
+        cache.update(gen_issue_data(issue_id, title="old"), lambda _: False)
+    cache.write_snapshot()
+    cache.close()
+    return cache_dir / "issues.snapshot"
+
+
+def test_load_from_snapshot(
+    store: cache_stores.IssueStore,
+    snapshot_file: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """An up to date snapshot is used without reading the store"""
+    for method in ("load_all", "load", "tokens"):
+        monkeypatch.setattr(store, method, mock.Mock(side_effect=AssertionError))
+
+    cache = caching.IssueCacheDict(store, snapshot_file=snapshot_file)
+
+    assert sorted(cache.keys()) == [1, 2, 3]
+    assert cache[IssueID(2)].title == "old"
+    assert {summary.id for summary in cache.summaries()} == {1, 2, 3}
+
+
+def test_load_newer_issues_from_store(
+    store: cache_stores.IssueStore, snapshot_file: Path
+) -> None:
+    """Issues changed after the snapshot was written are read from the store"""
+    other = caching.IssueCacheDict(store, snapshot_file=snapshot_file)
+    other.update(gen_issue_data(2, title="newer"), lambda _: False)
+    other.update(gen_issue_data(4, title="newer"), lambda _: False)
+    other.remove(lambda issue: issue.id == 3)
+    other.flush()
+    load = mock.Mock(wraps=store.load)
+    store.load = load  # type: ignore[method-assign]
+
+    cache = caching.IssueCacheDict(store, snapshot_file=snapshot_file)
+
+    assert sorted(cache.keys()) == [1, 2, 4]
+    assert sorted(call.args[0] for call in load.call_args_list) == [2, 4]
+    assert cache[IssueID(1)].title == "old"
+    assert cache[IssueID(2)].title == "newer"
+    assert cache[IssueID(4)].title == "newer"
+
+
+@pytest.mark.parametrize("position", [0, 28, 100], ids=["magic", "checksum", "index"])
+def test_ignore_corrupt_snapshot(
+    store: cache_stores.IssueStore, snapshot_file: Path, position: int
+) -> None:
+    """A corrupt snapshot is ignored and all issues are read from the store"""
+    data = bytearray(snapshot_file.read_bytes())
+    data[position] ^= 0xFF
+    snapshot_file.write_bytes(data)
+
+    assert cache_snapshot.Snapshot.open(snapshot_file) is None
+    cache = caching.IssueCacheDict(store, snapshot_file=snapshot_file)
+    assert sorted(cache.keys()) == [1, 2, 3]
+
+
+def test_ignore_truncated_snapshot(
+    store: cache_stores.IssueStore, snapshot_file: Path
+) -> None:
+    """A truncated snapshot is ignored"""
+    snapshot_file.write_bytes(snapshot_file.read_bytes()[:-10])
+
+    assert cache_snapshot.Snapshot.open(snapshot_file) is None
+
+
+def test_corrupt_snapshot_record(
+    store: cache_stores.IssueStore, snapshot_file: Path
+) -> None:
+    """A corrupt issue within the snapshot is read from the store"""
+    data = bytearray(snapshot_file.read_bytes())
+    data[-5] ^= 0xFF
+    snapshot_file.write_bytes(data)
+
+    cache = caching.IssueCacheDict(store, snapshot_file=snapshot_file)
+
+    assert [cache[IssueID(issue_id)].title for issue_id in (1, 2, 3)] == ["old"] * 3
+
+
+def test_write_snapshot_concurrently(
+    store: cache_stores.IssueStore, snapshot_file: Path
+) -> None:
+    """Snapshots written at once don't break reading issues"""
+    cache = caching.IssueCacheDict(store, snapshot_file=snapshot_file, lazy=True)
+    errors: list[BaseException] = []
+
+    def write() -> None:
+        try:
+            for _ in range(20):
+                cache.write_snapshot()
+        except BaseException as e:  # pragma: no cover
+            errors.append(e)
+
+    writers = [threading.Thread(target=write) for _ in range(3)]
+    for writer in writers:
+        writer.start()
+    while any(writer.is_alive() for writer in writers):
+        assert [cache[IssueID(issue_id)].title for issue_id in (1, 2, 3)] == (
+            ["old"] * 3
+        )
+    for writer in writers:
+        writer.join()
+
+    assert errors == []
+    assert cache_snapshot.Snapshot.open(snapshot_file) is not None
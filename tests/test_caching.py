@@ -0,0 +1,558 @@
+import sqlite3
+import time
+import tracemalloc
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+from unittest import mock
+
+import orjson
+import pytest
+
+from gitlab_personal_issue_board import cache_stores, caching
+from gitlab_personal_issue_board.models import Issue, IssueID
+
+from .conftest import gen_issue_data
+
+
+@pytest.fixture(params=["sqlite", "json"])
+def store(request: pytest.FixtureRequest, cache_dir: Path) -> cache_stores.IssueStore:
+    if request.param == "sqlite":
+        return cache_stores.SqliteStore(cache_dir / "issues.sqlite")
+    return cache_stores.JsonFileStore(cache_dir / "issues")
+
+
+def test_update_and_reload(store: cache_stores.IssueStore) -> None:
+    """Updated issues are persisted and loaded by a new cache"""
+    cache = caching.IssueCacheDict(store)
+    cache.update(gen_issue_data(1, labels=["foo"]), remove=lambda _: False)
+    cache.update(gen_issue_data(2, closed=True), remove=lambda _: False)
+    cache.flush()
+
+    reloaded = caching.IssueCacheDict(store)
+
+    assert sorted(reloaded.keys()) == [1, 2]
+    assert reloaded[IssueID(1)].labels[0].name == "foo"
+    assert reloaded[IssueID(2)].state == "closed"
+
+
+def test_update_remove(store: cache_stores.IssueStore) -> None:
+    """Issues meeting remove are dropped from memory and store"""
+    cache = caching.IssueCacheDict(store)
+    cache.update(gen_issue_data(1), remove=lambda _: False)
+    cache.update(gen_issue_data(1), remove=lambda _: True)
+    cache.flush()
+
+    assert len(cache) == 0
+    assert store.load(IssueID(1)) is None
+
+
+def test_batch_single_write(
+    store: cache_stores.IssueStore, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Changes of a batch are published and written at once on exit"""
+    cache = caching.IssueCacheDict(store, write_behind=False)
+    cache.update(gen_issue_data(3), remove=lambda _: False)
+    write = mock.Mock(wraps=store.write)
+    monkeypatch.setattr(store, "write", write)
+    with cache.batch():
+        cache.update(gen_issue_data(1), remove=lambda _: False)
+        cache.update(gen_issue_data(2), remove=lambda _: False)
+        cache.remove(lambda issue: issue.id == 3)
+        assert cache.keys() == (3,)
+        assert store.load(IssueID(1)) is None
+        assert store.load(IssueID(3)) is not None
+
+    assert sorted(cache.keys()) == [1, 2]
+    assert sorted(stored.issue_id for stored in store.load_all()) == [1, 2]
+    assert write.call_count == 1
+
+
+def test_refresh_from_disk(store: cache_stores.IssueStore) -> None:
+    """Issues changed, added or removed by another cache are picked up on refresh"""
+    cache = caching.IssueCacheDict(store)
+    cache.update(gen_issue_data(1, title="old"), remove=lambda _: False)
+    cache.update(gen_issue_data(2), remove=lambda _: False)
+    cache.flush()
+    other = caching.IssueCacheDict(store)
+    other.update(gen_issue_data(1, title="newer"), remove=lambda _: False)
+    other.update(gen_issue_data(3), remove=lambda _: False)
+    other.remove(lambda issue: issue.id == 2)
+    other.flush()
+
+    # reads are served from memory until the next refresh
+    assert cache[IssueID(1)].title == "old"
+    cache.refresh_from_disk()
+
+    assert cache[IssueID(1)].title == "newer"
+    assert sorted(cache.keys()) == [1, 3]
+
+
+def test_refresh_from_disk_unchanged(
+    store: cache_stores.IssueStore, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """If the generation of the store is unchanged the issues aren't checked"""
+    writer = caching.IssueCacheDict(store)
+    writer.update(gen_issue_data(1), remove=lambda _: False)
+    writer.flush()
+    cache = caching.IssueCacheDict(store)
+    tokens = mock.Mock(wraps=store.tokens)
+    monkeypatch.setattr(store, "tokens", tokens)
+
+    cache.refresh_from_disk()
+
+    assert tokens.call_count == 0
+
+
+def test_versions(store: cache_stores.IssueStore) -> None:
+    """Readers keep a consistent version while changes are published as new one"""
+    cache = caching.IssueCacheDict(store, write_behind=False)
+    cache.update(gen_issue_data(1), remove=lambda _: False)
+    cache.update(gen_issue_data(2), remove=lambda _: False)
+    version = cache.version
+    old = cache.current
+    values = iter(cache.values())
+    next(values)
+
+    with cache.batch():
+        for issue_id in range(3, 10):
+            cache.update(gen_issue_data(issue_id), remove=lambda _: False)
+        cache.remove(lambda issue: issue.id == 2)
+        assert cache.version == version
+
+    # the running iteration still sees the old version
+    assert [issue.id for issue in values] == [2]
+    assert cache.get_in(old, IssueID(2)).id == 2
+    with pytest.raises(KeyError):
+        cache[IssueID(2)]
+    assert cache.version == version + 1
+    assert sorted(cache.keys()) == [1, *range(3, 10)]
+    cache.refresh_from_disk()
+    assert cache.version == version + 1
+
+
+def test_update_outcomes(
+    store: cache_stores.IssueStore, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Unchanged issues are neither written nor published as new version"""
+    cache = caching.IssueCacheDict(store, write_behind=False)
+    assert cache.update(gen_issue_data(1), remove=lambda _: False) == "new"
+    write = mock.Mock(wraps=store.write)
+    monkeypatch.setattr(store, "write", write)
+    version = cache.version
+
+    assert cache.update(gen_issue_data(1), remove=lambda _: False) == "unchanged"
+    assert write.call_count == 0
+    assert cache.version == version
+
+    assert cache.update(gen_issue_data(1, title="new"), lambda _: False) == "changed"
+    assert write.call_count == 1
+    assert cache[IssueID(1)].title == "new"
+    assert cache.update(gen_issue_data(1), remove=lambda _: True) == "removed"
+    assert cache.update(gen_issue_data(2), remove=lambda _: True) == "ignored"
+    assert len(cache) == 0
+
+
+def test_query(store: cache_stores.IssueStore) -> None:
+    """The indexes follow updates, removals and changes by other processes"""
+    cache = caching.IssueCacheDict(store)
+    cache.update(gen_issue_data(1, labels=["foo", "bar"]), remove=lambda _: False)
+    cache.update(gen_issue_data(2, labels=["foo"], closed=True), lambda _: False)
+    cache.update(gen_issue_data(3, labels=["bar"], project_id=5), lambda _: False)
+    cache.flush()
+
+    assert cache.query(label="foo") == {1, 2}
+    assert cache.query(label="bar", state="opened") == {1, 3}
+    assert cache.query(label="foo", project_id=5) == set()
+    assert cache.query(state="closed") == {2}
+    assert cache.query() == {1, 2, 3}
+    assert cache.project_ids() == {123, 5}
+
+    # the issue moved from bar to baz
+    version = cache.current
+    cache.update(gen_issue_data(1, labels=["foo", "baz"]), remove=lambda _: False)
+    cache.remove(lambda issue: issue.id == 2)
+    assert cache.query(label="foo") == {1}
+    # published versions are not changed
+    assert version.query(label="foo") == {1, 2}
+    assert version.query(label="bar") == {1, 3}
+    assert cache.query(label="bar") == {3}
+    assert cache.label_names() == {"foo", "bar", "baz"}
+    cache.flush()
+
+    other = caching.IssueCacheDict(store)
+    assert other.query(label="foo") == {1}
+    other.update(gen_issue_data(3, labels=["foo"], closed=True), lambda _: False)
+    other.flush()
+    cache.refresh_from_disk()
+
+    assert cache.query(label="foo") == {1, 3}
+    assert cache.query(state="closed") == {3}
+    assert cache.label_names() == {"foo", "baz"}
+
+
+def test_sqlite_single_generation_per_write(cache_dir: Path) -> None:
+    """All records of one write share the version of their transaction"""
+    store = cache_stores.SqliteStore(cache_dir / "issues.sqlite")
+    record = cache_stores.IssueRecord(b"{}")
+    first = store.write({IssueID(1): record, IssueID(2): record})
+    second = store.write({IssueID(1): record})
+
+    assert first[IssueID(1)] == first[IssueID(2)]
+    assert second[IssueID(1)] != first[IssueID(1)]
+
+
+def test_open_store_migrates_json_files(cache_dir: Path) -> None:
+    """Existing JSON cache files are moved into the SQLite database"""
+    folder = cache_dir / "issues"
+    folder.mkdir()
+    for issue_id in (1, 2):
+        (folder / f"issue_{issue_id}.json").write_bytes(
+            orjson.dumps(gen_issue_data(issue_id), option=orjson.OPT_INDENT_2)
+        )
+
+    store = cache_stores.open_store()
+
+    assert isinstance(store, cache_stores.SqliteStore)
+    assert not folder.exists()
+    assert sorted(caching.IssueCacheDict(store).keys()) == [1, 2]
+
+
+@pytest.mark.parametrize("lazy", [True, False], ids=["lazy", "eager"])
+def test_lazy_validation(
+    store: cache_stores.IssueStore, monkeypatch: pytest.MonkeyPatch, lazy: bool
+) -> None:
+    """In lazy mode issues are only validated once accessed"""
+    writer = caching.IssueCacheDict(store)
+    for issue_id in range(10):
+        writer.update(gen_issue_data(issue_id, labels=["foo"]), lambda _: False)
+    writer.close()
+    validate = mock.Mock(wraps=Issue.model_validate_json)
+    monkeypatch.setattr(Issue, "model_validate_json", validate)
+
+    cache = caching.IssueCacheDict(store, lazy=lazy)
+    summaries = list(cache.summaries())
+    cache.remove(lambda issue: issue.id == 9)
+
+    assert validate.call_count == (0 if lazy else 10)
+    assert len(summaries) == 10
+    assert all(summary.label_names == {"foo"} for summary in summaries)
+    assert cache[IssueID(3)].id == 3
+    assert validate.call_count == (1 if lazy else 10)
+    assert len(list(cache.values())) == 9
+
+
+def test_summary_matches_issue() -> None:
+    """The summary extracted from the content is the same as from the issue"""
+    content = orjson.dumps(gen_issue_data(1, labels=["foo", "bar", "closed"]))
+
+    summary = caching.IssueSummary.from_content(content)
+
+    assert summary == caching.IssueSummary.from_issue(
+        Issue.model_validate_json(content)
+    )
+
+
+def gen_gitlab_attributes(issue_id: int) -> dict[str, Any]:
+    """Issue attributes containing all the fields returned by the gitlab API"""
+    data = gen_issue_data(
+        issue_id,
+        labels=["workflow::doing", "bug", "priority::high"],
+        description="A realistic description with some text.\n" * 5,
+    )
+    user = data["assignees"][0] | {"state": "active", "web_url": "https://x/user"}
+    return data | {
+        "author": user,
+        "assignee": user,
+        "closed_by": None,
+        "closed_at": None,
+        "milestone": {"id": 3, "iid": 1, "title": "Sprint 42", "state": "active"},
+        "type": "ISSUE",
+        "issue_type": "issue",
+        "user_notes_count": 12,
+        "merge_requests_count": 1,
+        "upvotes": 0,
+        "downvotes": 0,
+        "confidential": False,
+        "discussion_locked": None,
+        "time_stats": {
+            "time_estimate": 0,
+            "total_time_spent": 3600,
+            "human_time_estimate": None,
+            "human_total_time_spent": "1h",
+        },
+        "task_completion_status": {"count": 4, "completed_count": 2},
+        "has_tasks": True,
+        "task_status": "2 of 4 checklist items completed",
+        "_links": {
+            "self": f"https://gitlab.fake.example/api/v4/projects/123/issues/{issue_id}",
+            "notes": "https://gitlab.fake.example/api/v4/projects/123/notes",
+            "award_emoji": "https://gitlab.fake.example/api/v4/projects/123/award",
+            "project": "https://gitlab.fake.example/api/v4/projects/123",
+        },
+        "severity": "UNKNOWN",
+        "subscribed": True,
+        "moved_to_id": None,
+        "service_desk_reply_to": None,
+    }
+
+
+def test_compact_format(store: cache_stores.IssueStore) -> None:
+    """Only the fields of Issue are stored, the raw attributes only on request"""
+    cache = caching.IssueCacheDict(store)
+    cache.update(gen_gitlab_attributes(1), remove=lambda _: False)
+    raw_cache = caching.IssueCacheDict(store, keep_raw=True)
+    raw_cache.update(gen_gitlab_attributes(2), remove=lambda _: False)
+    cache.flush()
+    raw_cache.flush()
+
+    stored = {stored.issue_id: stored for stored in store.load_all()}
+
+    for issue_id in (1, 2):
+        content = orjson.loads(stored[IssueID(issue_id)].content)
+        assert content.keys() == Issue.model_fields.keys()
+    assert raw_cache.raw_attributes(IssueID(1)) is None
+    assert raw_cache.raw_attributes(IssueID(2)) == orjson.loads(
+        orjson.dumps(gen_gitlab_attributes(2))
+    )
+
+
+def test_sqlite_schema_migration(cache_dir: Path) -> None:
+    """Databases created with an older schema are migrated"""
+    path = cache_dir / "issues.sqlite"
+    with sqlite3.connect(path) as connection:
+        connection.executescript(cache_stores.SqliteStore.migrations[0])
+        connection.execute(
+            "INSERT INTO issues(id, version, content) VALUES (?, 1, ?)",
+            (1, orjson.dumps(gen_issue_data(1, labels=["foo"]))),
+        )
+    connection.close()
+
+    store = cache_stores.SqliteStore(path)
+
+    assert store.load_raw(IssueID(1)) is None
+    assert store.label_project_ids(["foo"]) == {123}
+    assert caching.IssueCacheDict(store)[IssueID(1)].id == 1
+
+
+def test_compact_format_comparison(cache_dir: Path) -> None:
+    """
+    Compare the size and load time of the legacy and the compact format
+
+    Run with `pytest -s` to see the numbers.
+    """
+    issues = [gen_gitlab_attributes(issue_id) for issue_id in range(2000)]
+    legacy = cache_stores.JsonFileStore(cache_dir / "legacy")
+    legacy.write(
+        {
+            IssueID(data["id"]): cache_stores.IssueRecord(
+                orjson.dumps(data, option=orjson.OPT_INDENT_2)
+            )
+            for data in issues
+        }
+    )
+    compact = cache_stores.JsonFileStore(cache_dir / "compact")
+    cache = caching.IssueCacheDict(compact)
+    with cache.batch():
+        for data in issues:
+            cache.update(data, remove=lambda _: False)
+    cache.close()
+
+    results: dict[str, tuple[int, float]] = {}
+    for name, store in (("legacy", legacy), ("compact", compact)):
+        contents = [stored.content for stored in store.load_all()]
+        start = time.perf_counter()
+        for content in contents:
+            Issue.model_validate_json(content)
+        results[name] = sum(map(len, contents)), time.perf_counter() - start
+
+    for name, (size, seconds) in results.items():
+        print(f"{name:>8}: {size / 1024:8.0f} KiB, parsed in {seconds * 1000:6.1f} ms")
+    assert results["compact"][0] < results["legacy"][0] / 2
+
+
+def test_write_behind(store: cache_stores.IssueStore) -> None:
+    """Changes are visible immediately and written in the background"""
+    cache = caching.IssueCacheDict(store)
+    cache.update(gen_issue_data(1), remove=lambda _: False)
+
+    assert cache[IssueID(1)].id == 1
+    cache.close()
+    assert [stored.issue_id for stored in store.load_all()] == [1]
+
+
+def test_write_behind_keeps_failed_records(
+    store: cache_stores.IssueStore, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Records that could not be written are written by the next flush"""
+    cache = caching.IssueCacheDict(store, write_behind=False)
+    with monkeypatch.context() as m:
+        m.setattr(store, "write", mock.Mock(side_effect=OSError("disk full")))
+        with pytest.raises(OSError, match="disk full"):
+            cache.update(gen_issue_data(1), remove=lambda _: False)
+
+    cache.flush()
+
+    assert [stored.issue_id for stored in store.load_all()] == [1]
+
+
+def test_ignore_half_written_files(cache_dir: Path) -> None:
+    """Left over temporary and truncated files are not loaded as issues"""
+    store = cache_stores.JsonFileStore(cache_dir / "issues")
+    content = orjson.dumps(gen_issue_data(1))
+    (store.folder / "issue_1.json.123.tmp").write_bytes(content[:10])
+    (store.folder / "issue_2.json").write_bytes(content[:10])
+    cache_stores.atomic_write(
+        store.folder / "issue_3.json", orjson.dumps(gen_issue_data(3))
+    )
+
+    cache = caching.IssueCacheDict(store)
+
+    assert cache.keys() == (IssueID(3),)
+
+
+def test_intern_memory(cache_dir: Path) -> None:
+    """
+    Labels and users of cached issues are shared, reducing the memory needed
+
+    Run with `pytest -s` to see the numbers.
+    """
+    labels = [f"label_{i}" for i in range(30)]
+    contents = [
+        orjson.dumps(gen_issue_data(issue_id, labels=labels[issue_id % 27 :][:3]))
+        for issue_id in range(10_000)
+    ]
+
+    def measure(validate: Callable[[bytes], Issue]) -> tuple[int, list[Issue]]:
+        tracemalloc.start()
+        try:
+            issues = [validate(content) for content in contents]
+            return tracemalloc.get_traced_memory()[0], issues
+        finally:
+            tracemalloc.stop()
+
+    plain, _ = measure(Issue.model_validate_json)
+    interned, issues = measure(caching.validate_issue)
+
+    print(f"\n   plain: {plain / 1024:8.0f} KiB\ninterned: {interned / 1024:8.0f} KiB")
+    assert interned < plain * 0.7
+    assert issues[0].assignees[0] is issues[-1].assignees[0]
+    store = cache_stores.SqliteStore(cache_dir / "issues.sqlite")
+    cache = caching.IssueCacheDict(store, lazy=False, write_behind=False)
+    cache.update(gen_issue_data(1, labels=labels[:2]), remove=lambda _: False)
+    cache.update(gen_issue_data(2, labels=labels[1:3]), remove=lambda _: False)
+    assert cache[IssueID(1)].labels[1] is cache[IssueID(2)].labels[0]
+    loaded = caching.IssueCacheDict(store, lazy=False)
+    assert loaded[IssueID(1)].labels[1] is loaded[IssueID(2)].labels[0]
+
+
+def test_memory_tiers(store: cache_stores.IssueStore) -> None:
+    """Cold issues are evicted to stay within the budget and reloaded on access"""
+    # all closed issues have the same size
+    size = len(Issue.model_validate(gen_issue_data(2, closed=True)).model_dump_json())
+    cache = caching.IssueCacheDict(
+        store, lazy=False, write_behind=False, memory_budget=3 * size
+    )
+    with cache.batch():
+        for issue_id in range(1, 10):
+            cache.update(gen_issue_data(issue_id, closed=True), lambda _: False)
+        cache.update(gen_issue_data(10, labels=["opened"]), lambda _: False)
+
+    stats = cache.tier_stats()
+    assert stats["hot"].issues == stats["hot"].resident == 1
+    assert stats["cold"] == caching.TierStats(9, 3, 3 * size)
+
+    # evicted issues are reloaded and the least recently used is evicted instead
+    assert [cache[IssueID(issue_id)].id for issue_id in range(1, 10)] == list(
+        range(1, 10)
+    )
+    assert cache.tier_stats()["cold"] == caching.TierStats(9, 3, 3 * size)
+
+    # referenced issues are hot and stay in memory
+    cache.set_referenced("board", [IssueID(issue_id) for issue_id in range(1, 6)])
+    for issue_id in range(1, 6):
+        cache[IssueID(issue_id)]
+    stats = cache.tier_stats()
+    assert stats["hot"].issues == stats["hot"].resident == 6
+    assert stats["cold"] == caching.TierStats(4, 3, 3 * size)
+
+    reloaded = caching.IssueCacheDict(store, lazy=False, memory_budget=0)
+    assert reloaded.tier_stats()["cold"] == caching.TierStats(9, 0, 0)
+    assert reloaded[IssueID(4)].state == "closed"
+
+
+def test_label_project_ids(store: cache_stores.IssueStore) -> None:
+    """The projects of labels follow writes and deletions"""
+    store.write(
+        {
+            IssueID(1): cache_stores.IssueRecord(
+                orjson.dumps(gen_issue_data(1, labels=["foo"], project_id=1))
+            ),
+            IssueID(2): cache_stores.IssueRecord(
+                orjson.dumps(gen_issue_data(2, labels=["bar"], project_id=2))
+            ),
+        }
+    )
+    assert store.label_project_ids(["foo"]) == {1}
+
+    store.write(
+        {
+            IssueID(2): cache_stores.IssueRecord(
+                orjson.dumps(gen_issue_data(2, labels=["foo"], project_id=2))
+            )
+        }
+    )
+    assert store.label_project_ids(["foo"]) == {1, 2}
+    assert store.label_project_ids(["bar"]) == set()
+
+    store.delete([IssueID(1)])
+    assert store.label_project_ids(["foo", "bar"]) == {2}
+    if isinstance(store, cache_stores.JsonFileStore):
+        # e.g. written by an older version
+        (store.folder / store.labels_file).unlink()
+        assert store.label_project_ids(["foo"]) == {2}
+    store.clear()
+    assert store.label_project_ids(["foo"]) == set()
+
+
+def test_load_projects(store: cache_stores.IssueStore) -> None:
+    """Only the given projects are loaded, others once requested"""
+    writer = caching.IssueCacheDict(store)
+    writer.update(gen_issue_data(1, labels=["foo"], project_id=1), lambda _: False)
+    writer.update(gen_issue_data(2, labels=["bar"], project_id=2), lambda _: False)
+    writer.update(gen_issue_data(3, project_id=3), lambda _: False)
+    writer.flush()
+
+    assert store.label_project_ids(["foo", "bar"]) == {1, 2}
+    cache = caching.IssueCacheDict(store, project_ids=[1])
+    assert cache.keys() == (1,)
+    assert cache.loaded_projects == frozenset({1})
+
+    # issues of not loaded projects are compared with the stored ones
+    unchanged = gen_issue_data(2, labels=["bar"], project_id=2)
+    assert cache.update(unchanged, lambda _: False) == "unchanged"
+    assert cache.update(gen_issue_data(3, project_id=3), lambda _: True) == "removed"
+    cache.flush()
+    assert store.load(IssueID(3)) is None
+
+    cache.load_projects([2])
+    assert sorted(cache.keys()) == [1, 2]
+    cache.load_projects()
+    assert cache.loaded_projects is None
+    assert sorted(cache.keys()) == [1, 2]
+
+
+def test_labels(store: cache_stores.IssueStore) -> None:
+    """The most used definition of each label is returned"""
+    red = {"name": "foo", "color": "red", "text_color": "white"}
+    blue = {"name": "foo", "color": "blue", "text_color": "white"}
+    cache = caching.IssueCacheDict(store)
+    cache.update(gen_issue_data(1, labels=[red, "bar"]), remove=lambda _: False)
+    cache.update(gen_issue_data(2, labels=[blue], project_id=5), lambda _: False)
+    cache.update(gen_issue_data(3, labels=[blue], project_id=5), lambda _: False)
+
+    labels = cache.labels()
+
+    assert labels.keys() == {"foo", "bar"}
+    assert labels["foo"].color == "blue"
+    assert labels["bar"].name == "bar"
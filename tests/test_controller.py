@@ -3,7 +3,7 @@ from dataclasses import dataclass
 
 import pytest
 
-from gitlab_personal_issue_board import controller, models
+from gitlab_personal_issue_board import caching, controller, models
 
 from .conftest import gen_issue, gen_label_card
 
@@ -182,17 +182,25 @@ def test_card_label_test_data_cards() -> None:
     ],
     ids=str,
 )
-def test_sort_issues_in_cards_by_labels(test_data: CardLabelTestData) -> None:
+@pytest.mark.parametrize("indexed", [False, True], ids=["scan", "indexed"])
+def test_sort_issues_in_cards_by_labels(
+    test_data: CardLabelTestData, indexed: bool
+) -> None:
     """
     Our test cases generate the expected cards
 
-    If a card is not changed the same card is returned
+    If a card is not changed the same card is returned.
+    Using the index of the issues gives the same result.
     """
     issues = test_data.fake_issues
     cards = test_data.fake_cards
     expected = test_data.expected_cards
+    index = caching.IssueIndex()
+    for issue in issues:
+        index.add(caching.IssueSummary.from_issue(issue))
+    version = caching.CacheVersion(0, {}, index) if indexed else None
 
-    got = tuple(controller.sort_issues_in_cards_by_label(issues, cards))
+    got = tuple(controller.sort_issues_in_cards_by_label(issues, cards, version))
 
     assert got == expected
 
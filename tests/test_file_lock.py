@@ -0,0 +1,35 @@
+import subprocess
+import sys
+from pathlib import Path
+
+from gitlab_personal_issue_board.file_lock import FileLock
+
+TRY_LOCK = """
+import sys
+from pathlib import Path
+from gitlab_personal_issue_board.file_lock import FileLock
+sys.exit(0 if FileLock(Path(sys.argv[1])).acquire(blocking=False) else 1)
+"""
+
+
+def try_lock_in_other_process(path: Path) -> bool:
+    result = subprocess.run(  # noqa: S603 only runs the test code
+        [sys.executable, "-c", TRY_LOCK, str(path)], check=False
+    )
+    return result.returncode == 0
+
+
+def test_file_lock(tmp_path: Path) -> None:
+    """A held lock can't be acquired by other locks or processes until released"""
+    path = tmp_path / "locks" / "test.lock"
+    lock = FileLock(path)
+    other = FileLock(path)
+
+    with lock:
+        assert not lock.acquire(blocking=False)
+        assert not other.acquire(blocking=False)
+        assert not try_lock_in_other_process(path)
+
+    assert try_lock_in_other_process(path)
+    assert other.acquire(blocking=False)
+    other.release()
@@ -0,0 +1,369 @@
+import asyncio
+import threading
+import time
+from collections import Counter
+from collections.abc import AsyncIterator
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+from unittest import mock
+
+import gitlab as python_gitlab
+import httpx
+import pytest
+import requests
+
+from gitlab_personal_issue_board import (
+    file_lock,
+    gitlab,
+    models,
+    request_scheduler,
+    settings,
+)
+
+from .conftest import FAKE_GITLAB, FAKE_USER, gen_issue_data, gen_label_card
+
+
+def test_label_changes() -> None:
+    """Moves only add and remove the labels of the cards"""
+    foo, bar, baz = (
+        models.Label(name=name, color="white", text_color="black")
+        for name in ("foo", "bar", "baz")
+    )
+
+    assert gitlab.label_changes("opened", foo, [foo, bar, baz]) == {
+        "add_labels": "foo",
+        "remove_labels": "bar,baz",
+    }
+    assert gitlab.label_changes("closed", "opened", [foo]) == {
+        "remove_labels": "foo",
+        "state_event": "reopen",
+    }
+    assert gitlab.label_changes("opened", "closed", []) == {"state_event": "close"}
+
+
+def test_label_cache() -> None:
+    """Labels expire after the ttl and created labels are added"""
+    cache = gitlab.LabelCache(ttl=10)
+    with mock.patch("time.monotonic", return_value=100):
+        cache.set(1, [{"name": "foo"}])
+        assert cache.add(1, {"name": "bar"}).keys() == {"foo", "bar"}
+        assert cache.add(2, {"name": "bar"}).keys() == {"bar"}
+        assert cache.get(2) is None
+    with mock.patch("time.monotonic", return_value=105):
+        labels = cache.get(1)
+        assert labels is not None
+        assert labels.keys() == {"foo", "bar"}
+    with mock.patch("time.monotonic", return_value=111):
+        assert cache.get(1) is None
+
+
+def test_move_journal(issues: gitlab.Issues) -> None:
+    """Moves are shown at once and sent in the background until accepted"""
+    foo, bar = (gen_label_card(name).label for name in ("foo", "bar"))
+    assert isinstance(foo, models.Label) and isinstance(bar, models.Label)
+    save = mock.AsyncMock(side_effect=[ConnectionError("offline"), None])
+    issues._save_move_async = save  # type: ignore[method-assign]
+    issues._move_delay = 0
+
+    issues.move(issues[models.IssueID(1)], bar, [foo, bar])
+    assert [label.name for label in issues[models.IssueID(1)].labels] == ["bar"]
+    # the move is superseded, the issue must be reopened
+    issues.move(issues[models.IssueID(1)], "closed", [foo, bar])
+    assert issues[models.IssueID(1)].state == "closed"
+
+    asyncio.run(issues.send_moves())
+    failed = issues.pending_moves()[models.IssueID(1)]
+    assert failed.error == "ConnectionError: offline"
+    assert failed.retry_at is not None
+    # retried only after the backoff
+    asyncio.run(issues.send_moves())
+    assert save.await_count == 1
+
+    issues._journal.failed(failed, "", datetime.now(UTC))
+    asyncio.run(issues.send_moves())
+    assert issues.pending_moves() == {}
+    assert save.await_args == mock.call(
+        123, 1, "closed", {"remove_labels": "bar,foo", "state_event": "close"}
+    )
+
+
+def test_moves_sent_by_one_process(issues: gitlab.Issues) -> None:
+    """Moves are not sent while another process is sending them"""
+    foo, bar = (gen_label_card(name).label for name in ("foo", "bar"))
+    assert isinstance(foo, models.Label) and isinstance(bar, models.Label)
+    save = mock.AsyncMock(return_value=None)
+    issues._save_move_async = save  # type: ignore[method-assign]
+    issues._move_delay = 0
+    issues.move(issues[models.IssueID(1)], bar, [foo, bar])
+
+    other_process = file_lock.FileLock(issues._send_lock.path)
+    with other_process:
+        asyncio.run(issues.send_moves())
+    assert save.await_count == 0
+
+    asyncio.run(issues.send_moves())
+    assert save.await_count == 1
+    assert issues.pending_moves() == {}
+
+
+def test_delta_refresh(issues: gitlab.Issues) -> None:
+    """Only issues assigned to me and cached ones are requested by a delta refresh"""
+    issues._cache.update(gen_issue_data(3), remove=lambda _: False)
+    issues._cache.update(gen_issue_data(4, project_id=5), remove=lambda _: False)
+    last_updated = datetime(2024, 12, 12, 5, tzinfo=UTC)
+    issues._instances[0].last_updated = last_updated
+    gl = mock.Mock(url=FAKE_GITLAB)
+    issues._instances[0].gl = gl
+    gl.issues.list.return_value = [gen_issue_data(2), gen_issue_data(3)]
+    unassigned = gen_issue_data(1) | {"assignees": []}
+    gl.projects.get.return_value.issues.list.side_effect = [[], [unassigned]]
+
+    assert issues.refresh().status is True
+
+    assert sorted(issues.keys()) == [2, 3, 4]
+    gl.issues.list.assert_called_once_with(
+        iterator=True,
+        scope="assigned_to_me",
+        with_labels_details=True,
+        updated_after=last_updated,
+    )
+    # issue 3 was listed as assigned already
+    assert gl.projects.get.return_value.issues.list.call_args_list == [
+        mock.call(
+            iterator=True,
+            iids=(iid,),
+            updated_after=last_updated,
+            with_labels_details=True,
+        )
+        for iid in (4, 1)
+    ]
+    assert [call.args[0] for call in gl.projects.get.call_args_list] == [5, 123]
+
+
+def test_refresh_instances_concurrently(
+    cache_dir: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """
+    Issues of all instances are cached apart, a slow instance doesn't delay the
+    others
+    """
+    config = settings.GitlabSettings(config_sections=("local",), page_concurrency=1)
+    monkeypatch.setattr(settings, "load_settings", lambda: settings.Settings(config))
+    monkeypatch.setattr(settings, "data_dir", lambda: cache_dir)
+    slow = mock.Mock(url=FAKE_GITLAB)
+    fast = mock.Mock(url="https://gitlab.local.example/")
+    connections = {None: slow, "local": fast}
+    monkeypatch.setattr(gitlab, "get_gitlab", connections.__getitem__)
+    monkeypatch.setattr(
+        gitlab, "get_gitlab_user", lambda config_section=None: FAKE_USER
+    )
+    issues = gitlab.Issues()
+    fast_id = models.IssueID(models.namespaced_id(2, 1))
+    fast_cached: list[bool] = []
+
+    def list_slow(**kwargs: Any) -> list[dict[str, Any]]:
+        deadline = time.monotonic() + 5
+        while fast_id not in issues.keys() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        fast_cached.append(fast_id in issues.keys())
+        return [gen_issue_data(2)]
+
+    slow.issues.list.side_effect = list_slow
+    fast.issues.list.return_value = [gen_issue_data(2)]
+
+    try:
+        result = issues.refresh()
+        assert result.status is True
+        assert fast_cached == [True]
+        assert sorted(issues.keys()) == [2, fast_id]
+        assert issues[fast_id].project_id == models.namespaced_id(123, 1)
+        assert result.changes == 2
+    finally:
+        issues.close()
+
+
+def test_refresh_async_joined(issues: gitlab.Issues) -> None:
+    """Refreshes requested while one is running get the result of that one"""
+    started: list[bool] = []
+
+    async def refresh_all() -> gitlab.RefreshResult:
+        started.append(True)
+        await asyncio.sleep(0.01)
+        return gitlab.RefreshResult(True, Counter(["new"]))
+
+    issues._refresh_all_async = refresh_all  # type: ignore[method-assign]
+
+    async def refresh_twice() -> tuple[gitlab.RefreshResult, gitlab.RefreshResult]:
+        return await asyncio.gather(issues.refresh_async(), issues.refresh_async())
+
+    first, second = asyncio.run(refresh_twice())
+    assert first is second
+    assert first.changes == 1
+    assert len(started) == 1
+    asyncio.run(issues.refresh_async())
+    assert len(started) == 2
+
+
+def test_refresh_async_applies_in_thread(issues: gitlab.Issues) -> None:
+    """Listed issues are cached in worker threads, never blocking the event loop"""
+    lock = issues._cache._change_lock
+    batch_held: list[bool] = []
+    apply_threads: list[int] = []
+
+    def held_by_other() -> bool:
+        if lock.acquire(blocking=False):
+            lock.release()
+            return False
+        return True
+
+    async def list_issues(*args: Any, **kwargs: Any) -> AsyncIterator[dict[str, Any]]:
+        # the cache isn't kept in a batch while waiting for gitlab
+        batch_held.append(await asyncio.to_thread(held_by_other))
+        yield gen_issue_data(2)
+
+    def apply(*args: Any) -> None:
+        apply_threads.append(threading.get_ident())
+        gitlab.Issues._apply_refreshed(issues, *args)
+
+    def write_snapshot() -> None:
+        apply_threads.append(threading.get_ident())
+
+    issues._instances[0].async_gl = mock.Mock(list_issues=list_issues)
+    issues._apply_refreshed = apply  # type: ignore[method-assign,assignment]
+    issues._cache.write_snapshot = write_snapshot  # type: ignore[method-assign]
+
+    assert asyncio.run(issues.refresh_async()).status is True
+
+    assert sorted(issues.keys()) == [1, 2]
+    assert batch_held == [False]
+    assert len(apply_threads) == 2
+    assert threading.get_ident() not in apply_threads
+
+
+class FailingAdapter(requests.adapters.BaseAdapter):
+    """Answer every request with *status*"""
+
+    def __init__(self, status: int) -> None:
+        super().__init__()
+        self.status = status
+        self.sent: list[str] = []
+
+    def send(
+        self, request: requests.PreparedRequest, *args: Any, **kwargs: Any
+    ) -> requests.Response:
+        self.sent.append(request.method or "")
+        response = requests.Response()
+        response.status_code = self.status
+        response.headers["Retry-After"] = "0"
+        response.request = request
+        response.url = request.url or ""
+        return response
+
+    def close(self) -> None:
+        pass
+
+
+@pytest.mark.parametrize(
+    ("status", "method", "sent"),
+    [(429, "get", 3), (503, "get", 3), (429, "post", 3), (503, "post", 1)],
+)
+def test_requests_retried_once_per_layer(status: int, method: str, sent: int) -> None:
+    """Only the scheduled session retries, failed POSTs aren't retried at all"""
+    scheduler = request_scheduler.RequestScheduler(max_retries=2, backoff=0.001)
+    session = request_scheduler.ScheduledSession(scheduler)
+    adapter = FailingAdapter(status)
+    session.mount("https://", adapter)
+    gl = gitlab.ScheduledGitlab(
+        FAKE_GITLAB, session=session, retry_transient_errors=True
+    )
+
+    with pytest.raises(python_gitlab.GitlabHttpError):
+        getattr(gl, f"http_{method}")("/projects")
+
+    assert len(adapter.sent) == sent
+
+
+def test_refresh_drops_inaccessible_projects(issues: gitlab.Issues) -> None:
+    """Issues of projects no longer accessible are removed, the others refreshed"""
+    issues._cache.update(gen_issue_data(4, project_id=5), remove=lambda _: False)
+    instance = issues._instances[0]
+    instance.last_updated = datetime(2024, 12, 12, 5, tzinfo=UTC)
+    gl = mock.Mock(url=FAKE_GITLAB)
+    instance.gl = gl
+    gl.issues.list.return_value = [gen_issue_data(2)]
+    gl.projects.get.return_value.issues.list.side_effect = [
+        python_gitlab.GitlabListError("404 Project Not Found", response_code=404),
+        [],
+    ]
+
+    result = issues.refresh()
+
+    assert result.status is True
+    assert sorted(issues.keys()) == [1, 2]
+    assert result.counts["removed"] == 1
+    assert instance.last_updated > datetime(2024, 12, 12, 5, tzinfo=UTC)
+
+
+def test_refresh_async_drops_inaccessible_projects(issues: gitlab.Issues) -> None:
+    """Same as with python-gitlab, for the async backend"""
+    issues._cache.update(gen_issue_data(4, project_id=5), remove=lambda _: False)
+    instance = issues._instances[0]
+    instance.last_updated = datetime(2024, 12, 12, 5, tzinfo=UTC)
+
+    async def list_issues(*args: Any, **kwargs: Any) -> AsyncIterator[dict[str, Any]]:
+        yield gen_issue_data(2)
+
+    async def list_project_issues(
+        project_id: int, *args: Any, **kwargs: Any
+    ) -> AsyncIterator[dict[str, Any]]:
+        if project_id == 5:
+            request = httpx.Request("GET", f"{FAKE_GITLAB}api/v4/projects/5/issues")
+            response = httpx.Response(403, request=request)
+            response.raise_for_status()
+        return
+        yield
+
+    instance.async_gl = mock.Mock(
+        list_issues=list_issues, list_project_issues=list_project_issues
+    )
+
+    result = asyncio.run(issues.refresh_async())
+
+    assert result.status is True
+    assert sorted(issues.keys()) == [1, 2]
+    assert result.counts["removed"] == 1
+
+
+def test_user_resolved_by_refresh(
+    cache_dir: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """
+    Starting doesn't authenticate, cached issues are kept while the user is unknown
+    and failed authentications are tried again
+    """
+    config = settings.GitlabSettings(page_concurrency=1)
+    monkeypatch.setattr(settings, "load_settings", lambda: settings.Settings(config))
+    monkeypatch.setattr(settings, "data_dir", lambda: cache_dir)
+    gl = mock.Mock(url=FAKE_GITLAB)
+    gl.auth.side_effect = [python_gitlab.GitlabAuthenticationError("timeout"), None]
+    gl.user.attributes = FAKE_USER.model_dump()
+    gl.issues.list.return_value = [gen_issue_data(2)]
+    gl.projects.get.return_value.issues.list.return_value = []
+    monkeypatch.setattr(gitlab, "get_gitlab", lambda config_section=None: gl)
+    gitlab.get_gitlab_user.cache_clear()
+    issues = gitlab.Issues()
+    try:
+        issues._cache.update(gen_issue_data(1), remove=lambda _: False)
+        issues.load_projects()
+        assert gl.auth.call_count == 0
+
+        assert "GitlabAuthenticationError" in str(issues.refresh().status)
+        assert issues.keys() == (1,)
+
+        assert issues.refresh().status is True
+        assert sorted(issues.keys()) == [1, 2]
+        assert gl.auth.call_count == 2
+    finally:
+        issues.close()
+        gitlab.get_gitlab_user.cache_clear()
@@ -0,0 +1,222 @@
+import asyncio
+import json
+import threading
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, ClassVar
+from urllib.parse import parse_qs, urlparse
+
+import gitlab as python_gitlab
+import httpx
+import pytest
+
+from gitlab_personal_issue_board import gitlab, models, settings
+from gitlab_personal_issue_board.gitlab_async import AsyncGitlab
+from gitlab_personal_issue_board.request_scheduler import RequestScheduler
+
+from .conftest import gen_issue_data, gen_label_data
+
+
+class FakeGitlab(BaseHTTPRequestHandler):
+    """Serve the few gitlab API endpoints used by *AsyncGitlab*"""
+
+    issues: ClassVar = [gen_issue_data(issue_id) for issue_id in range(1, 6)]
+    requests: ClassVar[list[tuple[str, str, Any]]] = []
+    #: send the number of pages, which gitlab omits for large listings
+    total_pages: ClassVar = True
+
+    def _reply(self, data: Any, headers: dict[str, str] | None = None) -> None:
+        body = json.dumps(data, default=str).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        self.requests.append(("GET", url.path, query))
+        if url.path == "/api/v4/issues":
+            page = int(query.get("page", ["1"])[0])
+            total_pages = (len(self.issues) + 1) // 2
+            headers = {"X-Total-Pages": str(total_pages)} if self.total_pages else {}
+            if page * 2 < len(self.issues):
+                host = f"http://{self.headers['Host']}"
+                next_url = f"{host}/api/v4/issues?scope=all&page={page + 1}"
+                headers["Link"] = f'<{next_url}>; rel="next"'
+            self._reply(self.issues[(page - 1) * 2 : page * 2], headers)
+        elif url.path == "/api/v4/projects/123/labels":
+            self._reply([gen_label_data("foo")])
+        else:
+            self._reply({**self.issues[0], "labels": ["foo"]})
+
+    def do_PUT(self) -> None:
+        length = int(self.headers["Content-Length"])
+        data = json.loads(self.rfile.read(length))
+        self.requests.append(("PUT", self.path, data))
+        labels = {label["name"] for label in self.issues[0]["labels"]}
+        labels -= set(data.get("remove_labels", "").split(","))
+        labels |= set(filter(None, [data.get("add_labels")]))
+        self._reply({**self.issues[0], "labels": sorted(labels)})
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+@pytest.fixture
+def fake_gitlab() -> Iterator[str]:
+    FakeGitlab.requests = []
+    FakeGitlab.total_pages = True
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGitlab)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_list_issues_follows_pages(fake_gitlab: str) -> None:
+    """All pages of a listing are requested"""
+
+    async def list_issues() -> list[dict[str, Any]]:
+        gl = AsyncGitlab(fake_gitlab, {"PRIVATE-TOKEN": "secret"}, max_connections=1)
+        try:
+            return [issue async for issue in gl.list_issues("all")]
+        finally:
+            await gl.aclose()
+
+    issues = asyncio.run(list_issues())
+
+    assert [issue["id"] for issue in issues] == [1, 2, 3, 4, 5]
+    assert len(FakeGitlab.requests) == 3
+    assert FakeGitlab.requests[0][2]["with_labels_details"] == ["true"]
+
+
+def test_list_issues_concurrently(fake_gitlab: str) -> None:
+    """Pages requested at once are returned in page order"""
+
+    async def list_issues() -> list[dict[str, Any]]:
+        gl = AsyncGitlab(fake_gitlab, {})
+        try:
+            return [
+                issue async for issue in gl.list_issues("assigned_to_me", concurrency=2)
+            ]
+        finally:
+            await gl.aclose()
+
+    issues = asyncio.run(list_issues())
+
+    assert [issue["id"] for issue in issues] == [1, 2, 3, 4, 5]
+    assert sorted(request[2]["page"] for request in FakeGitlab.requests) == [
+        ["1"],
+        ["2"],
+        ["3"],
+    ]
+
+
+@pytest.mark.parametrize("total_pages", [True, False], ids=["total", "no_total"])
+def test_list_pages_concurrently(
+    fake_gitlab: str,
+    cache_dir: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    total_pages: bool,
+) -> None:
+    """
+    The python-gitlab backend returns the pages requested at once in page order
+
+    Without the number of pages, the pages are requested one by one.
+    """
+    FakeGitlab.total_pages = total_pages
+    monkeypatch.setattr(settings, "data_dir", lambda: cache_dir)
+    monkeypatch.setattr(
+        gitlab,
+        "get_gitlab",
+        lambda config_section=None: python_gitlab.Gitlab(fake_gitlab),
+    )
+    config = settings.GitlabSettings(page_concurrency=2)
+    instance = gitlab.Instance(None, config)
+
+    issues = list(instance.list_assigned())
+
+    assert [issue["id"] for issue in issues] == [1, 2, 3, 4, 5]
+    assert sorted(request[2]["page"][0] for request in FakeGitlab.requests) == [
+        "1",
+        "2",
+        "3",
+    ]
+
+
+def test_update_issue(fake_gitlab: str) -> None:
+    """Label changes are sent in a single update"""
+
+    async def move() -> dict[str, Any]:
+        gl = AsyncGitlab(fake_gitlab, {})
+        try:
+            changes = gitlab.label_changes(
+                "opened",
+                "closed",
+                [models.Label(name="foo", color="white", text_color="black")],
+            )
+            return await gl.update_issue(123, 1, changes)
+        finally:
+            await gl.aclose()
+
+    asyncio.run(move())
+    assert FakeGitlab.requests == [
+        (
+            "PUT",
+            "/api/v4/projects/123/issues/1",
+            {"remove_labels": "foo", "state_event": "close"},
+        )
+    ]
+
+
+def test_retry_failed_requests() -> None:
+    """Rate limited and failed requests are sent again"""
+    responses = iter(
+        [
+            httpx.Response(429, headers={"Retry-After": "0"}),
+            httpx.Response(503),
+            httpx.Response(200, json={"id": 1}),
+        ]
+    )
+
+    async def get() -> dict[str, Any]:
+        gl = AsyncGitlab(
+            "http://gitlab.test",
+            {},
+            transport=httpx.MockTransport(lambda request: next(responses)),
+            scheduler=RequestScheduler(backoff=0.01),
+        )
+        try:
+            return await gl.get_issue(123, 1)
+        finally:
+            await gl.aclose()
+
+    assert asyncio.run(get()) == {"id": 1}
+
+
+def test_graphql() -> None:
+    """GraphQL queries are posted to the GraphQL endpoint of the instance"""
+    requests: list[httpx.Request] = []
+
+    def handle(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, json={"data": {"currentUser": None}})
+
+    async def query() -> dict[str, Any]:
+        gl = AsyncGitlab(
+            "http://gitlab.test", {}, transport=httpx.MockTransport(handle)
+        )
+        try:
+            return await gl.graphql({"query": "{ currentUser { id } }"})
+        finally:
+            await gl.aclose()
+
+    assert asyncio.run(query()) == {"data": {"currentUser": None}}
+    assert str(requests[0].url) == "http://gitlab.test/api/graphql"
+    assert json.loads(requests[0].content) == {"query": "{ currentUser { id } }"}
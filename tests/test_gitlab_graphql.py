@@ -0,0 +1,98 @@
+from typing import Any
+from unittest import mock
+
+import pytest
+
+from gitlab_personal_issue_board import gitlab, gitlab_graphql, models
+
+from .conftest import FAKE_GITLAB, FAKE_USER, gen_issue
+
+
+def gen_node(issue_id: int, labels: tuple[str, ...] = ()) -> dict[str, Any]:
+    """An issue as returned by the GraphQL query"""
+    return {
+        "id": f"gid://gitlab/Issue/{issue_id}",
+        "iid": str(issue_id),
+        "title": "An Issue",
+        "description": "Issue Description",
+        "state": "opened",
+        "labels": {
+            "nodes": [
+                {
+                    "title": label,
+                    "color": "white",
+                    "textColor": "black",
+                    "description": None,
+                }
+                for label in labels
+            ]
+        },
+        "assignees": {
+            "nodes": [
+                {
+                    "id": f"gid://gitlab/User/{FAKE_USER.id}",
+                    "username": FAKE_USER.username,
+                    "name": FAKE_USER.name,
+                    "avatarUrl": FAKE_USER.avatar_url,
+                }
+            ]
+        },
+        "webUrl": f"{FAKE_GITLAB}/fake/project/-/issues/{issue_id}",
+        "shortReference": f"#{issue_id}",
+        "fullReference": f"fake/project/#{issue_id}",
+        "createdAt": "2024-12-12T03:12:00Z",
+        "updatedAt": "2024-12-12T04:15:00Z",
+        "dueDate": None,
+        "projectId": 123,
+    }
+
+
+def gen_page(*nodes: dict[str, Any], cursor: str | None = None) -> dict[str, Any]:
+    return {
+        "data": {
+            "currentUser": {
+                "assignedIssues": {
+                    "pageInfo": {
+                        "hasNextPage": cursor is not None,
+                        "endCursor": cursor,
+                    },
+                    "nodes": list(nodes),
+                }
+            }
+        }
+    }
+
+
+def test_issue_from_node() -> None:
+    """Issues of the GraphQL API are the same as the ones of the REST API"""
+    data = gitlab_graphql.issue_from_node(gen_node(1, labels=("foo",)))
+    assert models.Issue.model_validate(data) == gen_issue(1, labels=["foo"])
+
+
+def test_parse_errors() -> None:
+    with pytest.raises(gitlab_graphql.GraphQLError, match="Field 'foo' missing"):
+        gitlab_graphql.parse_assigned_issues(
+            {"errors": [{"message": "Field 'foo' missing"}]}
+        )
+
+
+def test_refresh_with_graphql(issues: gitlab.Issues) -> None:
+    """All pages of the query are requested by a refresh"""
+    gl = mock.Mock(url=FAKE_GITLAB)
+    gl.http_post.side_effect = [
+        gen_page(gen_node(2), cursor="next"),
+        gen_page(gen_node(3)),
+    ]
+    issues._instances[0].gl = gl
+    issues._instances[0].sync = "graphql"
+
+    assert issues.refresh().status is True
+
+    assert sorted(issues.keys()) == [1, 2, 3]
+    assert issues[models.IssueID(3)] == gen_issue(3)
+    cursors = [
+        call.kwargs["post_data"]["variables"]["after"]
+        for call in gl.http_post.call_args_list
+    ]
+    assert cursors == [None, "next"]
+    assert gl.http_post.call_args.args == (f"{FAKE_GITLAB}/api/graphql",)
@@ -2,13 +2,17 @@ import pytest
 from pydantic import ValidationError
 
 from gitlab_personal_issue_board.models import (
+    InternPool,
+    Issue,
     Label,
     LabelBoard,
     LabelBoardID,
     LabelCard,
+    namespaced_id,
+    split_namespace,
 )
 
-from .conftest import gen_label_card_data
+from .conftest import gen_issue_data, gen_label_card_data
 
 
 def test_label_board_multiple_labels() -> None:
@@ -111,3 +115,38 @@ def test_label_board_with_no_cards() -> None:
     board = LabelBoard(id=LabelBoardID("fake"), name="fake", cards=())
     assert board.has_opened is False
     assert board.has_closed is False
+
+
+def test_issue_intern_labels_and_users() -> None:
+    """Issues validated with the same intern pool share equal labels and users"""
+    pool = InternPool()
+    context = {"intern": pool}
+
+    first = Issue.model_validate(gen_issue_data(1, labels=["foo"]), context=context)
+    second = Issue.model_validate(gen_issue_data(2, labels=["foo"]), context=context)
+    other = Issue.model_validate(gen_issue_data(3, labels=["foo"]))
+
+    assert first.labels[0] is second.labels[0]
+    assert first.assignees[0] is second.assignees[0]
+    assert other.labels[0] is not first.labels[0]
+    assert other.labels == first.labels
+    assert len(pool) == 2
+
+
+def test_issue_copy_derives_names_from_new_fields() -> None:
+    """Label names and assignees follow the labels of copies"""
+    issue = Issue.model_validate(gen_issue_data(1, labels=["foo"]))
+    assert issue.label_names == {"foo"}
+
+    copy = issue.model_copy(update={"labels": (), "assignees": ()})
+
+    assert copy.label_names == frozenset()
+    assert copy.assignee_usernames == frozenset()
+    assert issue.label_names == {"foo"}
+
+
+def test_namespaced_id() -> None:
+    """Namespace 0 keeps the ids, others are offset so ids don't collide"""
+    assert namespaced_id(42, 0) == 42
+    assert namespaced_id(42, 1) != 42
+    assert split_namespace(namespaced_id(42, 3)) == (3, 42)
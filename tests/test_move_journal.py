@@ -0,0 +1,75 @@
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+
+from gitlab_personal_issue_board import models
+from gitlab_personal_issue_board.move_journal import Move, MoveJournal
+
+from .conftest import gen_issue
+
+START = datetime(2024, 12, 12, 3, 12, tzinfo=UTC)
+
+
+def gen_label(name: str) -> models.Label:
+    return models.Label(name=name, color="white", text_color="black")
+
+
+def gen_move(new_label: str, *old_labels: str, seconds: int = 0) -> Move:
+    issue = gen_issue(1)
+    return Move(
+        issue_id=issue.id,
+        project_id=issue.project_id,
+        iid=issue.iid,
+        new_label="closed" if new_label == "closed" else gen_label(new_label),
+        old_labels=tuple(gen_label(name) for name in old_labels),
+        state=issue.state,
+        requested=START + timedelta(seconds=seconds),
+    )
+
+
+def test_journal_persisted(tmp_path: Path) -> None:
+    """Moves are kept across instances until they are done"""
+    path = tmp_path / "moves.json"
+    move = MoveJournal(path).put(gen_move("foo", "bar"))
+
+    other = MoveJournal(path)
+    assert other.moves() == {move.issue_id: move}
+    other.done(move)
+    assert MoveJournal(path).moves() == {}
+
+
+def test_journal_supersede(tmp_path: Path) -> None:
+    """A later move of an issue replaces the earlier one, keeping its state"""
+    journal = MoveJournal(tmp_path / "moves.json")
+    first = journal.put(gen_move("closed", "foo"))
+    second = journal.put(gen_move("bar", "foo", "baz", seconds=1))
+
+    assert journal.moves() == {second.issue_id: second}
+    assert second.state == "opened"
+    assert [label.name for label in second.old_labels] == ["foo", "baz"]
+
+    # the first move was sent meanwhile, the second one has to reopen the issue
+    journal.done(first)
+    current = journal.moves()[second.issue_id]
+    assert current.state == "closed"
+    assert current.requested == second.requested
+
+
+def test_journal_failed(tmp_path: Path) -> None:
+    """Failed moves are retried later, unless they were superseded"""
+    journal = MoveJournal(tmp_path / "moves.json")
+    move = journal.put(gen_move("foo"))
+    delay = timedelta(seconds=1)
+    assert not move.is_due(START, delay)
+    assert move.is_due(START + delay, delay)
+
+    journal.failed(move, "ConnectError: offline", START + timedelta(seconds=10))
+    failed = journal.moves()[move.issue_id]
+    assert failed.attempts == 1
+    assert failed.error == "ConnectError: offline"
+    assert not failed.is_due(START + delay, delay)
+    assert failed.is_due(START + timedelta(seconds=10), delay)
+
+    newer = journal.put(gen_move("bar", seconds=2))
+    journal.failed(failed, "ConnectError: offline", START)
+    assert journal.moves()[move.issue_id].attempts == 0
+    assert journal.moves()[move.issue_id].requested == newer.requested
@@ -0,0 +1,41 @@
+import asyncio
+import contextlib
+from collections import Counter
+from typing import Literal
+from unittest import mock
+
+from gitlab_personal_issue_board.gitlab import RefreshResult
+from gitlab_personal_issue_board.refresh_scheduler import RefreshScheduler
+
+
+def test_adapt_interval() -> None:
+    """Refresh more often while issues change, less often while idle or failing"""
+    scheduler = RefreshScheduler(interval=100, min_interval=60, max_interval=400)
+
+    assert scheduler.adapt(True, changes=3) == 60
+    assert scheduler.adapt(True, changes=0) == 90
+    assert scheduler.adapt("Failed to refresh issues", changes=0) == 180
+    assert scheduler.adapt("Failed to refresh issues", changes=0) == 360
+    assert scheduler.adapt("Failed to refresh issues", changes=0) == 400
+
+
+def test_pause_without_clients() -> None:
+    """No refresh is done while no client is connected"""
+    scheduler = RefreshScheduler(interval=0, min_interval=0, max_interval=0)
+    clients = iter([False, False])
+    results: list[str | Literal[True]] = ["failed", True]
+
+    async def refresh() -> RefreshResult:
+        return RefreshResult(results.pop(0), Counter(["new"]))
+
+    async def run() -> None:
+        task = asyncio.create_task(scheduler.run(refresh, lambda: next(clients, True)))
+        while results:
+            await asyncio.sleep(0)
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+    with mock.patch.object(RefreshScheduler, "poll_interval", 0):
+        asyncio.run(run())
+    assert next(clients, None) is None
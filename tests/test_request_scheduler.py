@@ -0,0 +1,84 @@
+import threading
+import time
+from unittest import mock
+
+from gitlab_personal_issue_board.request_scheduler import RequestScheduler
+
+
+def test_retry_delay() -> None:
+    """Only rate limited and failed responses are retried, with backoff"""
+    scheduler = RequestScheduler(max_retries=2, backoff=1, max_backoff=3)
+
+    assert scheduler.retry_delay("GET", 0, 404, {}) is None
+    assert 0.5 <= (scheduler.retry_delay("GET", 0, 503, {}) or 0) <= 1
+    assert 1 <= (scheduler.retry_delay("PUT", 1, 502, {}) or 0) <= 2
+    assert scheduler.retry_delay("GET", 2, 503, {}) is None
+    assert scheduler.retry_delay("GET", 0, 429, {"Retry-After": "30"}) == 30
+    assert scheduler.stats().retried == 3
+
+
+def test_retry_only_idempotent_requests() -> None:
+    """Failed POSTs could have been applied, only rate limited ones are retried"""
+    scheduler = RequestScheduler(backoff=1)
+
+    assert scheduler.retry_delay("POST", 0, 503, {}) is None
+    assert scheduler.retry_delay("POST", 0, 429, {"Retry-After": "2"}) == 2
+
+
+def test_rate_limit_throttles() -> None:
+    """Requests are spread once the rate limit is almost used up"""
+    scheduler = RequestScheduler(reserve=0.1)
+    with mock.patch("time.time", return_value=1000):
+        scheduler.record(
+            200,
+            {
+                "RateLimit-Limit": "100",
+                "RateLimit-Remaining": "50",
+                "RateLimit-Reset": "1060",
+            },
+        )
+    assert scheduler._try_start() == 0
+    assert scheduler._try_start() == 0
+    with mock.patch("time.time", return_value=1000):
+        scheduler.record(
+            200,
+            {
+                "RateLimit-Limit": "100",
+                "RateLimit-Remaining": "6",
+                "RateLimit-Reset": "1060",
+            },
+        )
+    # 60 seconds left for 6 requests
+    assert 9 < scheduler._try_start() <= 10
+
+    scheduler.record(429, {"Retry-After": "120"})
+    assert scheduler.stats().remaining == 0
+    assert scheduler._try_start() > 100
+
+
+def test_slot_limits_connections() -> None:
+    """At most max_connections requests are sent at once, others are queued"""
+    scheduler = RequestScheduler(max_connections=1)
+    started = threading.Event()
+    release = threading.Event()
+
+    def request() -> None:
+        with scheduler.slot():
+            started.set()
+            release.wait()
+
+    first = threading.Thread(target=request)
+    first.start()
+    started.wait()
+    second = threading.Thread(target=request)
+    second.start()
+    time.sleep(0.1)
+    stats = scheduler.stats()
+    assert (stats.in_flight, stats.queued) == (1, 1)
+
+    release.set()
+    first.join()
+    second.join()
+    stats = scheduler.stats()
+    assert (stats.in_flight, stats.queued, stats.sent) == (0, 0, 2)
+    assert stats.max_wait > 0
@@ -0,0 +1,37 @@
+from datetime import UTC, datetime
+from pathlib import Path
+
+from gitlab_personal_issue_board import sync_state
+
+
+def test_last_refresh_per_instance_and_user(cache_dir: Path) -> None:
+    """The last refresh is persisted for each instance and user"""
+    first = datetime(2025, 1, 2, 3, 4, tzinfo=UTC)
+    second = datetime(2025, 2, 3, 4, 5, tzinfo=UTC)
+
+    sync_state.set_last_refresh("https://gitlab.com", "me", first)
+    sync_state.set_last_refresh("https://gitlab.com", "other", second)
+    sync_state.set_last_refresh("https://gitlab.local", "me", second)
+
+    assert sync_state.get_last_refresh("https://gitlab.com", "me") == first
+    assert sync_state.get_last_refresh("https://gitlab.com", "other") == second
+    assert sync_state.get_last_refresh("https://gitlab.local", "me") == second
+    assert sync_state.get_last_refresh("https://gitlab.local", "other") is None
+
+
+def test_invalid_sync_state_is_ignored(cache_dir: Path) -> None:
+    """A corrupt sync state file leads to a full refresh"""
+    (cache_dir / sync_state.FILE_NAME).write_text("{not json")
+
+    assert sync_state.get_last_refresh("https://gitlab.com", "me") is None
+
+
+def test_namespaces_in_order_seen(cache_dir: Path) -> None:
+    """The first instance keeps the ids of gitlab, the others get new namespaces"""
+    started = datetime(2025, 1, 2, 3, 4, tzinfo=UTC)
+    sync_state.set_last_refresh("https://gitlab.com", "me", started)
+
+    assert sync_state.get_namespace("https://gitlab.com") == 0
+    assert sync_state.get_namespace("https://gitlab.local") == 1
+    assert sync_state.get_namespace("https://gitlab.com") == 0
+    assert sync_state.get_last_refresh("https://gitlab.com", "me") == started
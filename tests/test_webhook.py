@@ -0,0 +1,128 @@
+from datetime import UTC, datetime
+from typing import Any
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from gitlab_personal_issue_board import gitlab, models, webhook
+
+from .conftest import FAKE_USER, gen_issue_data
+
+SECRET = "webhook-secret"  # noqa: S105
+
+
+def issue_hook(labels: list[dict[str, Any]], assigned: bool = True) -> dict[str, Any]:
+    """An issue hook payload as posted by gitlab, shortened to the used fields"""
+    return {
+        "object_kind": "issue",
+        "event_type": "issue",
+        "user": {"id": 2, "name": "Other", "username": "other", "avatar_url": ""},
+        "project": {"id": 123, "path_with_namespace": "fake/project"},
+        "object_attributes": {
+            "id": 1,
+            "iid": 1,
+            "title": "An Issue",
+            "description": "Issue Description",
+            "state": "opened",
+            "project_id": 123,
+            "created_at": "2024-12-12 03:12:00 UTC",
+            "updated_at": "2024-12-13 08:00:00 UTC",
+            "due_date": None,
+            "url": "https://gitlab.fake.example/fake/project/-/issues/1",
+            "action": "update",
+        },
+        "labels": labels,
+        "assignees": [FAKE_USER.model_dump()] if assigned else [],
+    }
+
+
+BAR = {
+    "id": 7,
+    "title": "bar",
+    "color": "#FFFFFF",
+    "project_id": 123,
+    "description": None,
+    "type": "ProjectLabel",
+    "group_id": None,
+}
+
+
+@pytest.fixture
+def client(issues: gitlab.Issues) -> TestClient:
+    app = FastAPI()
+    webhook.register(app, issues, SECRET)
+    return TestClient(app)
+
+
+def test_issue_hook_updates(client: TestClient, issues: gitlab.Issues) -> None:
+    """Pushed changes are applied to the cache"""
+    response = client.post(
+        webhook.WEBHOOK_PATH,
+        json=issue_hook([BAR]),
+        headers={webhook.TOKEN_HEADER: SECRET},
+    )
+
+    assert response.json() == {"outcome": "changed"}
+    issue = issues[models.IssueID(1)]
+    assert issue.labels == (
+        models.Label(name="bar", color="#FFFFFF", text_color="#1F1E24"),
+    )
+    assert issue.references.full == "fake/project#1"
+
+
+def test_issue_hook_then_refresh(client: TestClient, issues: gitlab.Issues) -> None:
+    """A pushed issue equals the one listed by the next refresh"""
+    foo = {**BAR, "title": "foo", "color": "white"}
+    hook = issue_hook([foo])
+    del hook["assignees"][0]["id"]
+    response = client.post(
+        webhook.WEBHOOK_PATH, json=hook, headers={webhook.TOKEN_HEADER: SECRET}
+    )
+    assert response.json() == {"outcome": "changed"}
+
+    listed = gen_issue_data(
+        1, labels=["foo"], updated_at=datetime(2024, 12, 13, 8, tzinfo=UTC)
+    ) | {
+        "references": {"short": "#1", "full": "fake/project#1"},
+        "web_url": hook["object_attributes"]["url"],
+    }
+    assert issues._cache.update(listed, remove=lambda _: False) == "unchanged"
+
+
+@pytest.mark.parametrize(
+    ("color", "text_color"),
+    [
+        ("#fff", "#1F1E24"),
+        ("#FFFFFF", "#1F1E24"),
+        ("#428BCA", "#FFFFFF"),
+        ("red", "#FFFFFF"),
+    ],
+)
+def test_label_text_color(color: str, text_color: str) -> None:
+    """Labels not known yet get the text color gitlab would show"""
+    assert models.label_text_color(color) == text_color
+
+
+def test_issue_hook_unassigned(client: TestClient, issues: gitlab.Issues) -> None:
+    """Issues no longer assigned to me are removed"""
+    response = client.post(
+        webhook.WEBHOOK_PATH,
+        json=issue_hook([], assigned=False),
+        headers={webhook.TOKEN_HEADER: SECRET},
+    )
+
+    assert response.json() == {"outcome": "removed"}
+    assert len(issues) == 0
+
+
+def test_issue_hook_token(client: TestClient, issues: gitlab.Issues) -> None:
+    """Payloads without the secret token are rejected"""
+    response = client.post(
+        webhook.WEBHOOK_PATH,
+        json=issue_hook([BAR]),
+        headers={webhook.TOKEN_HEADER: "wrong"},
+    )
+
+    assert response.status_code == 401
+    assert [label.name for label in issues[models.IssueID(1)].labels] == ["foo"]